@@ -6,21 +6,42 @@
 # - K5X (NY + utbyggd): Global balans innan K6 – kan nu ta bort på BOKF-sidan (Steg 1/2)
 #   OCH på BANK-sidan (Steg 1B/2B) för att hantera fall som –2 218,71-exemplet.
 # - “Ny källa”:
-#     Bank: Match / Kundreskontra (BG53782751...) / Leverantörsreskontra (LB...) / Manuell
-#     Bokföring: Match annars originalvärde i kolumn "Källa"
+#     Bank: Match / Kandidat / Kundreskontra (BG53782751...) / Leverantörsreskontra (LB...) / Manuell
+#     Bokföring: Match / Kandidat annars originalvärde i kolumn "Källa"
+#   Kandidat (bara med K6_CANDIDATES) = K6-grupp med fler än 3 motdagar (K6K) – granskas manuellt
 # - Kombinerad först i arbetsboken, filter på rad 4, format:
 #     C2, E2, G2, N2 + kolumn N: "#,##0.00"; kolumn K: "yyyy-mm-dd"
 # - Dialoger: "Välj kontoutdraget" och "Välj bokföringslistan". "Spara som" alltid.
+# - Inkrementellt (MatchState): månad-till-datum-filer körs bara om för nya/ändrade dagar.
 
 import re
-import math
-import itertools
+import csv
+import bisect
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
 import warnings
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from copy import copy
+from functools import partial
 from pathlib import Path
+import numpy as np
 import pandas as pd
-from openpyxl.styles import PatternFill, Border, Side, Alignment
+from openpyxl.styles import PatternFill, Border, Side, Alignment, Font
 from openpyxl.utils import get_column_letter
-from openpyxl import load_workbook
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import ERROR_CODES
+try:
+    from pandas.tseries.api import guess_datetime_format
+except ImportError:  # pandas < 2.2
+    guess_datetime_format = lambda v: None
 
 warnings.filterwarnings("ignore", category=UserWarning, module=r"openpyxl\.styles\.stylesheet")
 
@@ -90,6 +111,213 @@ def ask_save_as_dialog(default_name="output_avstamning.xlsx", initialdir=None):
     except Exception:
         return None
 
+# ============================ Körstatistik ============================
+# Aktiv RunMetrics per tråd (se RunMetrics.active); ingen = instrumenteringen är av
+_metrics = threading.local()
+
+def _active_metrics():
+    return getattr(_metrics, "run", None)
+
+class RunMetrics:
+    """
+    Körstatistik för en avstämning:
+      - counts: träffar per steg i K1/K2/K5/K5X-stegarna, find_removal-anrop/-uppslag,
+        K6-försök, subset_sum_large-utfall …
+      - observations: storlekar (t.ex. MITM-halvornas tabeller) som antal/summa/max
+      - phases/stages: väggtid, CPU-tid (+ toppminne med memory=True) per fas och K-steg
+    Samlar bara inom `with metrics.active():` (i den tråden); utanför kostar varje mätpunkt en None-koll.
+    memory=True mäter toppminne per fas/steg med tracemalloc (som i sig gör körningen långsammare).
+    """
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.counts, self.observations = {}, {}
+        self.phases, self.stages = [], []
+
+    def count(self, key, n=1):
+        self.counts[key] = self.counts.get(key, 0) + n
+
+    def observe(self, key, value, n=1, total=None):
+        o = self.observations.setdefault(key, [0, 0, value])
+        o[0] += n; o[1] += value if total is None else total; o[2] = max(o[2], value)
+
+    def gave_up(self) -> int:
+        # Uppgivna stordagssökningar i K5X (båda sidor): de dagarna kan ha en match som inte hittades
+        return sum(n for k, n in self.counts.items() if k.startswith("K5X.gav_upp."))
+
+    def merge(self, counts, observations):
+        # Räknare från en poolprocess (se run_days)
+        for k, n in counts.items(): self.count(k, n)
+        for k, (n, total, mx) in observations.items(): self.observe(k, mx, n, total)
+
+    @contextmanager
+    def active(self):
+        prev = _active_metrics()
+        _metrics.run = self
+        started = self.memory and not tracemalloc.is_tracing()
+        if started: tracemalloc.start()
+        try:
+            yield self
+        finally:
+            if started: tracemalloc.stop()
+            _metrics.run = prev
+
+    def start_peak(self):
+        if self.memory and tracemalloc.is_tracing(): tracemalloc.reset_peak()
+
+    def peak_mb(self):
+        if not (self.memory and tracemalloc.is_tracing()): return None
+        return round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+
+    @contextmanager
+    def phase(self, name):
+        self.start_peak()
+        t0, c0 = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.phases.append({"phase": name, "wall_s": time.perf_counter() - t0,
+                                "cpu_s": time.process_time() - c0, "peak_mb": self.peak_mb()})
+
+    def report(self) -> dict:
+        return {
+            "phases": self.phases,
+            "stages": self.stages,
+            "counts": dict(sorted(self.counts.items())),
+            "observations": {k: {"antal": n, "summa": total, "max": mx}
+                             for k, (n, total, mx) in sorted(self.observations.items())},
+            "maxrss_mb": _maxrss_mb(),
+        }
+
+    def to_json(self, path=None) -> str:
+        text = json.dumps(self.report(), ensure_ascii=False, indent=2,
+                          default=lambda o: o.item() if hasattr(o, "item") else str(o))
+        if path is not None:
+            Path(path).write_text(text, encoding="utf-8")
+        return text
+
+    def frame(self) -> pd.DataFrame:
+        # Långt format (Del, Nyckel, Värde) för fliken "Körstatistik"
+        rows = []
+        for ph in self.phases:
+            rows += [("Fas", f"{ph['phase']}.{k}", v) for k, v in ph.items() if k != "phase" and v is not None]
+        for st in self.stages:
+            rows += [("K-steg", f"{st['stage']}.{k}", v) for k, v in st.items() if k != "stage" and v is not None]
+        rows += [("Räknare", k, v) for k, v in sorted(self.counts.items())]
+        for k, (n, total, mx) in sorted(self.observations.items()):
+            rows += [("Storlek", f"{k}.antal", n), ("Storlek", f"{k}.medel", total / n if n else 0),
+                     ("Storlek", f"{k}.max", mx)]
+        return pd.DataFrame(rows, columns=["Del", "Nyckel", "Värde"])
+
+def _maxrss_mb():
+    # Processens högsta RSS hittills (Unix); None där resource saknas
+    try:
+        import resource, sys
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+def metric(key, n=1):
+    m = _active_metrics()
+    if m is not None: m.count(key, n)
+
+def observe(key, value):
+    m = _active_metrics()
+    if m is not None: m.observe(key, value)
+
+def phase(name):
+    # Mätning av en fas (inläsning, export …) i aktiv RunMetrics; annars ingenting
+    m = _active_metrics()
+    return m.phase(name) if m is not None else nullcontext()
+
+# ============================== Förlopp ==============================
+# Aktiv RunProgress per tråd: Streamlit kör flera sessioners jobb i trådar i samma process
+_progress = threading.local()
+
+class RunCancelled(Exception):
+    """Körningen avbröts via RunProgress.cancel()."""
+
+class RunProgress:
+    """
+    Förlopp för en körning, skrivs av körtråden och läses från en annan (t.ex. Streamlit):
+      - steps/step: planerade steg (K-stegen, ev. "Kombinerad"/"Excel") och det som pågår
+      - days_done/days_total: dagar klara i det dagsvisa steget (0/0 för steg utan dagar)
+      - bank_matched/bokf_matched: matchade rader hittills
+    cancel() begär avbrott: körningen kastar RunCancelled vid nästa steg eller dag.
+    on_update(snapshot) anropas (i körtråden) vid varje ändring.
+    """
+    def __init__(self, on_update=None):
+        self.on_update = on_update
+        self.steps, self.step = [], None
+        self.days_done = self.days_total = 0
+        self.bank_matched = self.bokf_matched = 0
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def check(self):
+        if self.cancelled: raise RunCancelled(f"Avbruten under {self.step}")
+
+    def plan(self, steps):
+        with self._lock: self.steps = list(steps)
+
+    def start(self, step):
+        self.check()
+        with self._lock:
+            if step not in self.steps: self.steps.append(step)
+            self.step, self.days_done, self.days_total = step, 0, 0
+        self._notify()
+
+    def days(self, total):
+        with self._lock: self.days_done, self.days_total = 0, int(total)
+        self._notify()
+
+    def tick(self, n=1):
+        self.check()
+        with self._lock: self.days_done += n
+        self._notify()
+
+    def matched(self, bank_rows, bokf_rows):
+        with self._lock: self.bank_matched += bank_rows; self.bokf_matched += bokf_rows
+        self._notify()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            i = self.steps.index(self.step) if self.step in self.steps else 0
+            part = self.days_done / self.days_total if self.days_total else 0.0
+            return {"step": self.step, "step_no": i + 1, "steps": len(self.steps),
+                    "days_done": self.days_done, "days_total": self.days_total,
+                    "bank_matched": self.bank_matched, "bokf_matched": self.bokf_matched,
+                    "fraction": (i + part) / len(self.steps) if self.steps else 0.0}
+
+    def _notify(self):
+        if self.on_update is not None: self.on_update(self.snapshot())
+
+    @contextmanager
+    def active(self):
+        # Gör förloppet aktivt i den här tråden (progress_days/progress_tick rapporterar hit)
+        prev = getattr(_progress, "run", None)
+        _progress.run = self
+        try:
+            yield self
+        finally:
+            _progress.run = prev
+
+def progress_days(total):
+    run = getattr(_progress, "run", None)
+    if run is not None: run.days(total)
+
+def progress_tick(n=1):
+    # En dag klar i det aktiva steget; här kontrolleras också avbrott
+    run = getattr(_progress, "run", None)
+    if run is not None: run.tick(n)
+
 # ============================ Hjälpfunktioner ============================
 def _to_float(series: pd.Series) -> pd.Series:
     s = (series.astype(str)
@@ -98,66 +326,575 @@ def _to_float(series: pd.Series) -> pd.Series:
          .str.replace(",", ".", regex=False))
     return pd.to_numeric(s, errors="coerce")
 
+MAX_WHOLE_DIGITS = 15  # längre heltalsdel räknas som ogiltigt belopp (öresummor ryms då i int64)
+
+def _to_cents(series: pd.Series):
+    # Svenskt formaterat belopp ("-1 234,56") -> (öre som int64, giltig-mask), utan float.
+    # Tredje decimalen avrundas uppåt från 5; övriga format (t.ex. "1e-05") går via _to_float.
+    s = (series.astype(str)
+         .str.replace(" ", "", regex=False)
+         .str.replace("\u00a0", "", regex=False))
+    m = s.str.extract(r"^([+-]?)(\d*)(?:[.,](\d*))?$")
+    too_long = m[1].fillna("").str.lstrip("0").str.len().gt(MAX_WHOLE_DIGITS).to_numpy(dtype=bool, copy=True)
+    ok = m[1].notna() & ((m[1] != "") | m[2].fillna("").ne("")) & ~too_long
+    whole = m[1].where(ok & (m[1] != ""), "0").astype(np.int64)
+    frac = m[2].where(ok, "").fillna("").str.ljust(3, "0")
+    cents = whole * 100 + frac.str[:2].astype(np.int64) + (frac.str[2] >= "5").astype(np.int64)
+    # copy=True: to_numpy kan ge en skrivskyddad vy (copy-on-write i pandas ≥ 3), och arrayerna skrivs i nedan
+    cents = cents.where(m[0] != "-", -cents).to_numpy(dtype=np.int64, copy=True)
+    ok = ok.to_numpy(dtype=bool, copy=True)
+    if not ok.all():
+        f = _to_float(series[~ok]).to_numpy(dtype=float)
+        fin = np.isfinite(f) & (np.abs(f) < 10.0 ** MAX_WHOLE_DIGITS) & ~too_long[~ok]
+        rest = np.zeros(len(f), dtype=np.int64)
+        rest[fin] = np.round(f[fin] * 100).astype(np.int64)
+        cents[~ok] = rest
+        ok[~ok] = fin
+    cents[~ok] = 0
+    return cents, ok
+
+def _cents_to_float(cents: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    return np.where(valid, cents / 100, np.nan)
+
+NO_DAY = np.iinfo(np.int64).min  # dagsordinal för saknat datum (NaT)
+
+def day_ordinal(dates: pd.Series) -> np.ndarray:
+    # Datum -> heltal (dagar sedan 1970-01-01), NaT -> NO_DAY
+    return dates.to_numpy(dtype="datetime64[ns]").astype("datetime64[D]").astype(np.int64)
+
+def ordinal_to_date(day):
+    return pd.Timestamp(int(day), unit="D").date()
+
 def _strip_df(df: pd.DataFrame) -> pd.DataFrame:
     for c in df.columns:
         if pd.api.types.is_string_dtype(df[c]):
             df[c] = df[c].astype(str).str.strip()
     return df
 
-def load_bank(path: str) -> pd.DataFrame:
-    p = Path(path)
-    if p.suffix.lower() in [".xlsx",".xls"]:
-        df = pd.read_excel(p, header=BANK_HEADER_ROW, dtype=str)
+CSV_ENGINE = "c"  # "pyarrow" går också om paketet är installerat
+
+def _source(src):
+    # Sökväg, bytes eller filobjekt (t.ex. Streamlits UploadedFile) -> (Path | bytes, ändelse).
+    # Buffertar läses direkt ur minnet; ändelsen tas från .name eller gissas från innehållet.
+    if isinstance(src, (str, os.PathLike)):
+        p = Path(src)
+        return p, p.suffix.lower()
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        data = bytes(src)
     else:
-        df = pd.read_csv(p, skiprows=BANK_HEADER_ROW, dtype=str, sep=None, engine="python")
+        data = src.getvalue() if hasattr(src, "getvalue") else src.read()
+        if isinstance(data, str):  # textläge (open(path), StringIO): läsarna tolkar CSV som UTF-8
+            data = data.encode("utf-8")
+    name = getattr(src, "name", None)
+    suffix = Path(name).suffix.lower() if isinstance(name, str) else ""
+    if suffix not in (".csv", ".txt", ".xlsx", ".xls"):
+        suffix = {b"PK\x03\x04": ".xlsx", b"\xd0\xcf\x11\xe0": ".xls"}.get(data[:4], ".csv")
+    return data, suffix
+
+def _buffer(data):
+    # Path går rakt in i läsarna; bytes via en BytesIO (delar bytes-objektet, ingen kopia)
+    return data if isinstance(data, Path) else io.BytesIO(data)
+
+def _read_csv(data, skiprows: int, cols) -> pd.DataFrame:
+    # Avgränsaren gissas EN gång från rubrikraden (samma rad som sep=None/python-motorn
+    # sniffar), sedan läser den snabba motorn bara de kolumner vi använder.
+    try:
+        with (open(data, encoding="utf-8", newline="") if isinstance(data, Path)
+              else io.TextIOWrapper(io.BytesIO(data), encoding="utf-8", newline="")) as fh:
+            for _ in range(skiprows): fh.readline()
+            header = fh.readline()
+        sep = csv.Sniffer().sniff(header).delimiter
+    except (csv.Error, UnicodeDecodeError):
+        return pd.read_csv(_buffer(data), skiprows=skiprows, dtype=str, sep=None, engine="python")
+    names = next(csv.reader([header], delimiter=sep), [])
+    wanted = set(cols)
+    usecols = [c for c in names if c in wanted]
+    return pd.read_csv(_buffer(data), skiprows=skiprows, dtype=str, sep=sep, engine=CSV_ENGINE, usecols=usecols)
+
+XLSX_ENGINE = "stream"  # "stream" (strömmande läsare nedan) | "openpyxl" | "calamine" (via pd.read_excel)
+
+# Texter som read_excel (na_values) tolkar som saknat värde
+_NA_STRINGS = {"", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND",
+               "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"}
+
+def _xlsx_cell(v):
+    # Cellvärde -> samma sträng som read_excel(dtype=str) ger; tomt/felkod/NA-text -> NaN
+    if v is None: return np.nan
+    if isinstance(v, str): return np.nan if v in _NA_STRINGS or v in ERROR_CODES else v
+    if isinstance(v, float) and v.is_integer(): return str(int(v))
+    return str(v)
+
+def _blank_row(row) -> bool:
+    return all(v is None or v == "" for v in row)
+
+def _read_xlsx(data, suffix: str, header_row: int, cols) -> pd.DataFrame:
+    # Första bladet, rubrik på rad header_row (0-baserat). "stream": openpyxl read_only, raderna
+    # strömmas och bara våra kolumner sparas (kolumnvisa listor) – resten av cellerna lämnas direkt.
+    wanted = set(cols)
+    if XLSX_ENGINE != "stream" or suffix != ".xlsx":
+        engine = XLSX_ENGINE if XLSX_ENGINE != "stream" and suffix == ".xlsx" else None
+        return pd.read_excel(_buffer(data), header=header_row, dtype=str, engine=engine, usecols=lambda c: c in wanted)
+    wb = load_workbook(_buffer(data), read_only=True, data_only=True, keep_links=False)
+    try:
+        ws = wb.worksheets[0]
+        ws.reset_dimensions()  # lita inte på filens <dimension>, precis som pandas
+        rows = ws.iter_rows(values_only=True)
+        for _ in range(header_row): next(rows, None)
+        pos = {}
+        for i, v in enumerate(next(rows, ())):
+            if isinstance(v, str) and v in wanted and v not in pos: pos[v] = i
+        data = {c: [] for c in pos}
+        blank = 0  # tomma rader sedan senaste datarad: som read_excel behålls de inne i dataområdet
+        for row in rows:  # (NaN-rader, så att BankRowID/BokfRowID stämmer) och kapas bara i slutet
+            if _blank_row(row):
+                blank += 1; continue
+            for c in pos: data[c].extend([np.nan] * blank)
+            blank = 0
+            n = len(row)
+            for c, i in pos.items():
+                data[c].append(_xlsx_cell(row[i]) if i < n else np.nan)
+    finally:
+        wb.close()
+    return pd.DataFrame(data, dtype=object)
+
+def _to_datetime(series: pd.Series) -> pd.Series:
+    # Explicit format i stället för inferens: gissat från filens eget första icke-tomma värde,
+    # precis som pandas själv gör (inget delat tillstånd mellan filer); inget format -> gamla vägen.
+    first = series.dropna()
+    first = first[first != ""]
+    fmt = guess_datetime_format(first.iloc[0]) if not first.empty else None
+    if fmt is None:
+        return pd.to_datetime(series, errors="coerce")
+    return pd.to_datetime(series, format=fmt, errors="coerce")
+
+def load_bank(src, cache: bool = False) -> pd.DataFrame:
+    # src: sökväg, bytes eller filobjekt (se _source); cache=True (uttryckligen, t.ex. batch --cache):
+    # färdig ram hämtas från/sparas i INPUT_CACHE_DIR (se InputCache)
+    data, suffix = _source(src)
+    if cache and INPUT_CACHE_DIR is not None:
+        return InputCache(INPUT_CACHE_DIR).load("bank", data, suffix, _load_bank)
+    return _load_bank(data, suffix)
+
+def _load_bank(data, suffix: str) -> pd.DataFrame:
+    if suffix in [".xlsx",".xls"]:
+        df = _read_xlsx(data, suffix, BANK_HEADER_ROW, BANK_COLS)
+    else:
+        df = _read_csv(data, BANK_HEADER_ROW, BANK_COLS)
     for col in ["Bokföringsdatum","Text","Belopp"]:
         if col not in df.columns:
             raise ValueError(f"Bankfilen saknar kolumnen: '{col}'")
     df = _strip_df(df)
-    df["Bokföringsdatum"] = pd.to_datetime(df["Bokföringsdatum"], errors="coerce")
-    df["Belopp"] = _to_float(df["Belopp"])
+    df["Bokföringsdatum"] = _to_datetime(df["Bokföringsdatum"])
+    df["__Öre__"], giltig = _to_cents(df["Belopp"])
+    df["Belopp"] = _cents_to_float(df["__Öre__"].to_numpy(), giltig)
     df = df.reset_index(drop=False).rename(columns={"index":"BankRowID"})
+    df["__Dag__"] = day_ordinal(df["Bokföringsdatum"])
+    df["__Textklass__"] = classify_bank_text(df["Text"])
     return df
 
-def load_bokf(path: str) -> pd.DataFrame:
-    p = Path(path)
-    if p.suffix.lower() in [".xlsx",".xls"]:
-        df = pd.read_excel(p, header=BOKF_HEADER_ROW, dtype=str)
+def load_bokf(src, cache: bool = False) -> pd.DataFrame:
+    data, suffix = _source(src)
+    if cache and INPUT_CACHE_DIR is not None:
+        return InputCache(INPUT_CACHE_DIR).load("bokf", data, suffix, _load_bokf)
+    return _load_bokf(data, suffix)
+
+def _load_bokf(data, suffix: str) -> pd.DataFrame:
+    if suffix in [".xlsx",".xls"]:
+        df = _read_xlsx(data, suffix, BOKF_HEADER_ROW, BOKF_COLS)
     else:
-        df = pd.read_csv(p, skiprows=BOKF_HEADER_ROW, dtype=str, sep=None, engine="python")
+        df = _read_csv(data, BOKF_HEADER_ROW, BOKF_COLS)
     for col in ["Datum","IB Året SEK","Period SEK","Text1","Verifikationsnummer","Kategori"]:
         if col not in df.columns:
             raise ValueError(f"Bokföringsfilen saknar kolumnen: '{col}'")
     df = _strip_df(df)
     # Ta bort allt där IB Året SEK inte är helt tomt
     df = df[df["IB Året SEK"].isna() | (df["IB Året SEK"] == "")].copy()
-    df["Datum"] = pd.to_datetime(df["Datum"], errors="coerce")
-    df["Period SEK"] = _to_float(df["Period SEK"])
+    df["Datum"] = _to_datetime(df["Datum"])
+    df["__Öre__"], giltig = _to_cents(df["Period SEK"])
+    df["Period SEK"] = _cents_to_float(df["__Öre__"].to_numpy(), giltig)
     df = df.reset_index(drop=False).rename(columns={"index":"BokfRowID"})
+    df["__Dag__"] = day_ordinal(df["Datum"])
+    df[LEDGER_FEATURES] = ledger_features(df)
     return df
 
-def sek_round(x): return round(float(x), 2) if pd.notna(x) else x
-def sum_sek(s): return sek_round(s.fillna(0).sum())
-def startswith_seb(v): return isinstance(v,str) and v.upper().startswith("SEB")
+# ======================== Banktextklasser ========================
+# Flaggor i "__Textklass__" (sätts av load_bank). Mönstren överlappar (en LB-text kan ha en
+# 35-referens), så klassen är en bitmask och varje K-steg testar sin egen flagga.
+TEXT_BG5378  = 1   # innehåller BG53782751            (K1; K4 exkluderar)
+TEXT_BG5341  = 2   # innehåller BG 5341-7689          (K2; K4 exkluderar)
+TEXT_REF35   = 4   # innehåller 35 + 10 siffror       (K3; K4 exkluderar)
+TEXT_LB      = 8   # börjar med LB                    (K5; "Leverantörsreskontra")
+TEXT_KUND    = 16  # börjar med BG53782751            ("Kundreskontra")
+_TEXT_PATTERNS = [  # (flagga, förkompilerat mönster, måste matcha från början)
+    (TEXT_BG5378, re.compile(r"BG53782751", re.I), False),
+    (TEXT_BG5341, re.compile(r"BG\s*5341-7689", re.I), False),
+    (TEXT_REF35,  re.compile(r"35\d{10}"), False),
+    (TEXT_LB,     re.compile(r"\s*LB", re.I), True),
+    (TEXT_KUND,   re.compile(r"\s*BG53782751", re.I), True),
+]
+
+def classify_bank_text(text: pd.Series) -> np.ndarray:
+    # EN klassning per unik text (kontoutdrag upprepar samma texter), spridd till raderna som uint8
+    codes, uniques = pd.factorize(text.astype(str))
+    u = pd.Series(uniques, dtype=object)
+    flags = np.zeros(len(u), dtype=np.uint8)
+    for flag, pat, anchored in _TEXT_PATTERNS:
+        hit = u.str.match(pat) if anchored else u.str.contains(pat)
+        flags[hit.to_numpy(dtype=bool)] |= flag
+    return flags[codes]
+
+def text_class(bank_df: pd.DataFrame, flags: int) -> np.ndarray:
+    # Bool-mask: raden har någon av flaggorna; ramar som inte kommer från load_bank klassas här
+    if "__Textklass__" in bank_df.columns: cls = bank_df["__Textklass__"].to_numpy()
+    elif "Text" in bank_df.columns: cls = classify_bank_text(bank_df["Text"])
+    else: return np.zeros(len(bank_df), dtype=bool)
+    return (cls & flags) != 0
+
+# ======================== Bokföringsegenskaper ========================
+# Flaggor i "__Bokfklass__" (sätts av load_bokf, se ledger_features)
+BOKF_SEB           = 1  # Verifikationsnummer börjar med SEB, skiftlägesokänsligt   (K1)
+BOKF_VNR6          = 2  # Verifikationsnummer är exakt 6 siffror                     (K2 steg 12–15)
+BOKF_SKABANK_VNR   = 4  # "Skabank" i Verifikationsnummer                            (K1 steg 6–8, K2 steg 8–15)
+BOKF_SKABANK_TEXT1 = 8  # "Skabank" i Text1                                          (K2 steg 4–15)
+LEDGER_FEATURES = ["__Bokfklass__", "__YyVnr__", "__YyText1__"]
+_YYMMDD = re.compile(r"(?=([0-9]{6}))")  # alla 6-siffriga följder, även överlappande
+
+def ledger_features(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Strängegenskaper för bokföringsraderna, vektoriserat EN gång:
+      __Bokfklass__: BOKF_*-flaggor (uint8)
+      __YyVnr__/__YyText1__: alla 6-siffriga följder i Verifikationsnummer/Text1 (mellanslagsseparerade)
+        för rader med "Skabank" i samma kolumn, annars "". "Skabank" + <yymmdd> någonstans i texten
+        blir då ett uppslag i DayIndex.token_labels i stället för en deltextsökning per rad.
+    Icke-strängar (saknat värde) ger inga flaggor och inga token.
+    """
+    col = lambda c: (df[c] if c in df.columns else pd.Series(np.nan, index=df.index)).astype(object)
+    vnr, text1 = col("Verifikationsnummer"), col("Text1")
+    skabank_vnr = vnr.str.contains("Skabank", regex=False).eq(True).to_numpy()
+    skabank_text1 = text1.str.contains("Skabank", regex=False).eq(True).to_numpy()
+    cls = (BOKF_SEB * vnr.str.upper().str.startswith("SEB").eq(True).to_numpy()
+           | BOKF_VNR6 * ((vnr.str.len() == 6) & vnr.str.isdigit().eq(True)).to_numpy()
+           | BOKF_SKABANK_VNR * skabank_vnr | BOKF_SKABANK_TEXT1 * skabank_text1)
+
+    def tokens(s, gate):
+        out = pd.Series("", index=df.index, dtype=object)
+        if gate.any(): out[gate] = s[gate].str.findall(_YYMMDD).str.join(" ")
+        return out
+
+    return pd.DataFrame({"__Bokfklass__": cls.astype(np.uint8),
+                         "__YyVnr__": tokens(vnr, skabank_vnr),
+                         "__YyText1__": tokens(text1, skabank_text1)}, index=df.index)
+
+def ledger_class(bokf_df: pd.DataFrame, flags: int) -> np.ndarray:
+    # Bool-mask: raden har någon av flaggorna; ramar som inte kommer från load_bokf beräknas här
+    cls = (bokf_df["__Bokfklass__"] if "__Bokfklass__" in bokf_df.columns
+           else ledger_features(bokf_df)["__Bokfklass__"]).to_numpy()
+    return (cls & flags) != 0
+
+# ============================ Indatacache ============================
+LOADER_VERSION = 5  # höj när load_bank/load_bokf ger andra ramar än förut – gamla poster används då inte
+INPUT_CACHE_DIR = Path.home() / ".cache" / "avstamning"  # används bara med cache=True; None = aldrig
+INPUT_CACHE_MAX_MB = 1024
+
+_MODULE_DIGEST = []
+
+def _loader_settings() -> bytes:
+    # Allt utöver filens bytes som avgör den inlästa ramen; modulfilen hashas en gång per process
+    if not _MODULE_DIGEST:
+        try:
+            _MODULE_DIGEST.append(hashlib.blake2b(Path(__file__).read_bytes(), digest_size=16).hexdigest())
+        except OSError:
+            _MODULE_DIGEST.append("")
+    return "|".join([CSV_ENGINE, XLSX_ENGINE, pd.__version__, _MODULE_DIGEST[0]]).encode()
+
+class InputCache:
+    """
+    Innehållsadresserad cache för inlästa filer (load_bank/load_bokf):
+      - nyckel = filtyp + LOADER_VERSION + ändelse + blake2b av filens bytes (namn och plats spelar ingen roll,
+        samma uppladdning i minnet och samma fil på disk ger samma post) och av inläsningsinställningarna
+        (_loader_settings: CSV_ENGINE, XLSX_ENGINE, pandas-version, modulfilens innehåll)
+      - värde = den normaliserade ramen som pandas-pickle: kolumnblock som läses tillbaka utan tolkning,
+        med dtyper och NaN/None exakt som vid inläsningen (parquet gör om NaN i textkolumner till None)
+      - LRU: en träff uppdaterar postens mtime; över max_mb tas de längst oanvända posterna bort
+    Fel i cachen (trasig post, skrivskyddad katalog) ger bara en vanlig inläsning.
+    Av som standard (load_bank/load_bokf/build_output_excel_bytes med cache=True slår på den):
+    posterna är hela kontoutdrag och bokföringslistor, okrypterade, och en träff läses med pickle –
+    katalogen ska bara vara skrivbar för den som kör avstämningen.
+    Lagring: posterna ligger kvar tills katalogen överstiger max_mb (då tas de längst oanvända bort)
+    eller tills de raderas för hand; det finns ingen tidsgräns. Töm med InputCache(INPUT_CACHE_DIR).clear().
+    """
+    def __init__(self, directory, max_mb: float = INPUT_CACHE_MAX_MB):
+        self.dir = Path(directory)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+
+    def key(self, kind: str, data, suffix: str) -> str:
+        # data: Path eller bytes (se _source)
+        h = hashlib.blake2b(_loader_settings(), digest_size=20)
+        if isinstance(data, Path):
+            with open(data, "rb") as fh:
+                for chunk in iter(lambda: fh.read(1 << 20), b""): h.update(chunk)
+        else:
+            h.update(data)
+        return f"{kind}-v{LOADER_VERSION}{suffix}-{h.hexdigest()}"
+
+    def load(self, kind: str, data, suffix: str, loader) -> pd.DataFrame:
+        # loader(data, suffix) läser filen om posten saknas
+        entry = self.dir / (self.key(kind, data, suffix) + ".pkl")
+        try:
+            df = pd.read_pickle(entry)
+            os.utime(entry)
+            metric("cache.träff"); return df
+        except FileNotFoundError:
+            pass
+        except Exception:
+            entry.unlink(missing_ok=True)
+        metric("cache.miss")
+        df = loader(data, suffix)
+        tmp = None
+        try:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            # Unikt tempnamn per skrivare (även trådar i samma process, t.ex. Streamlit-sessioner)
+            with tempfile.NamedTemporaryFile(dir=self.dir, prefix=entry.name + ".", suffix=".tmp", delete=False) as fh:
+                tmp = Path(fh.name); df.to_pickle(fh)
+            os.replace(tmp, entry)  # atomiskt: samtidiga läsare ser aldrig en halv post
+            self.evict()
+        except OSError:
+            if tmp is not None: tmp.unlink(missing_ok=True)
+        return df
+
+    def clear(self):
+        # Tar bort alla poster (och kvarlämnade tempfiler) i katalogen
+        for e in [*self.dir.glob("*.pkl"), *self.dir.glob("*.tmp")]:
+            e.unlink(missing_ok=True)
+
+    def evict(self):
+        entries = []
+        for e in self.dir.glob("*.pkl"):
+            try:
+                st = e.stat(); entries.append((st.st_mtime, st.st_size, e))
+            except FileNotFoundError:
+                continue  # borttagen av en annan process
+        total = sum(size for _, size, _ in entries)
+        for _, size, e in sorted(entries):
+            if total <= self.max_bytes: break
+            e.unlink(missing_ok=True); total -= size
+
+# Belopp jämförs och summeras i hela ören ("__Öre__", saknat belopp = 0)
+def sum_ore(s): return int(s.sum())
+def rows_eq_ore(df, cents, amount_col):
+    # Rader med exakt `cents` öre; rader utan belopp räknas aldrig som träff
+    return df[(df["__Öre__"] == cents) & df[amount_col].notna()]
 def extract_yymmdd(dt):
     if pd.isna(dt): return None
     return pd.to_datetime(dt).strftime("%y%m%d")
-def has_yymmdd_in_text1(t, y): return isinstance(t,str) and ("Skabank" in t) and (y in t)
-def has_yymmdd_in_vnr(v, y):   return isinstance(v,str) and ("Skabank" in v) and (y in v)
-def is_6digit_vnr(v):          return isinstance(v,str) and len(v)==6 and v.isdigit()
-
-def col_apply(df: pd.DataFrame, col: str, func) -> pd.Series:
-    if col in df.columns:
-        return df[col].apply(func)
-    return pd.Series([False]*len(df), index=df.index)
-
-def combinations_limited(idx_list, max_combo=2000):
-    total = 0
-    for r in [1,2,3]:
-        for combo in itertools.combinations(idx_list, r):
-            total += 1
-            if total > max_combo: return
-            yield combo
+
+def find_removal(values, need, max_r=3, tag="find_removal"):
+    """
+    Första kombinationen av positioner (i itertools.combinations-ordning, r = 1..max_r)
+    vars värden (öre) summerar till need. Hashuppslag i stället för uppräkning:
+    r=1 O(n), r=2 O(n log n), r=3 O(n² log n), med tidig avbrytning vid första träff.
+    Körstatistik: <tag>.anrop och <tag>.uppslag (antal hashuppslag, räknas ut vid retur).
+    """
+    where = {}
+    for i, v in enumerate(values):
+        where.setdefault(v, []).append(i)
+
+    def first_after(v, lo):
+        # Minsta position > lo med värdet v
+        lst = where.get(v)
+        if not lst: return None
+        k = bisect.bisect_right(lst, lo)
+        return lst[k] if k < len(lst) else None
+
+    n = len(values)
+    def done(res, probes):
+        m = _active_metrics()
+        if m is not None:
+            m.count(tag + ".anrop"); m.count(tag + ".uppslag", probes)
+        return res
+
+    if max_r >= 1:
+        i = first_after(need, -1)
+        if i is not None: return done((i,), 1)
+    r2 = n if max_r >= 2 else 0
+    if max_r >= 2:
+        for i in range(n):
+            j = first_after(need - values[i], i)
+            if j is not None: return done((i, j), 2 + i)
+    if max_r >= 3:
+        for i in range(n):
+            rest = need - values[i]
+            for j in range(i + 1, n):
+                k = first_after(rest - values[j], j)
+                if k is not None: return done((i, j, k), 1 + r2 + i * (n - 1) - i * (i - 1) // 2 + j - i)
+    return done(None, (max_r >= 1) + r2 + (n * (n - 1) // 2 if max_r >= 3 else 0))
+
+def iter_days(df: pd.DataFrame):
+    # Som groupby(datum) men på heltalsordinalen; rader utan datum hoppas över
+    df = df[df["__Dag__"] != NO_DAY]
+    for day, grp in df.groupby("__Dag__", sort=True):
+        yield int(day), grp
+
+DAY_WORKERS = 1  # processer för de dagsvisa stegen (K1/K5/K5X); 1 = seriellt
+
+def run_days(day_fn, tasks, workers=None):
+    # Kör day_fn(*task) för varje dag. Resultaten kommer alltid i tasks-ordning (datumordning),
+    # så anroparen kan stämpla seriellt efteråt och få samma GroupKeys som vid seriell körning.
+    # workers: antal processer (None → DAY_WORKERS) eller en redan startad Executor (day_pool).
+    if workers is None: workers = DAY_WORKERS
+    progress_days(len(tasks))
+    pooled = isinstance(workers, Executor) or (workers > 1 and len(tasks) >= 2)
+    if not pooled or not tasks:
+        return _gather(day_fn(*t) for t in tasks)
+    metrics = _active_metrics()
+    fn = partial(_metered_day, day_fn) if metrics is not None else day_fn
+    with nullcontext(workers) if isinstance(workers, Executor) else \
+            ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as ex:
+        chunk = 1 if ex is workers else max(1, len(tasks) // (4 * workers))
+        try:
+            out = _gather(ex.map(fn, *zip(*tasks), chunksize=chunk))
+        except RunCancelled:
+            ex.shutdown(cancel_futures=True); raise  # avbruten körning: köade dagar körs inte
+    if metrics is None:
+        return out
+    for _, counts, observations in out:
+        metrics.merge(counts, observations)
+    return [res for res, _, _ in out]
+
+def _gather(results):
+    # Hämtar dagsresultaten i ordning och rapporterar varje klar dag (progress_tick)
+    out = []
+    for res in results:
+        out.append(res); progress_tick()
+    return out
+
+def _metered_day(day_fn, *args):
+    # Körs i poolprocessen: dagens körstatistik samlas lokalt och skickas tillbaka med resultatet
+    with RunMetrics().active() as metrics:
+        res = day_fn(*args)
+        return res, metrics.counts, metrics.observations
+
+def day_pool(workers=None):
+    # En gemensam processpool för en hel körning (startas en gång i stället för per steg)
+    if workers is None: workers = DAY_WORKERS
+    return ProcessPoolExecutor(max_workers=workers) if workers > 1 else nullcontext(1)
+
+# ============================ Dagsindex ============================
+_NO_POS = np.empty(0, dtype=np.int64)
+_NO_LABELS = pd.Index([])
+
+class DayIndex:
+    """
+    Dagsindex + förbrukningsmask över en inläst ram (load_bank/load_bokf):
+      - dag (heltalsordinal i "__Dag__") -> radpositioner i ramens ordning
+      - valfritt (Kategori.strip(), dag) -> radpositioner
+      - used[pos] = True när raden har stämplats av något K-steg
+      - token_labels(kolumn, token): inverterat index över en tokenkolumn (t.ex. "__YyVnr__")
+      - window(lo, hi, kats): rader med dag i [lo, hi] via binärsökning i dagsorterade partitioner
+    Byggs en gång och delas av alla K-steg: uppslag per dag kostar O(dagens rader),
+    consume() O(1) per rad, och restramar behöver inte kopieras mellan stegen.
+    """
+    def __init__(self, df: pd.DataFrame, kat_col=None, id_col=None):
+        self.df = df
+        self.id_col = id_col or ("BankRowID" if "BankRowID" in df.columns else "BokfRowID")
+        self.used = np.zeros(len(df), dtype=bool)
+        self._pos_of_id = pd.Index(df[self.id_col].to_numpy())
+        days = df["__Dag__"].to_numpy()
+        self._by_day = self._group(days)
+        self._by_kat, self._tokens, self._sorted = {}, {}, {}
+        if kat_col is not None and kat_col in df.columns:
+            codes, kats = pd.factorize(df[kat_col].astype(str).str.strip())
+            for (code, day), pos in self._group(days, codes).items():
+                self._by_kat.setdefault(kats[code], {})[day] = pos
+
+    @staticmethod
+    def _group(days, codes=None):
+        keys = (days,) if codes is None else (days, codes)
+        order = np.lexsort(keys)  # stabil → ramens ordning inom varje nyckel
+        cuts = np.zeros(len(order), dtype=bool)
+        for k in keys:
+            ks = k[order]
+            cuts[1:] |= ks[1:] != ks[:-1]
+        starts = np.flatnonzero(np.r_[True, cuts[1:]]) if len(order) else _NO_POS
+        ends = np.r_[starts[1:], len(order)]
+        out = {}
+        for s, e in zip(starts, ends):
+            p = order[s]
+            if days[p] == NO_DAY: continue
+            key = int(days[p]) if codes is None else (int(codes[p]), int(days[p]))
+            out[key] = order[s:e]
+        return out
+
+    @property
+    def kategorier(self):
+        return list(self._by_kat)
+
+    def free(self, df: pd.DataFrame = None) -> np.ndarray:
+        # Bool-mask (i df:s radordning) för rader som ännu inte förbrukats; df ⊆ indexets ram
+        if df is None or df is self.df: return ~self.used
+        return ~self.used[self.df.index.get_indexer(df.index)]
+
+    def consume(self, rows: pd.DataFrame):
+        if rows is None or rows.empty: return
+        pos = self._pos_of_id.get_indexer(rows[self.id_col].to_numpy())
+        self.used[pos[pos >= 0]] = True
+
+    def remaining(self) -> pd.DataFrame:
+        return self.df[~self.used]
+
+    def days(self):
+        return [d for d, pos in self._by_day.items() if not self.used[pos].all()]
+
+    def positions(self, days, kats=None) -> np.ndarray:
+        if isinstance(days, (int, np.integer)): days = [days]
+        if kats is None:
+            parts = [self._by_day.get(d, _NO_POS) for d in days]
+        else:
+            parts = [self._by_kat.get(k, {}).get(d, _NO_POS) for k in kats for d in days]
+        pos = parts[0] if len(parts) == 1 else np.sort(np.concatenate(parts)) if parts else _NO_POS
+        return pos[~self.used[pos]]
+
+    def rows(self, days, kats=None) -> pd.DataFrame:
+        return self.df.iloc[self.positions(days, kats)].copy()
+
+    def _day_sorted(self, kat=None):
+        # (dagar, positioner) sorterade på dag och inom dagen på ramordning – hela ramen (kat=None)
+        # eller en Kategori-partition; byggs vid första fönsteruppslaget
+        part = self._sorted.get(kat)
+        if part is None:
+            by_day = self._by_day if kat is None else self._by_kat.get(kat, {})
+            days = sorted(by_day)
+            pos = np.concatenate([by_day[d] for d in days]) if days else _NO_POS
+            day_of = np.repeat(np.array(days, dtype=np.int64), [len(by_day[d]) for d in days])
+            part = self._sorted[kat] = (day_of, pos)
+        return part
+
+    def window(self, lo: int, hi: int, kats=None) -> np.ndarray:
+        # Oförbrukade radpositioner (ramordning) med dag i [lo, hi] – samma som positions(range(lo, hi + 1), kats)
+        # men O(log n + k) oavsett fönstrets bredd: searchsorted i dagsorterade partitioner (per Kategori)
+        parts = []
+        for kat in ([None] if kats is None else kats):
+            day_of, pos = self._day_sorted(kat)
+            parts.append(pos[np.searchsorted(day_of, lo, "left"):np.searchsorted(day_of, hi, "right")])
+        pos = np.sort(np.concatenate(parts)) if parts else _NO_POS
+        return pos[~self.used[pos]]
+
+    def rows_window(self, lo: int, hi: int, kats=None) -> pd.DataFrame:
+        return self.df.iloc[self.window(lo, hi, kats)].copy()
+
+    def token_labels(self, col: str, token: str) -> pd.Index:
+        # Radetiketter vars tokenkolumn (ledger_features) innehåller token – även förbrukade rader,
+        # så resultatet snittas med en urvalsram (sel.index.isin(...)). Indexet byggs vid första uppslaget.
+        inv = self._tokens.get(col)
+        if inv is None:
+            toks = self.df[col] if col in self.df.columns else ledger_features(self.df)[col]
+            toks = toks[toks != ""].str.split().explode()
+            inv = self._tokens[col] = toks.groupby(toks).groups if len(toks) else {}
+        return inv.get(token, _NO_LABELS)
+
+def _day_index(df: pd.DataFrame, idx, kat_col=None) -> DayIndex:
+    # Delat index om det hör till just df, annars ett eget (fristående anrop)
+    return idx if idx is not None and idx.df is df else DayIndex(df, kat_col)
 
 # ====================== Gruppnyckel (GroupKey) ======================
 def new_group_key(cat: str, bank_rows: pd.DataFrame, counters: dict) -> str:
@@ -178,437 +915,445 @@ def stamp_match(bank_rows: pd.DataFrame, bokf_rows: pd.DataFrame, cat: str, coun
         f["__MatchKategori__"] = cat; f["__GroupKey__"] = gkey
     return b, f, gkey
 
-# =============================== K1 ===================================
-def run_category1_BG53782751(bank_df, bokf_df, counters):
-    bank_k1 = bank_df[
-        bank_df["Text"].astype(str).str.contains(r"BG53782751", case=False, na=False)
-        & (bank_df["Belopp"] > 0)
-    ].copy()
-    matched_bank_all, matched_bokf_all, used_bokf_ids = [], [], set()
+def stamp_pairs(bank_rows: pd.DataFrame, bokf_rows: pd.DataFrame, cat: str, counters: dict):
+    # Som stamp_match för varje 1:1-par (rad i bank_rows hör ihop med rad i bokf_rows),
+    # med löpnummer i bank_rows ordning – samma nycklar som ett anrop per par.
+    start = counters.get(cat, 0)
+    if len(bank_rows): counters[cat] = start + len(bank_rows)
+    seq = pd.Series(np.arange(start + 1, start + 1 + len(bank_rows)), index=bank_rows.index)
+    gkeys = (cat + "-B" + bank_rows["BankRowID"].astype(np.int64).astype(str)
+             + "-" + seq.astype(str).str.zfill(6))
+    b = bank_rows.copy(); f = bokf_rows.copy()
+    b["__MatchKategori__"] = cat; b["__GroupKey__"] = gkeys.to_numpy()
+    f["__MatchKategori__"] = cat; f["__GroupKey__"] = gkeys.to_numpy()
+    return b, f
 
-    for bank_date, bank_day_rows in bank_k1.groupby(bank_k1["Bokföringsdatum"].dt.date):
-        bank_day_rows = bank_day_rows.sort_values("BankRowID")
-        bank_sum = sum_sek(bank_day_rows["Belopp"])
-        yymmdd = extract_yymmdd(pd.to_datetime(bank_date))
-
-        bokf_day = bokf_df[
-            (bokf_df["Datum"].dt.date == bank_date) &
-            (bokf_df["Kategori"].astype(str).str.strip().str.lower() == "inbetalningar") &
-            (bokf_df["Period SEK"] > 0) &
-            (~bokf_df["BokfRowID"].isin(used_bokf_ids))
-        ].copy()
-        if bokf_day.empty: continue
-        try_match = lambda df_now: math.isclose(sum_sek(df_now["Period SEK"]), bank_sum, abs_tol=0.005)
-
-        cur = bokf_day.copy()
-        if try_match(cur):
-            b,f,_ = stamp_match(bank_day_rows, cur, "K1", counters)
-            matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(cur["BokfRowID"]); continue
-
-        cur = bokf_day.copy()
-        diff = sek_round(sum_sek(cur["Period SEK"]) - bank_sum)
+# =============================== K1 ===================================
+def _k1_day(bank_sum, bokf_day, right_vnr):
+    # K1-stegen för en dag; returnerar etiketterna för valda bokf-rader eller None.
+    # right_vnr: bool per rad i bokf_day – "Skabank" + bankdagens yymmdd i Verifikationsnummer
+    try_match = lambda df_now: sum_ore(df_now["__Öre__"]) == bank_sum
+
+    cur = bokf_day.copy()
+    if try_match(cur):
+        metric("K1.steg1"); return cur.index
+
+    cur = bokf_day.copy()
+    diff = sum_ore(cur["__Öre__"]) - bank_sum
+    if diff != 0:
+        cand = cur[cur["__Öre__"] == diff]
+        if not cand.empty:
+            cur2 = cur[cur["BokfRowID"] != cand.iloc[0]["BokfRowID"]]
+            if try_match(cur2):
+                metric("K1.steg2"); return cur2.index
+
+    seb = ledger_class(bokf_day, BOKF_SEB)
+    cur = bokf_day[seb].copy()
+    if not cur.empty and try_match(cur):
+        metric("K1.steg3"); return cur.index
+
+    cur = bokf_day[seb].copy()
+    if not cur.empty:
+        diff = sum_ore(cur["__Öre__"]) - bank_sum
         if diff != 0:
-            cand = cur[cur["Period SEK"].round(2) == diff]
+            cand = cur[cur["__Öre__"] == diff]
             if not cand.empty:
                 cur2 = cur[cur["BokfRowID"] != cand.iloc[0]["BokfRowID"]]
                 if try_match(cur2):
-                    b,f,_ = stamp_match(bank_day_rows, cur2, "K1", counters)
-                    matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(cur2["BokfRowID"]); continue
-
-        cur = bokf_day[col_apply(bokf_day, "Verifikationsnummer", startswith_seb)].copy()
-        if not cur.empty and try_match(cur):
-            b,f,_ = stamp_match(bank_day_rows, cur, "K1", counters)
-            matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(cur["BokfRowID"]); continue
-
-        cur = bokf_day[col_apply(bokf_day, "Verifikationsnummer", startswith_seb)].copy()
-        if not cur.empty:
-            diff = sek_round(sum_sek(cur["Period SEK"]) - bank_sum)
-            if diff != 0:
-                cand = cur[cur["Period SEK"].round(2) == diff]
-                if not cand.empty:
-                    cur2 = cur[cur["BokfRowID"] != cand.iloc[0]["BokfRowID"]]
-                    if try_match(cur2):
-                        b,f,_ = stamp_match(bank_day_rows, cur2, "K1", counters)
-                        matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(cur2["BokfRowID"]); continue
-
-        cur = bokf_day.copy()
-        non_seb = cur[~col_apply(cur, "Verifikationsnummer", startswith_seb)]
-        if not non_seb.empty:
-            base_sum = sum_sek(cur["Period SEK"]); target = bank_sum; found = False
-            for combo in combinations_limited(list(non_seb.index), 2000):
-                removed = sum_sek(cur.loc[list(combo), "Period SEK"])
-                new_sum = sek_round(base_sum - removed)
-                if new_sum < target - 0.005 or new_sum > target + 0.005: continue
-                cur2 = cur.drop(index=list(combo))
-                if try_match(cur2):
-                    b,f,_ = stamp_match(bank_day_rows, cur2, "K1", counters)
-                    matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(cur2["BokfRowID"]); found = True; break
-            if found: continue
-
-        cur_all = bokf_day.copy()
-        nonseb = ~col_apply(cur_all, "Verifikationsnummer", startswith_seb)
-        right = col_apply(cur_all, "Verifikationsnummer", lambda v: has_yymmdd_in_vnr(v, yymmdd))
-        non_seb_right = cur_all[nonseb & right]
-        cur = pd.concat([cur_all[col_apply(cur_all, "Verifikationsnummer", startswith_seb)], non_seb_right])
-        if not cur.empty and try_match(cur):
-            b,f,_ = stamp_match(bank_day_rows, cur, "K1", counters)
-            matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(cur["BokfRowID"]); continue
-
-        if not cur.empty:
-            diff = sek_round(sum_sek(cur["Period SEK"]) - bank_sum)
-            if diff != 0:
-                cand = cur[cur["Period SEK"].round(2) == diff]
-                if not cand.empty:
-                    cur2 = cur[cur["BokfRowID"] != cand.iloc[0]["BokfRowID"]]
-                    if try_match(cur2):
-                        b,f,_ = stamp_match(bank_day_rows, cur2, "K1", counters)
-                        matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(cur2["BokfRowID"]); continue
-
-        if not cur.empty:
-            non_seb2 = cur[~col_apply(cur, "Verifikationsnummer", startswith_seb)]
-            base_sum = sum_sek(cur["Period SEK"]); target = bank_sum; found = False
-            for combo in combinations_limited(list(non_seb2.index), 2000):
-                removed = sum_sek(cur.loc[list(combo), "Period SEK"])
-                new_sum = sek_round(base_sum - removed)
-                if new_sum < target - 0.005 or new_sum > target + 0.005: continue
-                cur2 = cur.drop(index=list(combo))
+                    metric("K1.steg4"); return cur2.index
+
+    cur = bokf_day.copy()
+    non_seb = cur[~seb]
+    if not non_seb.empty:
+        combo = find_removal(non_seb["__Öre__"].tolist(), sum_ore(cur["__Öre__"]) - bank_sum, tag="K1.find_removal")
+        if combo is not None:
+            cur2 = cur.drop(index=non_seb.index[list(combo)])
+            if try_match(cur2):
+                metric("K1.steg5"); return cur2.index
+
+    cur_all = bokf_day.copy()
+    non_seb_right = cur_all[~seb & right_vnr]
+    cur = pd.concat([cur_all[seb], non_seb_right])
+    if not cur.empty and try_match(cur):
+        metric("K1.steg6"); return cur.index
+
+    if not cur.empty:
+        diff = sum_ore(cur["__Öre__"]) - bank_sum
+        if diff != 0:
+            cand = cur[cur["__Öre__"] == diff]
+            if not cand.empty:
+                cur2 = cur[cur["BokfRowID"] != cand.iloc[0]["BokfRowID"]]
                 if try_match(cur2):
-                    b,f,_ = stamp_match(bank_day_rows, cur2, "K1", counters)
-                    matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(cur2["BokfRowID"]); found = True; break
-            if found: continue
+                    metric("K1.steg7"); return cur2.index
+
+    if not cur.empty:
+        non_seb2 = cur[~ledger_class(cur, BOKF_SEB)]
+        combo = find_removal(non_seb2["__Öre__"].tolist(), sum_ore(cur["__Öre__"]) - bank_sum, tag="K1.find_removal")
+        if combo is not None:
+            cur2 = cur.drop(index=non_seb2.index[list(combo)])
+            if try_match(cur2):
+                metric("K1.steg8"); return cur2.index
+    return None
+
+def run_category1_BG53782751(bank_df, bokf_df, counters, bank_idx=None, bokf_idx=None, workers=None):
+    bank_idx = _day_index(bank_df, bank_idx)
+    bokf_idx = _day_index(bokf_df, bokf_idx, "Kategori")
+    bank_k1 = bank_df[
+        text_class(bank_df, TEXT_BG5378)
+        & (bank_df["__Öre__"] > 0) & bank_idx.free(bank_df)
+    ].copy()
+    matched_bank_all, matched_bokf_all = [], []
+    inbet = [k for k in bokf_idx.kategorier if k.lower() == "inbetalningar"]
+
+    # Dagarna är oberoende (kandidaterna är dagens egna rader) → kan köras parallellt;
+    # stämplingen sker sedan i datumordning så att GroupKeys blir desamma som seriellt.
+    days, tasks = [], []
+    for bank_day, bank_day_rows in iter_days(bank_k1):
+        bokf_day = bokf_idx.rows(bank_day, inbet)
+        bokf_day = bokf_day[bokf_day["__Öre__"] > 0]
+        if bokf_day.empty: continue
+        days.append((bank_day_rows.sort_values("BankRowID"), bokf_day))
+        yymmdd = extract_yymmdd(ordinal_to_date(bank_day))
+        right_vnr = bokf_day.index.isin(bokf_idx.token_labels("__YyVnr__", yymmdd))
+        tasks.append((sum_ore(bank_day_rows["__Öre__"]), bokf_day, right_vnr))
+
+    hits = run_days(_k1_day, tasks, workers)
+    metric("K1.dagar", len(tasks)); metric("K1.ingen_träff", sum(h is None for h in hits))
+    for (bank_day_rows, bokf_day), hit in zip(days, hits):
+        if hit is None: continue
+        chosen = bokf_day.loc[hit]
+        b,f,_ = stamp_match(bank_day_rows, chosen, "K1", counters)
+        matched_bank_all.append(b); matched_bokf_all.append(f); bokf_idx.consume(chosen)
 
     matched_bank = pd.concat(matched_bank_all, ignore_index=True) if matched_bank_all else bank_k1.iloc[0:0].copy()
     matched_bokf = pd.concat(matched_bokf_all, ignore_index=True) if matched_bokf_all else bokf_df.iloc[0:0].copy()
+    bank_idx.consume(matched_bank)
     return matched_bank, matched_bokf
 
 # =============================== K2 ===================================
-def run_category2_BG5341_7689(bank_df, bokf_df, counters):
+K2_WINDOW_DAYS = 2  # Betalningar får ligga ±så många dagar från bankdagen (steg 12–15)
+
+def run_category2_BG5341_7689(bank_df, bokf_df, counters, bank_idx=None, bokf_idx=None):
+    bank_idx = _day_index(bank_df, bank_idx)
+    bokf_idx = _day_index(bokf_df, bokf_idx, "Kategori")
     bank_k2 = bank_df[
-        bank_df["Text"].astype(str).str.contains(r"BG\s*5341-7689", case=False, na=False)
-        & (bank_df["Belopp"] > 0)
+        text_class(bank_df, TEXT_BG5341)
+        & (bank_df["__Öre__"] > 0) & bank_idx.free(bank_df)
     ].copy()
-    matched_bank_all, matched_bokf_all, used_bokf_ids = [], [], set()
+    matched_bank_all, matched_bokf_all = [], []
+
+    def bokf_kat(days, kat):
+        base = bokf_idx.rows(days, [kat])
+        return base[base["__Öre__"] > 0]
 
-    for bank_date, bank_day_rows in bank_k2.groupby(bank_k2["Bokföringsdatum"].dt.date):
+    def bokf_kat_window(day, n, kat):
+        # ±n dagar runt day via fönsteruppslaget i dagsindexet (valfritt n)
+        base = bokf_idx.rows_window(day - n, day + n, [kat])
+        return base[base["__Öre__"] > 0]
+
+    bank_days = list(iter_days(bank_k2))
+    progress_days(len(bank_days))
+    for bank_day, bank_day_rows in bank_days:
+        metric("K2.dagar"); progress_tick()
         bank_day_rows = bank_day_rows.sort_values("BankRowID")
-        bank_sum = sum_sek(bank_day_rows["Belopp"])
-        yymmdd = extract_yymmdd(pd.to_datetime(bank_date))
+        bank_sum = sum_ore(bank_day_rows["__Öre__"])
+        yymmdd = extract_yymmdd(ordinal_to_date(bank_day))
 
         def bokf_065():
-            return bokf_df[
-                (bokf_df["Datum"].dt.date == bank_date) &
-                (bokf_df["Kategori"].astype(str).str.strip() == "065 BFO") &
-                (bokf_df["Period SEK"] > 0) &
-                (~bokf_df["BokfRowID"].isin(used_bokf_ids))
-            ].copy()
+            return bokf_kat(bank_day, "065 BFO")
 
         def only_text1_rightYY(df):
-            mask = col_apply(df, "Text1", lambda t: has_yymmdd_in_text1(t, yymmdd))
-            return df[mask].copy()
+            # "Skabank" + yymmdd i Text1: uppslag i tokenindexet i stället för deltextsökning
+            return df[df.index.isin(bokf_idx.token_labels("__YyText1__", yymmdd))].copy()
 
         def bokf_inbet_noSEB_rightYY():
-            base = bokf_df[
-                (bokf_df["Datum"].dt.date == bank_date) &
-                (bokf_df["Kategori"].astype(str).str.strip() == "Inbetalningar") &
-                (bokf_df["Period SEK"] > 0) &
-                (~bokf_df["BokfRowID"].isin(used_bokf_ids))
-            ].copy()
-            mask_nonSEB = ~col_apply(base, "Verifikationsnummer", startswith_seb)
-            mask_right = col_apply(base, "Verifikationsnummer", lambda v: has_yymmdd_in_vnr(v, yymmdd))
+            base = bokf_kat(bank_day, "Inbetalningar")
+            mask_nonSEB = ~ledger_class(base, BOKF_SEB)
+            mask_right = base.index.isin(bokf_idx.token_labels("__YyVnr__", yymmdd))
             return base[mask_nonSEB & mask_right].copy()
 
         def bokf_betalningar_pm2_rightYY():
-            day = pd.to_datetime(bank_date)
-            lo = (day - pd.Timedelta(days=2)).date()
-            hi = (day + pd.Timedelta(days=2)).date()
-            base = bokf_df[
-                (bokf_df["Datum"].dt.date >= lo) & (bokf_df["Datum"].dt.date <= hi) &
-                (bokf_df["Kategori"].astype(str).str.strip() == "Betalningar") &
-                (bokf_df["Period SEK"] > 0) &
-                (~bokf_df["BokfRowID"].isin(used_bokf_ids))
-            ].copy()
-            mask6 = col_apply(base, "Verifikationsnummer", is_6digit_vnr)
-            mask_right = col_apply(base, "Verifikationsnummer", lambda v: isinstance(v,str) and yymmdd in v)
+            # 6-siffrigt verifikationsnummer som innehåller yymmdd = är yymmdd
+            base = bokf_kat_window(bank_day, K2_WINDOW_DAYS, "Betalningar")
+            mask6 = ledger_class(base, BOKF_VNR6)
+            mask_right = base["Verifikationsnummer"].to_numpy(dtype=object) == yymmdd
             return base[mask6 & mask_right].copy()
 
-        try_match = lambda df_now: math.isclose(sum_sek(df_now["Period SEK"]), bank_sum, abs_tol=0.005)
+        try_match = lambda df_now: sum_ore(df_now["__Öre__"]) == bank_sum
 
-        cur = bokf_065()
+        # Urvalen beror bara på dagen (inget förbrukas mellan stegen) → byggs en gång per dag
+        b065 = bokf_065()
+        cur = b065
         if not cur.empty and try_match(cur):
             b,f,_ = stamp_match(bank_day_rows, cur, "K2", counters)
-            matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(cur["BokfRowID"]); continue
+            metric("K2.steg1"); matched_bank_all.append(b); matched_bokf_all.append(f); bokf_idx.consume(cur); continue
 
-        cur = bokf_065()
+        cur = b065
         if not cur.empty:
-            cand = cur[cur["Period SEK"].round(2) == bank_sum]
+            cand = cur[cur["__Öre__"] == bank_sum]
             if not cand.empty:
                 chosen = cand.iloc[[0]]
                 b,f,_ = stamp_match(bank_day_rows, chosen, "K2", counters)
-                matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(chosen["BokfRowID"]); continue
+                metric("K2.steg2"); matched_bank_all.append(b); matched_bokf_all.append(f); bokf_idx.consume(chosen); continue
 
-        cur = bokf_065()
+        cur = b065
         if not cur.empty:
-            diff = sek_round(sum_sek(cur["Period SEK"]) - bank_sum)
+            diff = sum_ore(cur["__Öre__"]) - bank_sum
             if diff != 0:
-                drop = cur[cur["Period SEK"].round(2) == diff]
+                drop = cur[cur["__Öre__"] == diff]
                 if not drop.empty:
                     cur2 = cur[cur["BokfRowID"] != drop.iloc[0]["BokfRowID"]]
                     if try_match(cur2):
                         b,f,_ = stamp_match(bank_day_rows, cur2, "K2", counters)
-                        matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(cur2["BokfRowID"]); continue
+                        metric("K2.steg3"); matched_bank_all.append(b); matched_bokf_all.append(f); bokf_idx.consume(cur2); continue
 
-        cur = only_text1_rightYY(bokf_065())
+        t065 = only_text1_rightYY(b065)
+        cur = t065
         if not cur.empty and try_match(cur):
             b,f,_ = stamp_match(bank_day_rows, cur, "K2", counters)
-            matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(cur["BokfRowID"]); continue
+            metric("K2.steg4"); matched_bank_all.append(b); matched_bokf_all.append(f); bokf_idx.consume(cur); continue
 
-        cur = only_text1_rightYY(bokf_065())
+        cur = t065
         if not cur.empty:
-            cand = cur[cur["Period SEK"].round(2) == bank_sum]
+            cand = cur[cur["__Öre__"] == bank_sum]
             if not cand.empty:
                 chosen = cand.iloc[[0]]
                 b,f,_ = stamp_match(bank_day_rows, chosen, "K2", counters)
-                matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(chosen["BokfRowID"]); continue
+                metric("K2.steg5"); matched_bank_all.append(b); matched_bokf_all.append(f); bokf_idx.consume(chosen); continue
 
-        cur = only_text1_rightYY(bokf_065())
+        cur = t065
         if not cur.empty:
-            diff = sek_round(sum_sek(cur["Period SEK"]) - bank_sum)
+            diff = sum_ore(cur["__Öre__"]) - bank_sum
             if diff != 0:
-                drop = cur[cur["Period SEK"].round(2) == diff]
+                drop = cur[cur["__Öre__"] == diff]
                 if not drop.empty:
                     cur2 = cur[cur["BokfRowID"] != drop.iloc[0]["BokfRowID"]]
                     if try_match(cur2):
                         b,f,_ = stamp_match(bank_day_rows, cur2, "K2", counters)
-                        matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(cur2["BokfRowID"]); continue
+                        metric("K2.steg6"); matched_bank_all.append(b); matched_bokf_all.append(f); bokf_idx.consume(cur2); continue
 
-        cur = only_text1_rightYY(bokf_065())
+        cur = t065
         if not cur.empty:
-            base_sum = sum_sek(cur["Period SEK"]); target = bank_sum; found = False
-            for r in [1,2,3]:
-                for combo in itertools.combinations(list(cur.index), r):
-                    removed = sum_sek(cur.loc[list(combo), "Period SEK"])
-                    new_sum = sek_round(base_sum - removed)
-                    if new_sum < target - 0.005 or new_sum > target + 0.005: continue
-                    cur2 = cur.drop(index=list(combo))
-                    if try_match(cur2):
-                        b,f,_ = stamp_match(bank_day_rows, cur2, "K2", counters)
-                        matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(cur2["BokfRowID"]); found = True; break
-                if found: break
-            if found: continue
+            combo = find_removal(cur["__Öre__"].tolist(), sum_ore(cur["__Öre__"]) - bank_sum, tag="K2.find_removal")
+            if combo is not None:
+                cur2 = cur.drop(index=cur.index[list(combo)])
+                if try_match(cur2):
+                    b,f,_ = stamp_match(bank_day_rows, cur2, "K2", counters)
+                    metric("K2.steg7"); matched_bank_all.append(b); matched_bokf_all.append(f); bokf_idx.consume(cur2); continue
 
-        set_065 = only_text1_rightYY(bokf_065())
+        set_065 = t065
         set_inb = bokf_inbet_noSEB_rightYY()
         cur = pd.concat([set_065, set_inb], ignore_index=False)
         if not cur.empty and try_match(cur):
             b,f,_ = stamp_match(bank_day_rows, cur, "K2", counters)
-            matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(cur["BokfRowID"]); continue
+            metric("K2.steg8"); matched_bank_all.append(b); matched_bokf_all.append(f); bokf_idx.consume(cur); continue
 
         if not cur.empty:
-            cand = cur[cur["Period SEK"].round(2) == bank_sum]
+            cand = cur[cur["__Öre__"] == bank_sum]
             if not cand.empty:
                 chosen = cand.iloc[[0]]
                 b,f,_ = stamp_match(bank_day_rows, chosen, "K2", counters)
-                matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(chosen["BokfRowID"]); continue
+                metric("K2.steg9"); matched_bank_all.append(b); matched_bokf_all.append(f); bokf_idx.consume(chosen); continue
 
         if not cur.empty:
-            diff = sek_round(sum_sek(cur["Period SEK"]) - bank_sum)
+            diff = sum_ore(cur["__Öre__"]) - bank_sum
             if diff != 0:
-                drop = cur[cur["Period SEK"].round(2) == diff]
+                drop = cur[cur["__Öre__"] == diff]
                 if not drop.empty:
                     cur2 = cur[cur["BokfRowID"] != drop.iloc[0]["BokfRowID"]]
                     if try_match(cur2):
                         b,f,_ = stamp_match(bank_day_rows, cur2, "K2", counters)
-                        matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(cur2["BokfRowID"]); continue
+                        metric("K2.steg10"); matched_bank_all.append(b); matched_bokf_all.append(f); bokf_idx.consume(cur2); continue
 
         if not cur.empty:
-            base_sum = sum_sek(cur["Period SEK"]); target = bank_sum; found = False
-            for r in [1,2,3]:
-                for combo in itertools.combinations(list(cur.index), r):
-                    removed = sum_sek(cur.loc[list(combo), "Period SEK"])
-                    new_sum = sek_round(base_sum - removed)
-                    if new_sum < target - 0.005 or new_sum > target + 0.005: continue
-                    cur2 = cur.drop(index=list(combo))
-                    if try_match(cur2):
-                        b,f,_ = stamp_match(bank_day_rows, cur2, "K2", counters)
-                        matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(cur2["BokfRowID"]); found = True; break
-                if found: break
-            if found: continue
+            combo = find_removal(cur["__Öre__"].tolist(), sum_ore(cur["__Öre__"]) - bank_sum, tag="K2.find_removal")
+            if combo is not None:
+                cur2 = cur.drop(index=cur.index[list(combo)])
+                if try_match(cur2):
+                    b,f,_ = stamp_match(bank_day_rows, cur2, "K2", counters)
+                    metric("K2.steg11"); matched_bank_all.append(b); matched_bokf_all.append(f); bokf_idx.consume(cur2); continue
 
         set_bet = bokf_betalningar_pm2_rightYY()
         cur = pd.concat([set_065, set_inb, set_bet], ignore_index=False)
         if not cur.empty and try_match(cur):
             b,f,_ = stamp_match(bank_day_rows, cur, "K2", counters)
-            matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(cur["BokfRowID"]); continue
+            metric("K2.steg12"); matched_bank_all.append(b); matched_bokf_all.append(f); bokf_idx.consume(cur); continue
 
         if not cur.empty:
-            cand = cur[cur["Period SEK"].round(2) == bank_sum]
+            cand = cur[cur["__Öre__"] == bank_sum]
             if not cand.empty:
                 chosen = cand.iloc[[0]]
                 b,f,_ = stamp_match(bank_day_rows, chosen, "K2", counters)
-                matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(chosen["BokfRowID"]); continue
+                metric("K2.steg13"); matched_bank_all.append(b); matched_bokf_all.append(f); bokf_idx.consume(chosen); continue
 
         if not cur.empty:
-            diff = sek_round(sum_sek(cur["Period SEK"]) - bank_sum)
+            diff = sum_ore(cur["__Öre__"]) - bank_sum
             if diff != 0:
-                drop = cur[cur["Period SEK"].round(2) == diff]
+                drop = cur[cur["__Öre__"] == diff]
                 if not drop.empty:
                     cur2 = cur[cur["BokfRowID"] != drop.iloc[0]["BokfRowID"]]
                     if try_match(cur2):
                         b,f,_ = stamp_match(bank_day_rows, cur2, "K2", counters)
-                        matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(cur2["BokfRowID"]); continue
+                        metric("K2.steg14"); matched_bank_all.append(b); matched_bokf_all.append(f); bokf_idx.consume(cur2); continue
 
         if not cur.empty:
-            base_sum = sum_sek(cur["Period SEK"]); target = bank_sum; found = False
-            for r in [1,2,3]:
-                for combo in itertools.combinations(list(cur.index), r):
-                    removed = sum_sek(cur.loc[list(combo), "Period SEK"])
-                    new_sum = sek_round(base_sum - removed)
-                    if new_sum < target - 0.005 or new_sum > target + 0.005: continue
-                    cur2 = cur.drop(index=list(combo))
-                    if try_match(cur2):
-                        b,f,_ = stamp_match(bank_day_rows, cur2, "K2", counters)
-                        matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(cur2["BokfRowID"]); found = True; break
-                if found: break
-            if found: continue
+            combo = find_removal(cur["__Öre__"].tolist(), sum_ore(cur["__Öre__"]) - bank_sum, tag="K2.find_removal")
+            if combo is not None:
+                cur2 = cur.drop(index=cur.index[list(combo)])
+                if try_match(cur2):
+                    b,f,_ = stamp_match(bank_day_rows, cur2, "K2", counters)
+                    metric("K2.steg15"); matched_bank_all.append(b); matched_bokf_all.append(f); bokf_idx.consume(cur2); continue
 
     matched_bank = pd.concat(matched_bank_all, ignore_index=True) if matched_bank_all else bank_k2.iloc[0:0].copy()
     matched_bokf = pd.concat(matched_bokf_all, ignore_index=True) if matched_bokf_all else bokf_df.iloc[0:0].copy()
+    bank_idx.consume(matched_bank)
     return matched_bank, matched_bokf
 
-# =============================== K3 ===================================
-def run_category3_35ref(bank_df, bokf_df, counters):
-    has_35ref = bank_df["Text"].astype(str).str.contains(r"35\d{10}", regex=True, na=False)
-    bank_k3 = bank_df[has_35ref].copy().sort_values(["Bokföringsdatum","BankRowID"])
-    bokf_pay = bokf_df[(bokf_df["Kategori"].astype(str).str.strip() == "Betalningar")].copy()
-
-    matched_bank_rows, matched_bokf_rows, used_bokf_ids = [], [], set()
-    for _, b in bank_k3.iterrows():
-        b_date = pd.to_datetime(b["Bokföringsdatum"]).date() if pd.notna(b["Bokföringsdatum"]) else None
-        amount = sek_round(b["Belopp"])
-        if b_date is None or pd.isna(amount): continue
-        cand = bokf_pay[
-            (bokf_pay["Datum"].dt.date == b_date) &
-            (~bokf_pay["BokfRowID"].isin(used_bokf_ids)) &
-            (bokf_pay["Period SEK"].round(2) == amount)
-        ].copy()
-        if len(cand) >= 1:
-            chosen = cand.sort_values("BokfRowID").iloc[[0]]
-            used_bokf_ids |= set(chosen["BokfRowID"])
-            b2,f2,_ = stamp_match(pd.DataFrame([b]), chosen, "K3", counters)
-            matched_bank_rows.append(b2.iloc[0]); matched_bokf_rows.append(f2.iloc[0])
+# ========================= 1:1-matchning (K3/K4) =========================
+def match_one_to_one(bank_sel: pd.DataFrame, bokf_sel: pd.DataFrame, cat: str, counters: dict):
+    """
+    1:1 på (dag, öre) med en enda merge:
+      - bankrader i ordningen (Bokföringsdatum, BankRowID), bokf-rader i BokfRowID-ordning
+      - k:te bankraden för en nyckel paras med k:te bokf-raden för samma nyckel
+    Ger samma par och GroupKeys som att per bankrad ta första oanvända bokf-raden.
+    """
+    b = bank_sel[(bank_sel["__Dag__"] != NO_DAY) & bank_sel["Belopp"].notna()].sort_values(["Bokföringsdatum","BankRowID"])
+    f = bokf_sel[(bokf_sel["__Dag__"] != NO_DAY) & bokf_sel["Period SEK"].notna()].sort_values("BokfRowID")
+    key = ["__Dag__", "__Öre__"]
+    bk = b[key].assign(__rank__=b.groupby(key).cumcount().to_numpy(), __bpos__=np.arange(len(b)))
+    fk = f[key].assign(__rank__=f.groupby(key).cumcount().to_numpy(), __fpos__=np.arange(len(f)))
+    pairs = bk.merge(fk, on=key + ["__rank__"], how="inner").sort_values("__bpos__")
+    return stamp_pairs(b.iloc[pairs["__bpos__"].to_numpy()], f.iloc[pairs["__fpos__"].to_numpy()], cat, counters)
 
-    matched_bank = pd.DataFrame(matched_bank_rows) if matched_bank_rows else bank_k3.iloc[0:0].copy()
-    matched_bokf = pd.DataFrame(matched_bokf_rows) if matched_bokf_rows else bokf_df.iloc[0:0].copy()
+# =============================== K3 ===================================
+def run_category3_35ref(bank_df, bokf_df, counters, bank_idx=None, bokf_idx=None):
+    bank_idx = _day_index(bank_df, bank_idx)
+    bokf_idx = _day_index(bokf_df, bokf_idx)
+    has_35ref = text_class(bank_df, TEXT_REF35)
+    bank_k3 = bank_df[has_35ref & bank_idx.free(bank_df)]
+    bokf_pay = bokf_df[(bokf_df["Kategori"].astype(str).str.strip() == "Betalningar") & bokf_idx.free(bokf_df)]
+    matched_bank, matched_bokf = match_one_to_one(bank_k3, bokf_pay, "K3", counters)
+    bank_idx.consume(matched_bank); bokf_idx.consume(matched_bokf)
     return matched_bank, matched_bokf
 
 # =============================== K4 ===================================
-def run_category4_ovrigt(bank_df, bokf_df, counters):
-    mask_k1 = bank_df["Text"].astype(str).str.contains(r"BG53782751", case=False, na=False)
-    mask_k2 = bank_df["Text"].astype(str).str.contains(r"BG\s*5341-7689", case=False, na=False)
-    mask_k3 = bank_df["Text"].astype(str).str.contains(r"35\d{10}", regex=True, na=False)
-    bank_k4 = bank_df[~(mask_k1 | mask_k2 | mask_k3)].copy().sort_values(["Bokföringsdatum","BankRowID"])
-
-    matched_bank_rows, matched_bokf_rows, used_bokf_ids = [], [], set()
-    for _, b in bank_k4.iterrows():
-        b_date = pd.to_datetime(b["Bokföringsdatum"]).date() if pd.notna(b["Bokföringsdatum"]) else None
-        amount = sek_round(b["Belopp"])
-        if b_date is None or pd.isna(amount): continue
-        cand = bokf_df[
-            (bokf_df["Datum"].dt.date == b_date) &
-            (~bokf_df["BokfRowID"].isin(used_bokf_ids)) &
-            (bokf_df["Period SEK"].round(2) == amount)
-        ].copy()
-        if len(cand) >= 1:
-            chosen = cand.sort_values("BokfRowID").iloc[[0]]
-            used_bokf_ids |= set(chosen["BokfRowID"])
-            b2,f2,_ = stamp_match(pd.DataFrame([b]), chosen, "K4", counters)
-            matched_bank_rows.append(b2.iloc[0]); matched_bokf_rows.append(f2.iloc[0])
-
-    matched_bank = pd.DataFrame(matched_bank_rows) if matched_bank_rows else bank_k4.iloc[0:0].copy()
-    matched_bokf = pd.DataFrame(matched_bokf_rows) if matched_bokf_rows else bokf_df.iloc[0:0].copy()
+def run_category4_ovrigt(bank_df, bokf_df, counters, bank_idx=None, bokf_idx=None):
+    bank_idx = _day_index(bank_df, bank_idx)
+    bokf_idx = _day_index(bokf_df, bokf_idx)
+    k1_k3 = text_class(bank_df, TEXT_BG5378 | TEXT_BG5341 | TEXT_REF35)
+    bank_k4 = bank_df[~k1_k3 & bank_idx.free(bank_df)]
+    matched_bank, matched_bokf = match_one_to_one(bank_k4, bokf_df[bokf_idx.free(bokf_df)], "K4", counters)
+    bank_idx.consume(matched_bank); bokf_idx.consume(matched_bokf)
     return matched_bank, matched_bokf
 
 # =============================== K5 (LB – 6 steg) =====================
-def run_category5_LB(bank_df: pd.DataFrame, bokf_df: pd.DataFrame, counters=None):
+def _k5_day(bank_sum, bokf_all):
+    # K5-stegen för en dag; returnerar etiketterna för valda bokf-rader eller None
+    try_match = lambda df_now, target_sum: sum_ore(df_now["__Öre__"]) == target_sum
+
+    # 1–3: alla
+    if not bokf_all.empty:
+        if try_match(bokf_all, bank_sum):
+            metric("K5.steg1"); return bokf_all.index
+        cand = rows_eq_ore(bokf_all, bank_sum, "Period SEK")
+        if len(cand) >= 1:
+            chosen = cand.sort_values("BokfRowID").iloc[[0]]
+            metric("K5.steg2"); return chosen.index
+        diff = sum_ore(bokf_all["__Öre__"]) - bank_sum
+        if diff != 0:
+            drop = bokf_all[bokf_all["__Öre__"] == diff]
+            if len(drop) >= 1:
+                drop_id = drop.sort_values("BokfRowID").iloc[0]["BokfRowID"]
+                remainder = bokf_all[bokf_all["BokfRowID"] != drop_id]
+                if try_match(remainder, bank_sum):
+                    metric("K5.steg3"); return remainder.index
+
+    # 4–6: endast negativa
+    bokf_neg = bokf_all[bokf_all["__Öre__"] < 0]
+    if not bokf_neg.empty:
+        if try_match(bokf_neg, bank_sum):
+            metric("K5.steg4"); return bokf_neg.index
+        cand = rows_eq_ore(bokf_neg, bank_sum, "Period SEK")
+        if len(cand) >= 1:
+            chosen = cand.sort_values("BokfRowID").iloc[[0]]
+            metric("K5.steg5"); return chosen.index
+        diff = sum_ore(bokf_neg["__Öre__"]) - bank_sum
+        if diff != 0:
+            drop = bokf_neg[bokf_neg["__Öre__"] == diff]
+            if len(drop) >= 1:
+                drop_id = drop.sort_values("BokfRowID").iloc[0]["BokfRowID"]
+                remainder = bokf_neg[bokf_neg["BokfRowID"] != drop_id]
+                if try_match(remainder, bank_sum):
+                    metric("K5.steg6"); return remainder.index
+    return None
+
+def run_category5_LB(bank_df: pd.DataFrame, bokf_df: pd.DataFrame, counters=None, bank_idx=None, bokf_idx=None, workers=None):
     if counters is None: counters = {}
-    bank_lb = bank_df[bank_df["Text"].astype(str).str.match(r"^\s*LB", case=False, na=False)].copy()
+    bank_idx = _day_index(bank_df, bank_idx)
+    bokf_idx = _day_index(bokf_df, bokf_idx)
+    bank_lb = bank_df[text_class(bank_df, TEXT_LB) & bank_idx.free(bank_df)].copy()
 
     matched_bank_all, matched_bokf_all = [], []
-    used_bokf_ids: set[int] = set()
 
-    def try_match(df_now: pd.DataFrame, target_sum: float) -> bool:
-        return math.isclose(sum_sek(df_now["Period SEK"]), target_sum, abs_tol=0.005)
+    days, tasks = [], []
+    for bank_day, bank_day_rows in iter_days(bank_lb):
+        bokf_day = bokf_idx.rows(bank_day)
+        if bokf_day.empty: continue
+        days.append((bank_day_rows.sort_values("BankRowID"), bokf_day))
+        tasks.append((sum_ore(bank_day_rows["__Öre__"]), bokf_day))
 
-    for _, bank_day_rows in bank_lb.groupby(bank_lb["Bokföringsdatum"].dt.date):
-        bank_day_rows = bank_day_rows.sort_values("BankRowID")
-        bank_sum = sum_sek(bank_day_rows["Belopp"])
-
-        def get_bokf_rows(neg_only: bool) -> pd.DataFrame:
-            q = (bokf_df["Datum"].dt.date == bank_day_rows["Bokföringsdatum"].dt.date.iloc[0]) & (~bokf_df["BokfRowID"].isin(used_bokf_ids))
-            if neg_only:
-                q = q & (bokf_df["Period SEK"] < 0)
-            return bokf_df[q].copy()
-
-        # 1–3: alla
-        bokf_all = get_bokf_rows(neg_only=False)
-        if not bokf_all.empty:
-            if try_match(bokf_all, bank_sum):
-                b,f,_ = stamp_match(bank_day_rows, bokf_all, "K5", counters)
-                matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(bokf_all["BokfRowID"]); continue
-            cand = bokf_all[bokf_all["Period SEK"].round(2) == bank_sum]
-            if len(cand) >= 1:
-                chosen = cand.sort_values("BokfRowID").iloc[[0]]
-                b,f,_ = stamp_match(bank_day_rows, chosen, "K5", counters)
-                matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(chosen["BokfRowID"]); continue
-            diff = sek_round(sum_sek(bokf_all["Period SEK"]) - bank_sum)
-            if diff != 0:
-                drop = bokf_all[bokf_all["Period SEK"].round(2) == diff]
-                if len(drop) >= 1:
-                    drop_id = drop.sort_values("BokfRowID").iloc[0]["BokfRowID"]
-                    remainder = bokf_all[bokf_all["BokfRowID"] != drop_id]
-                    if try_match(remainder, bank_sum):
-                        b,f,_ = stamp_match(bank_day_rows, remainder, "K5", counters)
-                        matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(remainder["BokfRowID"]); continue
-
-        # 4–6: endast negativa
-        bokf_neg = get_bokf_rows(neg_only=True)
-        if not bokf_neg.empty:
-            if try_match(bokf_neg, bank_sum):
-                b,f,_ = stamp_match(bank_day_rows, bokf_neg, "K5", counters)
-                matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(bokf_neg["BokfRowID"]); continue
-            cand = bokf_neg[bokf_neg["Period SEK"].round(2) == bank_sum]
-            if len(cand) >= 1:
-                chosen = cand.sort_values("BokfRowID").iloc[[0]]
-                b,f,_ = stamp_match(bank_day_rows, chosen, "K5", counters)
-                matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(chosen["BokfRowID"]); continue
-            diff = sek_round(sum_sek(bokf_neg["Period SEK"]) - bank_sum)
-            if diff != 0:
-                drop = bokf_neg[bokf_neg["Period SEK"].round(2) == diff]
-                if len(drop) >= 1:
-                    drop_id = drop.sort_values("BokfRowID").iloc[0]["BokfRowID"]
-                    remainder = bokf_neg[bokf_neg["BokfRowID"] != drop_id]
-                    if try_match(remainder, bank_sum):
-                        b,f,_ = stamp_match(bank_day_rows, remainder, "K5", counters)
-                        matched_bank_all.append(b); matched_bokf_all.append(f); used_bokf_ids |= set(remainder["BokfRowID"]); continue
+    hits = run_days(_k5_day, tasks, workers)
+    metric("K5.dagar", len(tasks)); metric("K5.ingen_träff", sum(h is None for h in hits))
+    for (bank_day_rows, bokf_day), hit in zip(days, hits):
+        if hit is None: continue
+        chosen = bokf_day.loc[hit]
+        b,f,_ = stamp_match(bank_day_rows, chosen, "K5", counters)
+        matched_bank_all.append(b); matched_bokf_all.append(f); bokf_idx.consume(chosen)
 
     matched_bank = pd.concat(matched_bank_all, ignore_index=True) if matched_bank_all else bank_lb.iloc[0:0].copy()
     matched_bokf = pd.concat(matched_bokf_all, ignore_index=True) if matched_bokf_all else bokf_df.iloc[0:0].copy()
+    bank_idx.consume(matched_bank)
     return matched_bank, matched_bokf
 
 # ========================== K5X (NY – Global balans, utbyggd) ==========================
+def _half_sums(vals) -> np.ndarray:
+    # Alla delmängdssummor för en halva; position = bitmask (bit j <-> vals[j])
+    sums = np.zeros(1, dtype=np.int64)
+    for v in vals:
+        sums = np.concatenate((sums, sums + v))
+    return sums
+
+def _mitm_join(left_vals, right_vals, target_cents):
+    # Per summa behålls minsta bitmask (första förekomst); vänstersidan gås igenom i
+    # maskordning – samma val som den tidigare dict/set-varianten gjorde.
+    l_sum, l_mask = np.unique(_half_sums(left_vals), return_index=True)
+    r_sum, r_mask = np.unique(_half_sums(right_vals), return_index=True)
+    need = target_cents - l_sum
+    j = np.minimum(np.searchsorted(r_sum, need), len(r_sum) - 1)
+    hit = r_sum[j] == need
+    if not hit.any():
+        return None
+    best = int(np.argmin(np.where(hit, l_mask, np.iinfo(np.int64).max)))
+    return int(l_mask[best]), int(r_mask[j[best]])
+
+def _mask_ids(mask, ids):
+    return {i for bit, i in enumerate(ids) if mask >> bit & 1}
+
 def subset_sum_mitm(values_cents, ids, target_cents, max_rows=50):
     """
     Meet-in-the-middle:
       - Om n ≤ 26: full MITM (två halvor fullständigt).
       - Om 27–50: använd topp 34 med störst |belopp| (17+17) för MITM.
       - Returnerar set(ids) som ska EXKLUDERAS för att "resten" ska bli target.
+    Halvorna hålls som int64-summor indexerade på bitmask; sort + searchsorted gör
+    joinen och id:n avkodas bara för den vinnande masken.
     """
     n = len(values_cents)
     if n == 0:
         return None
     # Välj de max_rows största i absolutbelopp
     order = sorted(range(n), key=lambda i: abs(values_cents[i]), reverse=True)[:min(n, max_rows)]
-    values_cents = [values_cents[i] for i in order]
+    values_cents = [int(values_cents[i]) for i in order]
     ids = [ids[i] for i in order]
     n = len(values_cents)
 
@@ -617,70 +1362,234 @@ def subset_sum_mitm(values_cents, ids, target_cents, max_rows=50):
         return set()
 
     if n <= 26:
-        k = n // 2
-        left_vals, left_ids = values_cents[:k], ids[:k]
-        right_vals, right_ids = values_cents[k:], ids[k:]
-
-        left_sums = {0: set()}
-        for v, i in zip(left_vals, left_ids):
-            new = {}
-            for s, comb in left_sums.items():
-                ns = s + v
-                if ns not in left_sums and ns not in new:
-                    new[ns] = comb | {i}
-            left_sums.update(new)
-
-        right_sums = {0: set()}
-        for v, i in zip(right_vals, right_ids):
-            new = {}
-            for s, comb in right_sums.items():
-                ns = s + v
-                if ns not in right_sums and ns not in new:
-                    new[ns] = comb | {i}
-            right_sums.update(new)
-
-        for sL, combL in left_sums.items():
-            need = target_cents - sL
-            if need in right_sums:
-                return combL | right_sums[need]
-        return None
+        k, take = n // 2, n
     else:
         # 27–50 → ta topp 34 (17+17) för kontrollerbar MITM
-        take = min(34, n)
-        left_vals, left_ids = values_cents[:17], ids[:17]
-        right_vals, right_ids = values_cents[17:take], ids[17:take]
-
-        left_sums = {0: set()}
-        for v, i in zip(left_vals, left_ids):
-            new = {}
-            for s, comb in left_sums.items():
-                ns = s + v
-                if ns not in left_sums and ns not in new:
-                    new[ns] = comb | {i}
-            left_sums.update(new)
-
-        right_sums = {0: set()}
-        for v, i in zip(right_vals, right_ids):
-            new = {}
-            for s, comb in right_sums.items():
-                ns = s + v
-                if ns not in right_sums and ns not in new:
-                    new[ns] = comb | {i}
-            right_sums.update(new)
-
-        for sL, combL in left_sums.items():
-            need = target_cents - sL
-            if need in right_sums:
-                return combL | right_sums[need]
+        k, take = 17, min(34, n)
+    metric("mitm.anrop"); observe("mitm.halva_vänster", 1 << k); observe("mitm.halva_höger", 1 << (take - k))
+    hit = _mitm_join(values_cents[:k], values_cents[k:take], target_cents)
+    if hit is None:
         return None
+    mask_l, mask_r = hit
+    return _mask_ids(mask_l, ids[:k]) | _mask_ids(mask_r, ids[k:take])
+
+# Stor-dag-lösaren (dagar med > MITM_FULL_ROWS rader, där MITM bara ser topp 34)
+MITM_FULL_ROWS = 34  # upp till så många rader söker subset_sum_mitm igenom alla (17+17 eller n//2)
+K5X_LARGE_TIME_BUDGET = 0.5       # sekunder per dag och sida
+K5X_LARGE_TOTAL_BUDGET = 30.0     # sekunder (väggtid) för hela K5X-steget; sedan ges resten av stordagarna upp
+K5X_LARGE_MAX_STATES = 1_000_000  # nåbara summor i DP-steget (8 byte/summa)
+K6_TIME_BUDGET = 0.2              # sekunder per dagsgruppsökning i K6
+K6_WINDOW_DAYS = 7                # pass 2: motdagar ligger högst så många dagar från ankardagen
+K6_MAX_DAYS = 10                  # högst så många dagar per K6-grupp, ankardagen inräknad (färst föredras)
+K6_CANDIDATES = False             # True: pass 2-grupper stämplas K6_CANDIDATE_CAT ("Kandidat") i stället för K6
+K6_CANDIDATE_CAT = "K6K"          # K6-grupper med fler än 3 motdagar: förslag, inte match
+
+def _rest_bounds(vals):
+    # pos_rest[i]/neg_rest[i] = summan av positiva/negativa värden från position i och framåt
+    v = np.asarray(vals, dtype=np.int64)
+    pos_rest = np.r_[np.cumsum(np.clip(v, 0, None)[::-1])[::-1], 0]
+    neg_rest = np.r_[np.cumsum(np.clip(v, None, 0)[::-1])[::-1], 0]
+    return pos_rest, neg_rest
+
+def _subset_sum_dp(vals, target_cents, max_states, deadline):
+    # Gles DP över nåbara summor (sorterade int64-arrayer). steps[j] = summor som blev
+    # nåbara med rad j, vilket räcker för att rekonstruera en lösning. Summor som inte
+    # längre kan nå target med återstående rader kastas (exakt beskärning).
+    pos_rest, neg_rest = _rest_bounds(vals)
+    sums = np.zeros(1, dtype=np.int64)
+    steps = []
+    for j, v in enumerate(vals):
+        new = np.setdiff1d(sums + v, sums, assume_unique=True) if v else sums[:0]
+        steps.append(new)
+        sums = np.union1d(sums, new)
+        lo, hi = target_cents - pos_rest[j + 1], target_cents - neg_rest[j + 1]
+        sums = sums[np.searchsorted(sums, lo):np.searchsorted(sums, hi, side="right")]
+        if target_cents in new:
+            chosen, rest = [], target_cents
+            for k in range(j, -1, -1):
+                if rest == 0: break
+                pos = np.searchsorted(steps[k], rest)
+                if pos < len(steps[k]) and steps[k][pos] == rest:
+                    chosen.append(k); rest -= vals[k]
+            return chosen, "hit"
+        if len(sums) > max_states or time.perf_counter() > deadline:
+            return None, "budget"
+    return None, "none"
+
+def _subset_sum_dp_fewest(vals, target_cents, max_k, max_states, deadline):
+    # Som _subset_sum_dp men med minsta antal rader per nåbar summa (högst max_k). Alla rader
+    # gås igenom, så träffen har så få rader som möjligt. steps[j] = (summor, antal) som blev
+    # nåbara eller fick färre rader med rad j; en summas antal vid steg j är dess senaste post.
+    # Extra beskärning: resten till target måste nås med de lim - antal största återstående,
+    # där lim = max_k eller (efter en träff) ett färre än träffens antal.
+    n = len(vals)
+    pos_rest, neg_rest = _rest_bounds(vals)
+    abs_rest = np.r_[np.cumsum(np.abs(np.asarray(vals, dtype=np.int64))[::-1])[::-1], 0]
+    sums = cnt = np.zeros(1, dtype=np.int64)
+    steps, lim = [], max_k
+    for j, v in enumerate(vals):
+        ok = cnt < lim if v else np.zeros(len(cnt), dtype=bool)
+        all_s, all_c = np.r_[sums, sums[ok] + v], np.r_[cnt, cnt[ok] + 1]
+        order = np.lexsort((all_c, all_s))
+        all_s, all_c = all_s[order], all_c[order]
+        first = np.r_[True, all_s[1:] != all_s[:-1]] if len(all_s) else all_s.astype(bool)
+        new_s, new_c = all_s[first], all_c[first]
+        at = np.minimum(np.searchsorted(sums, new_s), len(sums) - 1) if len(sums) else None
+        better = (sums[at] != new_s) | (cnt[at] > new_c) if len(sums) else np.ones(len(new_s), dtype=bool)
+        steps.append((new_s[better], new_c[better]))
+        lo, hi = target_cents - pos_rest[j + 1], target_cents - neg_rest[j + 1]
+        a, b = np.searchsorted(new_s, lo), np.searchsorted(new_s, hi, side="right")
+        sums, cnt = new_s[a:b], new_c[a:b]
+        keep = np.abs(target_cents - sums) <= abs_rest[np.clip(n - (lim - cnt), j + 1, n)]
+        sums, cnt = sums[keep], cnt[keep]
+        at = np.searchsorted(sums, target_cents)
+        if at < len(sums) and sums[at] == target_cents: lim = int(cnt[at]) - 1
+        if len(sums) > max_states or time.perf_counter() > deadline:
+            return None, "budget"
+    at = np.searchsorted(sums, target_cents)
+    if at == len(sums) or sums[at] != target_cents:
+        return None, "none"
+    chosen, rest, k = [], target_cents, len(vals) - 1
+    while rest:  # baklänges: senaste post för rest (steg k) → rad k är med, fortsätt före k
+        while True:
+            st_s = steps[k][0]
+            pos = np.searchsorted(st_s, rest)
+            if pos < len(st_s) and st_s[pos] == rest: break
+            k -= 1
+        chosen.append(k); rest -= vals[k]; k -= 1
+    return chosen, "hit"
+
+def _subset_sum_bnb(vals, target_cents, max_states, deadline, max_k=None):
+    # Branch-and-bound (rader sorterade på |belopp| fallande): gren kapas när behovet ligger
+    # utanför [återstående negativa, återstående positiva] eller inte nås med högst max_k
+    # rader; misslyckade (i, behov, antal tagna) cachas begränsat. "Hoppa över" prövas före
+    # "ta med" → små exkluderingsmängder hittas först.
+    n = len(vals)
+    pos_rest, neg_rest = (b.tolist() for b in _rest_bounds(vals))
+    max_k = n if max_k is None else max_k
+    abs_cum = np.r_[0, np.cumsum(np.abs(np.asarray(vals, dtype=np.int64)))].tolist()
+    failed, taken, nodes = set(), [], 0
+    stack = [[0, target_cents, 0]]
+    while stack:
+        fr = stack[-1]
+        i, need, phase = fr
+        if phase == 0:
+            nodes += 1
+            if not nodes & 0xFFF and time.perf_counter() > deadline:
+                return None, "budget"
+            if need == 0:
+                return list(taken), "hit"
+            left = max_k - len(taken)
+            if (i == n or left == 0 or need < neg_rest[i] or need > pos_rest[i]
+                    or abs(need) > abs_cum[min(n, i + left)] - abs_cum[i] or (i, need, len(taken)) in failed):
+                stack.pop(); continue
+            fr[2] = 1; stack.append([i + 1, need, 0])
+        elif phase == 1:
+            fr[2] = 2; taken.append(i); stack.append([i + 1, need - vals[i], 0])
+        else:
+            taken.pop()
+            if len(failed) < max_states: failed.add((i, need, len(taken)))
+            stack.pop()
+    return None, "none"
 
-def run_category5X_global(bank_df: pd.DataFrame, bokf_df: pd.DataFrame, counters=None):
+def subset_sum_large(values_cents, ids, target_cents, time_budget=None, max_states=None, max_k=None):
+    """
+    Exakt delmängdssumma över ALLA rader (för stora dagar där subset_sum_mitm kapar):
+      1) gles DP över nåbara summor (minsta |belopp| först) så länge de ryms i max_states,
+      2) annars branch-and-bound tills time_budget sekunder har gått.
+    max_k: högst så många rader i lösningen, och då den med färst rader (DP:n håller minsta
+    antal per summa, branch-and-bound körs med växande gräns 1..max_k).
+    Returnerar (set(ids) att exkludera | None, status) med status "hit", "none" eller
+    "budget" (gav upp – tids- eller minnesbudgeten tog slut).
+    """
+    time_budget = K5X_LARGE_TIME_BUDGET if time_budget is None else time_budget
+    max_states = K5X_LARGE_MAX_STATES if max_states is None else max_states
+    if target_cents == 0:
+        return set(), "hit"
+    deadline = time.perf_counter() + time_budget
+    order = sorted(range(len(values_cents)), key=lambda i: abs(values_cents[i]))
+    vals = [int(values_cents[i]) for i in order]
+    if max_k is None:
+        chosen, status = _subset_sum_dp(vals, target_cents, max_states, deadline)
+    else:
+        chosen, status = _subset_sum_dp_fewest(vals, target_cents, max_k, max_states, deadline)
+    if status == "budget" and time.perf_counter() < deadline:
+        order = order[::-1]
+        vals = vals[::-1]
+        for k in ([None] if max_k is None else range(1, max_k + 1)):
+            chosen, status = _subset_sum_bnb(vals, target_cents, max_states, deadline, k)
+            if status != "none": break
+    metric(f"subset_sum_large.{status}")
+    if chosen is None:
+        return None, status
+    return {ids[order[k]] for k in chosen}, status
+
+def _k5x_exclude(cents, ids, target_cents, side, stop=None):
+    # MITM först (oförändrat beteende); stor dag utan träff → exakt lösare över alla rader.
+    # stop: time.time() då K5X-stegets totalbudget är slut (väggtid, gemensam för poolprocesserna).
+    # Uppgivna sökningar räknas i körstatistiken (K5X.gav_upp.<sida>) – den kommer också
+    # tillbaka från poolprocesserna, vilket en varning inte gör.
+    exclude = subset_sum_mitm(cents, ids, target_cents, max_rows=50)
+    if exclude is None and len(cents) > MITM_FULL_ROWS:
+        budget = K5X_LARGE_TIME_BUDGET if stop is None else min(K5X_LARGE_TIME_BUDGET, stop - time.time())
+        if budget > 0:
+            exclude, status = subset_sum_large(cents, ids, target_cents, time_budget=budget)
+        else:
+            status = "budget"; metric("K5X.totalbudget_slut")
+        if status == "budget":
+            metric(f"K5X.gav_upp.{side}"); observe("K5X.gav_upp_rader", len(cents))
+    return exclude
+
+def _k5x_day(b_day, f_day, stop=None):
+    # K5X-stegen för en dag; returnerar (bank-, bokf-etiketter) för gruppen eller None
+    bank_sum = sum_ore(b_day["__Öre__"])
+    bokf_sum = sum_ore(f_day["__Öre__"])
+    diff = bokf_sum - bank_sum
+
+    # ---- Steg 1 (BOKF: singel == diff)
+    one = rows_eq_ore(f_day, diff, "Period SEK")
+    if not one.empty:
+        drop_id = one.sort_values("BokfRowID").iloc[0]["BokfRowID"]
+        remainder_f = f_day[f_day["BokfRowID"] != drop_id]
+        if sum_ore(remainder_f["__Öre__"]) == bank_sum:
+            metric("K5X.steg1"); return b_day.index, remainder_f.index
+
+    # ---- Steg 2 (BOKF: MITM == diff)
+    cents = f_day["__Öre__"].tolist()
+    ids  = f_day["BokfRowID"].tolist()
+    exclude = _k5x_exclude(cents, ids, diff, "BOKF", stop)
+    if exclude is not None:
+        remainder_f = f_day[~f_day["BokfRowID"].isin(exclude)]
+        if sum_ore(remainder_f["__Öre__"]) == bank_sum:
+            metric("K5X.steg2"); return b_day.index, remainder_f.index
+
+    # ---- Steg 1B (BANK: singel == -diff)
+    one_bank = rows_eq_ore(b_day, -diff, "Belopp")
+    if not one_bank.empty:
+        drop_bid = one_bank.sort_values("BankRowID").iloc[0]["BankRowID"]
+        remainder_b = b_day[b_day["BankRowID"] != drop_bid]
+        if bokf_sum == sum_ore(remainder_b["__Öre__"]):
+            metric("K5X.steg1B"); return remainder_b.index, f_day.index
+
+    # ---- Steg 2B (BANK: MITM == -diff)
+    cents_b = b_day["__Öre__"].tolist()
+    ids_b  = b_day["BankRowID"].tolist()
+    exclude_b = _k5x_exclude(cents_b, ids_b, -diff, "BANK", stop)  # OBS: -diff
+    if exclude_b is not None:
+        remainder_b = b_day[~b_day["BankRowID"].isin(exclude_b)]
+        if bokf_sum == sum_ore(remainder_b["__Öre__"]):
+            metric("K5X.steg2B"); return remainder_b.index, f_day.index
+    return None
+
+def run_category5X_global(bank_df: pd.DataFrame, bokf_df: pd.DataFrame, counters=None, bank_idx=None, bokf_idx=None, workers=None):
     """
     K5X PER DATUM (symmetrisk):
       - Bankurval: Alla återstående bankrader för dagen
       - Bokföringsurval: Alla återstående bokföringsrader för dagen
       Steg 1  (BOKF): EN bokf-rad == diff -> ta bort den, matcha resten
       Steg 2  (BOKF): MITM(bokf) == diff  -> ta bort dem, matcha resten
+                      (> 34 rader utan MITM-träff: exakt stor-dag-lösare, se subset_sum_large;
+                       högst K5X_LARGE_TIME_BUDGET per dag och K5X_LARGE_TOTAL_BUDGET totalt)
       Steg 1B (BANK): EN bankrad == -diff -> ta bort den, matcha resten
       Steg 2B (BANK): MITM(bank) == -diff -> ta bort dem, matcha resten
     """
@@ -691,128 +1600,103 @@ def run_category5X_global(bank_df: pd.DataFrame, bokf_df: pd.DataFrame, counters
     matched_bank_all, matched_bokf_all = [], []
 
     # Samla alla datum som finns kvar på någon sida
-    bank_dates = set(bank_df.dropna(subset=["Bokföringsdatum"])["Bokföringsdatum"].dt.date)
-    bokf_dates = set(bokf_df.dropna(subset=["Datum"])["Datum"].dt.date)
-    all_dates = sorted(bank_dates | bokf_dates)
+    bank_idx = _day_index(bank_df, bank_idx)
+    bokf_idx = _day_index(bokf_df, bokf_idx)
+    all_dates = sorted(set(bank_idx.days()) | set(bokf_idx.days()))
 
+    # Varje dag behandlas en gång och en dags rader finns bara under den dagen,
+    # så dagarna kan lösas oberoende (ev. parallellt) och stämplas i datumordning.
+    tasks, stop = [], time.time() + K5X_LARGE_TOTAL_BUDGET
     for d in all_dates:
-        b_day = bank_df[bank_df["Bokföringsdatum"].dt.date == d].copy()
-        f_day = bokf_df[bokf_df["Datum"].dt.date == d].copy()
+        b_day = bank_idx.rows(d)
+        f_day = bokf_idx.rows(d)
         if b_day.empty or f_day.empty:
             continue
+        tasks.append((b_day, f_day, stop))
 
-        bank_sum = sum_sek(b_day["Belopp"])
-        bokf_sum = sum_sek(f_day["Period SEK"])
-        diff = sek_round(bokf_sum - bank_sum)
-
-        # ---- Steg 1 (BOKF: singel == diff)
-        one = f_day[f_day["Period SEK"].round(2) == diff]
-        if not one.empty:
-            drop_id = one.sort_values("BokfRowID").iloc[0]["BokfRowID"]
-            remainder_f = f_day[f_day["BokfRowID"] != drop_id]
-            if math.isclose(sum_sek(remainder_f["Period SEK"]), bank_sum, abs_tol=0.005):
-                b,f,_ = stamp_match(b_day, remainder_f, "K5X", counters)
-                matched_bank_all.append(b); matched_bokf_all.append(f)
-                # ta bort dagens träffade rader från fortsatta försök
-                bank_df = bank_df[~bank_df["BankRowID"].isin(b["BankRowID"])]
-                bokf_df = bokf_df[~bokf_df["BokfRowID"].isin(f["BokfRowID"])]
-                continue
-
-        # ---- Steg 2 (BOKF: MITM == diff)
-        vals = f_day["Period SEK"].fillna(0).round(2).tolist()
-        ids  = f_day["BokfRowID"].tolist()
-        cents = [int(round(v*100)) for v in vals]
-        target_cents = int(round(diff*100))
-        exclude = subset_sum_mitm(cents, ids, target_cents, max_rows=50)
-        if exclude is not None:
-            remainder_f = f_day[~f_day["BokfRowID"].isin(exclude)]
-            if math.isclose(sum_sek(remainder_f["Period SEK"]), bank_sum, abs_tol=0.005):
-                b,f,_ = stamp_match(b_day, remainder_f, "K5X", counters)
-                matched_bank_all.append(b); matched_bokf_all.append(f)
-                bank_df = bank_df[~bank_df["BankRowID"].isin(b["BankRowID"])]
-                bokf_df = bokf_df[~bokf_df["BokfRowID"].isin(f["BokfRowID"])]
-                continue
-
-        # ---- Steg 1B (BANK: singel == -diff)
-        one_bank = b_day[b_day["Belopp"].round(2) == -diff]
-        if not one_bank.empty:
-            drop_bid = one_bank.sort_values("BankRowID").iloc[0]["BankRowID"]
-            remainder_b = b_day[b_day["BankRowID"] != drop_bid]
-            if math.isclose(sum_sek(f_day["Period SEK"]), sum_sek(remainder_b["Belopp"]), abs_tol=0.005):
-                b,f,_ = stamp_match(remainder_b, f_day, "K5X", counters)
-                matched_bank_all.append(b); matched_bokf_all.append(f)
-                bank_df = bank_df[~bank_df["BankRowID"].isin(b["BankRowID"])]
-                bokf_df = bokf_df[~bokf_df["BokfRowID"].isin(f["BokfRowID"])]
-                continue
-
-        # ---- Steg 2B (BANK: MITM == -diff)
-        vals_b = b_day["Belopp"].fillna(0).round(2).tolist()
-        ids_b  = b_day["BankRowID"].tolist()
-        cents_b = [int(round(v*100)) for v in vals_b]
-        target_b_cents = int(round(-diff*100))  # OBS: -diff
-        exclude_b = subset_sum_mitm(cents_b, ids_b, target_b_cents, max_rows=50)
-        if exclude_b is not None:
-            remainder_b = b_day[~b_day["BankRowID"].isin(exclude_b)]
-            if math.isclose(sum_sek(f_day["Period SEK"]), sum_sek(remainder_b["Belopp"]), abs_tol=0.005):
-                b,f,_ = stamp_match(remainder_b, f_day, "K5X", counters)
-                matched_bank_all.append(b); matched_bokf_all.append(f)
-                bank_df = bank_df[~bank_df["BankRowID"].isin(b["BankRowID"])]
-                bokf_df = bokf_df[~bokf_df["BokfRowID"].isin(f["BokfRowID"])]
-                continue
+    hits = run_days(_k5x_day, tasks, workers)
+    metric("K5X.dagar", len(tasks)); metric("K5X.ingen_träff", sum(h is None for h in hits))
+    for (b_day, f_day, _), hit in zip(tasks, hits):
+        if hit is None: continue
+        b,f,_ = stamp_match(b_day.loc[hit[0]], f_day.loc[hit[1]], "K5X", counters)
+        matched_bank_all.append(b); matched_bokf_all.append(f)
 
     matched_bank = pd.concat(matched_bank_all, ignore_index=True) if matched_bank_all else bank_df.iloc[0:0].copy()
     matched_bokf = pd.concat(matched_bokf_all, ignore_index=True) if matched_bokf_all else bokf_df.iloc[0:0].copy()
+    bank_idx.consume(matched_bank); bokf_idx.consume(matched_bokf)
     return matched_bank, matched_bokf
 
 
 # =============================== K6 (symmetrisk) ======================
-def run_category6_symmetric(bank_df, bokf_df, counters):
-    if bank_df.empty and bokf_df.empty:
-        return bank_df.iloc[0:0].copy(), bokf_df.iloc[0:0].copy()
+def _day_totals(bank_rem, bokf_rem) -> dict:
+    # Dagssaldo i öre (bokf − bank) per dag för restraderna; rader utan datum räknas inte
+    bank_sum = (-bank_rem["__Öre__"]).groupby(bank_rem["__Dag__"]).sum().drop(NO_DAY, errors="ignore")
+    bokf_sum = bokf_rem["__Öre__"].groupby(bokf_rem["__Dag__"]).sum().drop(NO_DAY, errors="ignore")
+    all_dates = sorted(set(bank_sum.index) | set(bokf_sum.index))
+    return {d: int(bank_sum.get(d,0) + bokf_sum.get(d,0)) for d in all_dates}
 
-    bank_df = bank_df.copy(); bank_df["__flip__"] = -bank_df["Belopp"]
-    bank_sum = bank_df.dropna(subset=["Bokföringsdatum"]).groupby(bank_df["Bokföringsdatum"].dt.date)["__flip__"].sum().round(2)
-    bokf_sum = bokf_df.dropna(subset=["Datum"]).groupby(bokf_df["Datum"].dt.date)["Period SEK"].sum().round(2)
+def run_category6_symmetric(bank_df, bokf_df, counters, bank_idx=None, bokf_idx=None):
+    """
+    K6 på resten: dagar vars dagssaldo (bokf − bank) är 0 stämplas var för sig; obalanserade
+    dagar paras över dagar – en ankardag mot motdagar med motsatt saldo:
+      Pass 1: 1–3 motdagar (find_removal) ur hela perioden för ALLA ankardagar, plus- sedan
+              minusdagar → "K6"
+      Pass 2: fler motdagar (högst K6_MAX_DAYS dagar i gruppen, färst möjliga) inom
+              ±K6_WINDOW_DAYS för de ankare som är kvar → "K6"; med K6_CANDIDATES stämplas
+              de K6_CANDIDATE_CAT ("Kandidat" i Kombinerad) för manuell granskning i stället.
+    """
+    bank_idx = _day_index(bank_df, bank_idx)
+    bokf_idx = _day_index(bokf_df, bokf_idx)
+    bank_rem, bokf_rem = bank_idx.remaining(), bokf_idx.remaining()
+    if bank_rem.empty and bokf_rem.empty:
+        return bank_df.iloc[0:0].copy(), bokf_df.iloc[0:0].copy()
 
-    all_dates = sorted(set(bank_sum.index) | set(bokf_sum.index))
-    totals = {d: round(float(bank_sum.get(d,0.0) + bokf_sum.get(d,0.0)), 2) for d in all_dates}
-    matched_dates = set(d for d,t in totals.items() if math.isclose(t, 0.0, abs_tol=0.005))
+    totals = _day_totals(bank_rem, bokf_rem)
+    matched_dates = set(d for d,t in totals.items() if t == 0)
+    metric("K6.balanserade_dagar", len(matched_dates))
 
-    rem = {d:t for d,t in totals.items() if d not in matched_dates and not math.isclose(t,0.0, abs_tol=0.005)}
-    plus_days  = [(d,t) for d,t in rem.items() if t > 0]
+    rem = {d:t for d,t in totals.items() if d not in matched_dates}
+    plus_days  = [(d,t) for d,t in rem.items() if t > 0]   # dagsordning (totals är sorterad)
     minus_days = [(d,t) for d,t in rem.items() if t < 0]
 
     used_plus, used_minus, combo_groups = set(), set(), []
 
-    def find_subset_sum(items_pos, target_pos, max_k=10, max_combos=2000):
-        tried = 0
+    def window(days, anchor, used, many):
+        # Oanvända motdagar (dag, |saldo|); pass 2 bara dag i [anchor − K6_WINDOW_DAYS, anchor + K6_WINDOW_DAYS]
+        lo, hi = 0, len(days)
+        if many:
+            lo = bisect.bisect_left(days, (anchor - K6_WINDOW_DAYS,))
+            hi = bisect.bisect_right(days, (anchor + K6_WINDOW_DAYS, float("inf")))
+        return [(d, abs(v)) for d, v in days[lo:hi] if d not in used]
+
+    def find_subset_sum(items_pos, target_pos, many):
+        # Dagsbelopp (öre) fallande. many=False: 1–3 dagar via hashuppslag (samma val som
+        # uppräkningen i kombinationsordning); many=True: exakt delmängdssumma med högst
+        # K6_MAX_DAYS − 1 motdagar, färst möjliga.
+        metric("K6.försök")
         values = sorted(items_pos, key=lambda x: x[1], reverse=True)
-        for r in range(1, min(max_k, len(values)) + 1):
-            for combo in itertools.combinations(values, r):
-                tried += 1
-                if tried > max_combos: return None
-                s = round(sum(v for _, v in combo), 2)
-                if math.isclose(s, target_pos, abs_tol=0.005):
-                    return {d for d,_ in combo}
-        return None
-
-    for d_plus, v_plus in plus_days:
-        if d_plus in used_plus: continue
-        cand = [(d, abs(v)) for d,v in minus_days if d not in used_minus]
-        if not cand: continue
-        hit = find_subset_sum(cand, v_plus)
-        if hit:
-            used_plus.add(d_plus); used_minus |= hit
-            combo_groups.append({"dates": {d_plus, *hit}})
-
-    for d_minus, v_minus in minus_days:
-        if d_minus in used_minus: continue
-        cand = [(d, v) for d,v in plus_days if d not in used_plus]
-        if not cand: continue
-        hit = find_subset_sum(cand, abs(v_minus))
-        if hit:
-            used_minus.add(d_minus); used_plus |= hit
-            combo_groups.append({"dates": {d_minus, *hit}})
+        amounts = [v for _, v in values]
+        if not many:
+            combo = find_removal(amounts, target_pos, max_r=min(3, K6_MAX_DAYS - 1), tag="K6.find_removal")
+            if combo is None: return None
+            metric("K6.träff_1-3_dagar"); return {values[i][0] for i in combo}
+        hit, _ = subset_sum_large(amounts, [d for d, _ in values], target_pos, time_budget=K6_TIME_BUDGET,
+                                  max_k=K6_MAX_DAYS - 1)
+        if hit: metric("K6.träff_fler_dagar")
+        return hit or None
+
+    for many in ([False, True] if K6_MAX_DAYS > 4 else [False]):
+        cat = K6_CANDIDATE_CAT if many and K6_CANDIDATES else "K6"
+        for anchors, opposite, used_a, used_o in [(plus_days, minus_days, used_plus, used_minus),
+                                                  (minus_days, plus_days, used_minus, used_plus)]:
+            for d_anchor, v_anchor in anchors:
+                if d_anchor in used_a: continue
+                cand = window(opposite, d_anchor, used_o, many)
+                if not cand: continue
+                hit = find_subset_sum(cand, abs(v_anchor), many)
+                if hit:
+                    used_a.add(d_anchor); used_o |= hit
+                    combo_groups.append({"dates": {d_anchor, *hit}, "cat": cat})
 
     matched_dates |= set().union(*[g["dates"] for g in combo_groups]) if combo_groups else set()
 
@@ -820,8 +1704,8 @@ def run_category6_symmetric(bank_df, bokf_df, counters):
 
     single_dates = sorted(d for d in totals if d in matched_dates and all(d not in g["dates"] for g in combo_groups))
     for d in single_dates:
-        b_rows = bank_df[bank_df["Bokföringsdatum"].dt.date == d].copy()
-        f_rows = bokf_df[bokf_df["Datum"].dt.date == d].copy()
+        b_rows = bank_idx.rows(d)
+        f_rows = bokf_idx.rows(d)
         if b_rows.empty and f_rows.empty: continue
         b2,f2,_ = stamp_match(b_rows, f_rows, "K6", counters)
         if not b2.empty: matched_bank.append(b2)
@@ -829,150 +1713,396 @@ def run_category6_symmetric(bank_df, bokf_df, counters):
 
     for _, g in enumerate(combo_groups, start=1):
         dset = g["dates"]
-        b_rows = bank_df[bank_df["Bokföringsdatum"].dt.date.isin(dset)].copy()
-        f_rows = bokf_df[bokf_df["Datum"].dt.date.isin(dset)].copy()
+        b_rows = bank_idx.rows(sorted(dset))
+        f_rows = bokf_idx.rows(sorted(dset))
         if b_rows.empty and f_rows.empty: continue
-        b2,f2,_ = stamp_match(b_rows, f_rows, "K6", counters)
+        b2,f2,_ = stamp_match(b_rows, f_rows, g["cat"], counters)
         if not b2.empty: matched_bank.append(b2)
         if not f2.empty: matched_bokf.append(f2)
 
     matched_bank = pd.concat(matched_bank, ignore_index=True) if matched_bank else bank_df.iloc[0:0].copy()
     matched_bokf = pd.concat(matched_bokf, ignore_index=True) if matched_bokf else bokf_df.iloc[0:0].copy()
+    bank_idx.consume(matched_bank); bokf_idx.consume(matched_bokf)
     return matched_bank, matched_bokf
 
+# ============================== Pipeline ==============================
+STAGES = {}  # namn -> (K-steg, dagsparallellt, dagsöverskridande); registreringsordningen är standardordningen
+STAGE_CATS = {}  # namn -> MatchKategori som steget stämplar
+
+def register_stage(name: str, func, day_parallel: bool = False, cross_day: bool = False, cats=None):
+    # func har K-stegens signatur: func(bank_df, bokf_df, counters, bank_idx=, bokf_idx=[, workers=])
+    # och förbrukar själv sina träffar i indexen. day_parallel=True -> får processpoolen som workers=.
+    # cross_day=True: steget parar rader från olika dagar ur hela resten (K6) – vid inkrementell
+    # körning ser det alla omatchade rader och hoppas över om restens dagssaldon är oförändrade.
+    # cats: MatchKategori-värdena steget stämplar (None = bara name), t.ex. K6:s kandidatgrupper.
+    STAGES[name] = (func, day_parallel, cross_day)
+    STAGE_CATS[name] = tuple(cats) if cats is not None else (name,)
+
+register_stage("K1", run_category1_BG53782751, day_parallel=True)
+register_stage("K2", run_category2_BG5341_7689)
+register_stage("K3", run_category3_35ref)
+register_stage("K4", run_category4_ovrigt)
+register_stage("K5", run_category5_LB, day_parallel=True)
+register_stage("K5X", run_category5X_global, day_parallel=True)
+register_stage("K6", run_category6_symmetric, cross_day=True, cats=("K6", K6_CANDIDATE_CAT))
+
+class ReconciliationPipeline:
+    """
+    Kör K-stegen i ordning över inlästa ramar (load_bank/load_bokf) med delade dagsindex och counters.
+      pipe = ReconciliationPipeline(stages=None, workers=None).run(bank_all, bokf_all)
+      komb = pipe.combined()
+    stages: stegnamn i körordning (None = alla i STAGES) – stäng av/kasta om för experiment.
+    workers: processer för de dagsvisa stegen (se run_days/day_pool).
+    progress: RunProgress som får aktuellt steg, dagar klara/totalt och matchade rader; dess
+    cancel() avbryter körningen med RunCancelled.
+    Efter run(): matched_bank/matched_bokf, counters och stats (en dict per steg: väggtid, CPU-tid
+    i huvudprocessen, fria rader in/ut, matchade rader per sida och toppminne om en RunMetrics
+    med memory=True är aktiv – stats hamnar då också i dess rapport).
+    Inkrementellt: run(bank_all, bokf_all, state=MatchState.load(p)) återanvänder förra körningens
+    grupper för oförändrade dagar och kör K-stegen bara för dirty_days; MatchState.from_pipeline(pipe)
+    ger läget att spara till nästa gång.
+    """
+    def __init__(self, stages=None, workers=None, progress: RunProgress = None):
+        self.stages = list(STAGES) if stages is None else list(stages)
+        unknown = [s for s in self.stages if s not in STAGES]
+        if unknown:
+            raise ValueError(f"Okända K-steg: {', '.join(map(str, unknown))}")
+        self.workers = workers
+        self.progress = progress
+        self.counters, self.stats = {}, []
+
+    def run(self, bank_all: pd.DataFrame, bokf_all: pd.DataFrame, state: "MatchState" = None):
+        self.bank_all, self.bokf_all = bank_all, bokf_all
+        self.bank_idx, self.bokf_idx = DayIndex(bank_all), DayIndex(bokf_all, "Kategori")
+        self.counters, self.stats = {}, []
+        self.dirty_days = None  # None = full körning
+        matched_bank_list, matched_bokf_list = [], []
+        free = lambda idx: int(len(idx.used) - idx.used.sum())
+        locked = rest = None
+        if state is not None and state.stages == self.stages:
+            matched_bank_list, matched_bokf_list, locked = self._reuse(state)
+            rest = state.rest
+
+        progress = self.progress or RunProgress()
+        metrics = _active_metrics()
+        if not progress.steps: progress.plan(self.stages)
+        if matched_bank_list or matched_bokf_list:
+            progress.matched(sum(map(len, matched_bank_list)), sum(map(len, matched_bokf_list)))
+
+        with day_pool(self.workers) as pool, progress.active():
+            for name in self.stages:
+                progress.start(name)
+                func, day_parallel, cross_day = STAGES[name]
+                extra = {"workers": pool} if day_parallel else {}
+                if cross_day and locked is not None:
+                    # Låsta dagars omatchade rader släpps fram igen: parningen över dagar gäller hela resten
+                    for idx, lock in zip((self.bank_idx, self.bokf_idx), locked): idx.used[lock] = False
+                    locked = None
+                skip = cross_day and rest is not None and _day_totals(*self.remaining()) == rest
+                if skip: metric(f"inkrementell.{name}_oförändrad")
+                bank_in, bokf_in = free(self.bank_idx), free(self.bokf_idx)
+                if metrics is not None: metrics.start_peak()
+                t0, c0 = time.perf_counter(), time.process_time()
+                if skip:
+                    mb, mf = bank_all.iloc[0:0], bokf_all.iloc[0:0]
+                else:
+                    mb, mf = func(bank_all, bokf_all, self.counters,
+                                  bank_idx=self.bank_idx, bokf_idx=self.bokf_idx, **extra)
+                self.stats.append({
+                    "stage": name,
+                    "wall_s": time.perf_counter() - t0, "cpu_s": time.process_time() - c0,
+                    "bank_in": bank_in, "bokf_in": bokf_in,
+                    "bank_out": free(self.bank_idx), "bokf_out": free(self.bokf_idx),
+                    "bank_matched": len(mb), "bokf_matched": len(mf),
+                    "peak_mb": metrics.peak_mb() if metrics is not None else None,
+                })
+                if not mb.empty: matched_bank_list.append(mb)
+                if not mf.empty: matched_bokf_list.append(mf)
+                progress.matched(len(mb), len(mf))
+
+        self.matched_bank = (pd.concat(matched_bank_list, ignore_index=True)
+                             if matched_bank_list else bank_all.iloc[0:0].copy())
+        self.matched_bokf = (pd.concat(matched_bokf_list, ignore_index=True)
+                             if matched_bokf_list else bokf_all.iloc[0:0].copy())
+        if metrics is not None: metrics.stages = [dict(st) for st in self.stats]
+        return self
+
+    def _reuse(self, state: "MatchState"):
+        # Förra körningens grupper utanför de omkörda dagarna läggs in som matchade och förbrukas;
+        # övriga rader på oförändrade dagar låses så att K-stegen bara ser de omkörda dagarna.
+        # Returnerar (matchade bank, matchade bokf, lås-masker per sida).
+        self.counters = dict(state.counters)
+        dirty, kept = _plan_incremental(state, self.bank_all, self.bokf_all,
+                                        {c for n, (_, _, cd) in STAGES.items() if cd for c in STAGE_CATS[n]})
+        self.dirty_days = sorted(dirty)
+        matched, locked = [], []
+        for df, idx, (pos, gkey, kat) in zip((self.bank_all, self.bokf_all), (self.bank_idx, self.bokf_idx), kept):
+            rows = df.iloc[pos].copy()
+            rows["__MatchKategori__"] = kat; rows["__GroupKey__"] = gkey
+            matched.append([rows] if len(rows) else [])
+            idx.used[pos] = True
+            days = df["__Dag__"].to_numpy()
+            lock = (days != NO_DAY) & ~np.isin(days, self.dirty_days) & ~idx.used
+            idx.used[lock] = True
+            locked.append(lock)
+        present = set(self.bank_idx.days()) | set(self.bokf_idx.days())
+        metric("inkrementell.omkörda_dagar", len(present))
+        metric("inkrementell.återanvända_grupper", len(set(kept[0][1]) | set(kept[1][1])))
+        return matched[0], matched[1], locked
+
+    def remaining(self):
+        # Omatchade rader (bank, bokf) efter körningen
+        return self.bank_idx.remaining(), self.bokf_idx.remaining()
+
+    def combined(self) -> pd.DataFrame:
+        mapping_bank, mapping_bokf = build_mapping_from_groupkey(self.matched_bank, self.matched_bokf)
+        return build_combined_all(self.bank_all, self.bokf_all, mapping_bank, mapping_bokf)
+
+    def stats_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.stats)
+
+# ========================= Inkrementell körning =========================
+STATE_VERSION = 1
+# Grannar till en ändrad dag som också körs om: en ändring dag c når K2-bankdagar inom ±K2_WINDOW_DAYS
+# (deras Betalningar-fönster täcker c), och de förbrukar i sin tur rader ±K2_WINDOW_DAYS från sig själva
+INCREMENTAL_WINDOW = 2 * K2_WINDOW_DAYS
+
+def row_fingerprints(df: pd.DataFrame, id_col: str) -> pd.DataFrame:
+    # Radavtryck: hash av filens kolumner (inte radnummer/hjälpkolumner) + löpnummer bland
+    # identiska rader, så att dubbletter hålls isär; radens dag följer med
+    cols = [c for c in df.columns if c != id_col and not c.startswith("__")]
+    fp = pd.util.hash_pandas_object(df[cols], index=False).to_numpy()
+    return pd.DataFrame({"fp": fp, "nr": pd.Series(fp).groupby(fp).cumcount().to_numpy(),
+                         "day": df["__Dag__"].to_numpy()})
+
+class MatchState:
+    """
+    Sparat matchningsläge mellan körningar på månad-till-datum-filer:
+      - bank/bokf: radavtryck (fp, nr, day) + gkey/kat (GroupKey, MatchKategori; "" = omatchad)
+      - counters: GroupKey-löpnummer per kategori – nya grupper fortsätter numreringen
+      - rest: dagssaldon (öre, se _day_totals) för raderna som var omatchade efter körningen
+      - stages: stegordningen läget bygger på (annan ordning → full körning)
+    Sparas med pandas pickle; load() ger None om filen saknas eller har annan STATE_VERSION.
+    """
+    def __init__(self, bank, bokf, counters, rest, stages):
+        self.bank, self.bokf = bank, bokf
+        self.counters, self.rest, self.stages = counters, rest, stages
+
+    @classmethod
+    def from_pipeline(cls, pipe: ReconciliationPipeline) -> "MatchState":
+        sides = []
+        for df, matched, id_col in [(pipe.bank_all, pipe.matched_bank, "BankRowID"),
+                                    (pipe.bokf_all, pipe.matched_bokf, "BokfRowID")]:
+            _, kat, gid = _join_match(df[id_col], _match_columns(matched, id_col))
+            sides.append(row_fingerprints(df, id_col).assign(gkey=gid, kat=kat))
+        rest = {int(d): t for d, t in _day_totals(*pipe.remaining()).items()}
+        return cls(sides[0], sides[1], dict(pipe.counters), rest, list(pipe.stages))
+
+    def save(self, path):
+        pd.to_pickle({"version": STATE_VERSION, **vars(self)}, path)
+
+    @classmethod
+    def load(cls, path):
+        p = Path(path)
+        if not p.exists(): return None
+        data = pd.read_pickle(p)
+        if not isinstance(data, dict) or data.pop("version", None) != STATE_VERSION: return None
+        return cls(**data)
+
+def _plan_incremental(state: MatchState, bank_all, bokf_all, cross_cats):
+    """
+    Jämför inlästa ramar med sparat läge. Returnerar (dirty, kept):
+      dirty: dagar som körs om = ändrade dagar (nya/borttagna rader på någon sida)
+             ± INCREMENTAL_WINDOW (K2:s fönster åt båda håll), utökat med alla dagar i tidigare grupper
+             som rör dem och i sin tur ± INCREMENTAL_WINDOW runt dem, tills mängden slutar växa
+             (dagsöverskridande grupper, cross_cats, utökar inte – de släpps bara)
+      kept:  per sida (positioner, GroupKey, kategori) för rader i grupper som återanvänds; GroupKey
+             numreras om till gruppens minsta BankRowID i de nya ramarna (löpnumret behålls)
+    """
+    merged, changed = [], set()
+    for df, old, id_col in [(bank_all, state.bank, "BankRowID"), (bokf_all, state.bokf, "BokfRowID")]:
+        new = row_fingerprints(df, id_col)
+        m = new.assign(pos=np.arange(len(new))).merge(old, on=["fp","nr","day"], how="outer", indicator=True)
+        changed.update(int(d) for d in m.loc[m["_merge"] != "both", "day"].unique() if d != NO_DAY)
+        merged.append(m)
+    metric("inkrementell.ändrade_dagar", len(changed))
+
+    groups = pd.concat([m.loc[m["gkey"].notna() & (m["gkey"] != ""), ["gkey","kat","day"]] for m in merged])
+    local = groups[~groups["kat"].isin(cross_cats)]
+    dirty, frontier = set(), changed
+    while frontier:
+        # Fönstret runt nya dagar; grupper som rör fönstret släpps och deras dagar får sitt eget fönster
+        new = {d + k for d in frontier for k in range(-INCREMENTAL_WINDOW, INCREMENTAL_WINDOW + 1)} - dirty
+        dirty |= new
+        touched = local.loc[local["day"].isin(list(new)), "gkey"].unique()
+        frontier = set(local.loc[local["gkey"].isin(touched), "day"].astype(np.int64)) - dirty
+    dropped = set(groups.loc[groups["day"].isin(list(dirty)), "gkey"])
+
+    kept = []
+    for m in merged:
+        k = m[(m["_merge"] == "both") & (m["gkey"] != "") & ~m["gkey"].isin(dropped)]
+        kept.append((k["pos"].to_numpy(dtype=np.int64), k["gkey"].to_numpy(dtype=object),
+                     k["kat"].to_numpy(dtype=object)))
+    # B-numret i GroupKey är minsta BankRowID, som flyttas när rader före gruppen läggs till/tas bort
+    bank_pos, bank_gkey, _ = kept[0]
+    min_bid = pd.Series(bank_all["BankRowID"].to_numpy()[bank_pos]).groupby(bank_gkey).min()
+    for i, (pos, gkey, kat) in enumerate(kept):
+        g = pd.Series(gkey, dtype=object)
+        bid = g.map(min_bid).fillna(0).astype(np.int64).astype(str)
+        kept[i] = (pos, (kat + "-B" + bid + "-" + g.str.rsplit("-", n=1).str[1]).to_numpy(dtype=object), kat)
+    return dirty, kept
+
 # ======================= Kombinerad + formatering =======================
+# Kolumn i Kombinerad -> bokföringskolumn (övriga hämtas under samma namn)
+KOMB_FROM_BOKF = {
+    "Ing. ack. Belopp": "Ing. ack. belopp 07-2025 SEK",
+    "Utg. ack. Belopp": "Utg. ack. belopp 07-2025 SEK",
+    "Utländskt valutabelopp": "Utländskt valutabelopap",
+    "Text": "Text1",
+}
+KOMB_MATCH_COLS = ["System","Ny källa","MatchKategori","MatchGruppID"]  # sätts av avstämningen
+
+def _join_match(ids: pd.Series, mapping: pd.DataFrame):
+    # Slår upp RowID i matchningskolumnerna (build_mapping_from_groupkey); "" för omatchade rader
+    pos = mapping.index.get_indexer(ids.to_numpy())
+    cat = np.append(mapping["MatchKategori"].to_numpy(dtype=object), "")[pos]  # pos -1 -> ""
+    gid = np.append(mapping["MatchGruppID"].to_numpy(dtype=object), "")[pos]
+    return pos >= 0, cat, gid
+
 def build_combined_all(bank_all, bokf_all, mapping_bank, mapping_bokf):
-    bank_rows = []
-    for _, r in bank_all.iterrows():
-        is_matched = r["BankRowID"] in mapping_bank
-        cat, gid = mapping_bank.get(r["BankRowID"], ("",""))
-        text = str(r.get("Text","") or "")
-        if is_matched:
-            ny_kalla = "Match"
-        elif re.match(r"^\s*BG53782751", text, flags=re.IGNORECASE):
-            ny_kalla = "Kundreskontra"
-        elif re.match(r"^\s*LB", text, flags=re.IGNORECASE):
-            ny_kalla = "Leverantörsreskontra"
-        else:
-            ny_kalla = "Manuell"
-
-        row = {col:"" for col in KOMB_COLS}
-        row["Datum"] = r["Bokföringsdatum"]
-        row["Period SEK"] = -float(r["Belopp"]) if pd.notna(r["Belopp"]) else None
-        row["Text"] = text
-        row["Verifikationsnummer"] = ""
-        row["System"] = "Bank"
-        row["Ny källa"] = ny_kalla
-        row["MatchKategori"] = cat
-        row["MatchGruppID"] = gid
-        bank_rows.append(row)
-
-    bokf_rows = []
-    for _, r in bokf_all.iterrows():
-        is_matched = r["BokfRowID"] in mapping_bokf
-        cat, gid = mapping_bokf.get(r["BokfRowID"], ("",""))
-        ny_kalla = "Match" if is_matched else (r.get("Källa","") or "")
-
-        row = {col:"" for col in KOMB_COLS}
-        row["Gruppering: (KTO-ANS-SPE)"] = r.get("Gruppering: (KTO-ANS-SPE)","")
-        row["FTG"] = r.get("FTG","")
-        row["KTO"] = r.get("KTO","")
-        row["SPE"] = r.get("SPE","")
-        row["ANS"] = r.get("ANS","")
-        row["OBJ"] = r.get("OBJ","")
-        row["MOT"] = r.get("MOT","")
-        row["PRD"] = r.get("PRD","")
-        row["MAR"] = r.get("MAR","")
-        row["RGR"] = r.get("RGR","")
-        row["Datum"] = r.get("Datum","")
-        row["IB Året SEK"] = r.get("IB Året SEK","")
-        row["Ing. ack. Belopp"] = r.get("Ing. ack. belopp 07-2025 SEK","")
-        row["Period SEK"] = r.get("Period SEK","")
-        row["Utg. ack. Belopp"] = r.get("Utg. ack. belopp 07-2025 SEK","")
-        row["Val"] = r.get("Val","")
-        row["Utländskt valutabelopp"] = r.get("Utländskt valutabelopap","")
-        row["Text"] = r.get("Text1","")
-        row["Postning -Dokumentsekvensnummer"] = r.get("Postning -Dokumentsekvensnummer","")
-        row["Verifikationsnummer"] = r.get("Verifikationsnummer","")
-        row["Källa"] = r.get("Källa","")
-        row["Kategori"] = r.get("Kategori","")
-        row["System"] = "Bokföring"
-        row["Ny källa"] = ny_kalla
-        row["MatchKategori"] = cat
-        row["MatchGruppID"] = gid
-        bokf_rows.append(row)
-
-    komb = pd.DataFrame(bank_rows + bokf_rows, columns=KOMB_COLS)
+    # Kolumnvis: bankdelen och bokföringsdelen byggs som hela kolumner och staplas
+    nb, nf = len(bank_all), len(bokf_all)
+    blank = lambda n: np.full(n, "", dtype=object)
+
+    hit, cat, gid = _join_match(bank_all["BankRowID"], mapping_bank)
+    text = pd.Series([str(v or "") for v in bank_all["Text"]] if "Text" in bank_all.columns else blank(nb),
+                     index=bank_all.index, dtype=object)
+    ny_kalla = np.select(
+        [hit & (cat == K6_CANDIDATE_CAT),
+         hit,
+         text_class(bank_all, TEXT_KUND),
+         text_class(bank_all, TEXT_LB)],
+        ["Kandidat", "Match", "Kundreskontra", "Leverantörsreskontra"], "Manuell").astype(object)
+    bank = pd.DataFrame({col: blank(nb) for col in KOMB_COLS})
+    bank["Datum"] = bank_all["Bokföringsdatum"].to_numpy()
+    bank["Period SEK"] = -bank_all["Belopp"].astype(float).to_numpy()
+    bank["Text"] = text.to_numpy(dtype=object)
+    bank["System"] = "Bank"
+    bank["Ny källa"] = ny_kalla
+    bank["MatchKategori"] = cat
+    bank["MatchGruppID"] = gid
+
+    hit, cat, gid = _join_match(bokf_all["BokfRowID"], mapping_bokf)
+    bokf = pd.DataFrame({col: blank(nf) for col in KOMB_COLS})
+    for col in KOMB_COLS:
+        src = KOMB_FROM_BOKF.get(col, col)
+        if col not in KOMB_MATCH_COLS and src in bokf_all.columns:
+            bokf[col] = bokf_all[src].to_numpy()
+    kalla = bokf_all["Källa"].to_numpy(dtype=object) if "Källa" in bokf_all.columns else blank(nf)
+    bokf["System"] = "Bokföring"
+    bokf["Ny källa"] = np.select([hit & (cat == K6_CANDIDATE_CAT), hit],
+                                 ["Kandidat", "Match"], np.array([v or "" for v in kalla], dtype=object))
+    bokf["MatchKategori"] = cat
+    bokf["MatchGruppID"] = gid
+
+    komb = pd.concat([bank, bokf], ignore_index=True)[KOMB_COLS]
     komb["System"] = komb["System"].astype(pd.CategoricalDtype(["Bank","Bokföring"], ordered=True))
     komb = komb.sort_values(by=["MatchGruppID","Datum","System"], na_position="last").reset_index(drop=True)
     return komb
 
-def make_combined_sheet(wb_path: Path):
-    wb = load_workbook(wb_path)
-    ws = wb["Kombinerad"]
-
-    def fill(cell, value=None, bg_hex=None, border=True):
-        if value is not None:
-            ws[cell] = value
-        if bg_hex:
-            ws[cell].fill = PatternFill(start_color=bg_hex.replace("#",""),
-                                        end_color=bg_hex.replace("#",""),
-                                        fill_type="solid")
-        if border:
-            thin = Side(style="thin", color="000000")
-            ws[cell].border = Border(left=thin, right=thin, top=thin, bottom=thin)
-        ws[cell].alignment = Alignment(vertical="center")
-
-    # Rad 2 – kontroller
-    fill("B2", "Bank", bg_hex="#B8D3EF")
-    fill("C2"); ws["C2"].number_format = "#,##0.00"
-    fill("D2", "Bokföring", bg_hex="#B8D3EF")
-    fill("E2"); ws["E2"].number_format = "#,##0.00"
-    fill("G2", bg_hex="#D9D9D9"); ws["G2"] = "=E2-C2"; ws["G2"].number_format = "#,##0.00"
-    fill("N2", bg_hex="#D9D9D9"); ws["N2"] = "=ROUND(SUBTOTAL(9,N5:N99999),2)"; ws["N2"].number_format = "#,##0.00"
-
-    ws.freeze_panes = "A5"
-
-    for col_idx in range(1, ws.max_column + 1):
+def write_combined_sheet(komb: pd.DataFrame, target, stats: pd.DataFrame = None):
+    """
+    Skriver "Kombinerad" i ETT strömmande pass (openpyxl write_only) till target (sökväg eller
+    fil-objekt, t.ex. BytesIO): kontrollrad 2, rubrik på rad 4 (pandas rubrikstil), data från rad 5
+    med format i kolumn K/N, frysta rutor och autofilter – ingen omläsning av arbetsboken.
+    stats (t.ex. RunMetrics.frame()) skrivs som en extra flik "Körstatistik".
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Kombinerad")
+    ncols = len(komb.columns)
+    last_row = 4 + len(komb)
+    for col_idx in range(1, ncols + 1):
         ws.column_dimensions[get_column_letter(col_idx)].width = 14
+    ws.freeze_panes = "A5"
+    ws.auto_filter.ref = f"A4:{get_column_letter(ncols)}{last_row}"
 
-    col_N = 14  # N
-    for r in range(5, ws.max_row + 1):
-        ws.cell(row=r, column=col_N).number_format = "#,##0.00"
-
-    col_K = 11  # K
-    for r in range(5, ws.max_row + 1):
-        ws.cell(row=r, column=col_K).number_format = "yyyy-mm-dd"
-
-    last_col_letter = get_column_letter(ws.max_column)
-    if ws.max_row >= 4:
-        ws.auto_filter.ref = f"A4:{last_col_letter}{ws.max_row}"
-
-    try:
-        sheets = wb._sheets
-        idx = sheets.index(ws)
-        sheets.insert(0, sheets.pop(idx))
-    except Exception:
-        pass
-
-    wb.save(wb_path)
+    thin = Side(style="thin", color="000000")
+    box = Border(left=thin, right=thin, top=thin, bottom=thin)
+    def cell(value=None, bg_hex=None, border=True, fmt=None, **style):
+        c = WriteOnlyCell(ws, value)
+        if bg_hex:
+            c.fill = PatternFill(start_color=bg_hex.replace("#",""), end_color=bg_hex.replace("#",""), fill_type="solid")
+        if border: c.border = box
+        c.alignment = style.pop("alignment", Alignment(vertical="center"))
+        if fmt: c.number_format = fmt
+        for k, v in style.items(): setattr(c, k, v)
+        return c
+
+    # Rad 1–3: kontroller på rad 2
+    ws.append([])
+    row2 = [None] * 14
+    row2[1] = cell("Bank", bg_hex="#B8D3EF")
+    row2[2] = cell(fmt="#,##0.00")
+    row2[3] = cell("Bokföring", bg_hex="#B8D3EF")
+    row2[4] = cell(fmt="#,##0.00")
+    row2[6] = cell("=E2-C2", bg_hex="#D9D9D9", fmt="#,##0.00")
+    row2[13] = cell("=ROUND(SUBTOTAL(9,N5:N99999),2)", bg_hex="#D9D9D9", fmt="#,##0.00")
+    ws.append(row2)
+    ws.append([])
+
+    # Rad 4: rubriker (samma stil som DataFrame.to_excel)
+    head = Alignment(horizontal="center", vertical="top")
+    ws.append([cell(str(c), alignment=head, font=Font(bold=True)) for c in komb.columns])
+
+    # Rad 5+: kolumnvis konvertering till Python-värden (NaN/NaT/"" -> tom cell), radvis skrivning
+    cols = []
+    for c in komb.columns:
+        s = komb[c].astype(object)
+        cols.append([None if v is None or (isinstance(v, str) and v == "") else v
+                     for v in s.where(s.notna(), None).tolist()])
+    fmt_col = {10: "yyyy-mm-dd", 13: "#,##0.00"}  # K, N (0-baserat)
+    fmt_cells = {i: cell(fmt=f, border=False, alignment=Alignment()) for i, f in fmt_col.items() if i < ncols}
+    for values in zip(*cols):
+        row = list(values)
+        for i, tmpl in fmt_cells.items():
+            c = WriteOnlyCell(ws, row[i]); c._style = copy(tmpl._style); row[i] = c
+        ws.append(row)
+
+    if stats is not None:
+        ws2 = wb.create_sheet("Körstatistik")
+        for col_idx, width in enumerate([12, 40, 16], start=1):
+            ws2.column_dimensions[get_column_letter(col_idx)].width = width
+        head = [WriteOnlyCell(ws2, str(c)) for c in stats.columns]
+        for c in head: c.font = Font(bold=True)
+        ws2.append(head)
+        for values in stats.itertuples(index=False):
+            ws2.append(list(values))
+
+    wb.save(target)
 
 # =============================== Export/Helpers ===============================
+def _match_columns(matched: pd.DataFrame, id_col: str) -> pd.DataFrame:
+    # RowID (index) -> MatchKategori (kategorikod) + MatchGruppID, en rad per matchad rad.
+    # Som tidigare: tom nyckel hoppas över, kategorin tas från gruppens första rad och
+    # en rad som (mot förmodan) finns i flera grupper får den sista i nyckelordning.
+    cols = [id_col, "__GroupKey__"]
+    if matched.empty or any(c not in matched.columns for c in cols):
+        return pd.DataFrame({"MatchKategori": pd.Categorical([]), "MatchGruppID": pd.Series([], dtype=object)},
+                            index=pd.Index([], name=id_col))
+    m = matched[cols + (["__MatchKategori__"] if "__MatchKategori__" in matched.columns else [])]
+    m = m[m["__GroupKey__"].notna() & (m["__GroupKey__"] != "")].sort_values("__GroupKey__", kind="stable")
+    if "__MatchKategori__" in m.columns:
+        first = m.drop_duplicates("__GroupKey__").set_index("__GroupKey__")["__MatchKategori__"]
+        cat = m["__GroupKey__"].map(first)
+    else:
+        cat = pd.Series("", index=m.index)
+    keep = ~m[id_col].duplicated(keep="last").to_numpy()
+    return pd.DataFrame({"MatchKategori": pd.Categorical(cat.to_numpy()[keep]),
+                         "MatchGruppID": m["__GroupKey__"].to_numpy(dtype=object)[keep]},
+                        index=pd.Index(m[id_col].to_numpy()[keep], name=id_col))
+
 def build_mapping_from_groupkey(matched_bank_all: pd.DataFrame, matched_bokf_all: pd.DataFrame):
-    mapping_bank, mapping_bokf = {}, {}
-    if not matched_bank_all.empty and "__GroupKey__" in matched_bank_all.columns:
-        for gkey, grp in matched_bank_all.groupby("__GroupKey__"):
-            if not gkey: continue
-            cat = grp["__MatchKategori__"].iloc[0] if "__MatchKategori__" in grp.columns else ""
-            for bid in grp.get("BankRowID", pd.Series([], dtype=int)).tolist():
-                mapping_bank[bid] = (cat, gkey)
-    if not matched_bokf_all.empty and "__GroupKey__" in matched_bokf_all.columns:
-        for gkey, grp in matched_bokf_all.groupby("__GroupKey__"):
-            if not gkey: continue
-            cat = grp["__MatchKategori__"].iloc[0] if "__MatchKategori__" in grp.columns else ""
-            for fid in grp.get("BokfRowID", pd.Series([], dtype=int)).tolist():
-                mapping_bokf[fid] = (cat, gkey)
-    return mapping_bank, mapping_bokf
+    return _match_columns(matched_bank_all, "BankRowID"), _match_columns(matched_bokf_all, "BokfRowID")
 
 # ================================= Main =================================
 def main():
@@ -988,108 +2118,53 @@ def main():
     bank_all = load_bank(bank_path)
     bokf_all = load_bokf(bokf_path)
 
-    bank_rem = bank_all.copy()
-    bokf_rem = bokf_all.copy()
-    matched_bank_list, matched_bokf_list = [], []
-    counters = {}
-
-    # K1–K5
-    for cat, func in [("K1",run_category1_BG53782751),
-                      ("K2",run_category2_BG5341_7689),
-                      ("K3",run_category3_35ref),
-                      ("K4",run_category4_ovrigt),
-                      ("K5",run_category5_LB)]:
-        mb, mf = func(bank_rem, bokf_rem, counters)
-        if not mb.empty: matched_bank_list.append(mb); bank_rem = bank_rem[~bank_rem["BankRowID"].isin(mb["BankRowID"])]
-        if not mf.empty: matched_bokf_list.append(mf); bokf_rem = bokf_rem[~bokf_rem["BokfRowID"].isin(mf["BokfRowID"])]
-
-    # K5X (ny, global balans – nu symmetrisk)
-    mb5x, mf5x = run_category5X_global(bank_rem, bokf_rem, counters)
-    if not mb5x.empty: matched_bank_list.append(mb5x); bank_rem = bank_rem[~bank_rem["BankRowID"].isin(mb5x["BankRowID"])]
-    if not mf5x.empty: matched_bokf_list.append(mf5x); bokf_rem = bokf_rem[~bokf_rem["BokfRowID"].isin(mf5x["BokfRowID"])]
+    # K1 → K2 → K3 → K4 → K5 → K5X → K6 (se STAGES); K1/K5/K5X dagsvis i poolen om DAY_WORKERS > 1
+    pipe = ReconciliationPipeline().run(bank_all, bokf_all)
+    komb = pipe.combined()
 
-    # K6 (symmetrisk) på rester
-    mb6, mf6 = run_category6_symmetric(bank_rem, bokf_rem, counters)
-    if not mb6.empty: matched_bank_list.append(mb6)
-    if not mf6.empty: matched_bokf_list.append(mf6)
-
-    matched_bank_all = pd.concat(matched_bank_list, ignore_index=True) if matched_bank_list else bank_all.iloc[0:0].copy()
-    matched_bokf_all = pd.concat(matched_bokf_list, ignore_index=True) if matched_bokf_list else bokf_all.iloc[0:0].copy()
-
-    om_bank_all = bank_all[~bank_all["BankRowID"].isin(matched_bank_all.get("BankRowID", pd.Series(dtype=int)))].copy()
-    om_bokf_all = bokf_all[~bokf_all["BokfRowID"].isin(matched_bokf_all.get("BokfRowID", pd.Series(dtype=int)))].copy()
-
-    mapping_bank, mapping_bokf = build_mapping_from_groupkey(matched_bank_all, matched_bokf_all)
-
-    komb = build_combined_all(bank_all, bokf_all, mapping_bank, mapping_bokf)
-
-    with pd.ExcelWriter(out_path, engine="openpyxl") as xw:
-        komb.to_excel(xw, index=False, sheet_name="Kombinerad", startrow=3)
-        # Om du vill lägga tillbaka omatchat/matchat-flikar, säg till så aktiverar vi dem igen.
-
-    make_combined_sheet(Path(out_path))
+    # Om du vill lägga tillbaka omatchat/matchat-flikar, säg till så aktiverar vi dem igen.
+    write_combined_sheet(komb, out_path)
     print(f"✅ Klar! Skrev: {out_path}")
 
 if __name__ == "__main__":
     main()
 from pathlib import Path
-import tempfile
 import pandas as pd
 
-def build_output_excel_bytes(bank_path: str, bokf_path: str) -> bytes:
-    # 1) Läs källor
-    bank_all = load_bank(bank_path)
-    bokf_all = load_bokf(bokf_path)
-
-    # 2) Kör K1–K5 på rester (OBS: counters medföljer till varje kategori)
-    bank_rem = bank_all.copy()
-    bokf_rem = bokf_all.copy()
-    matched_bank_list, matched_bokf_list = [], []
-    counters = {}
-
-    for cat, func in [
-        ("K1", run_category1_BG53782751),
-        ("K2", run_category2_BG5341_7689),
-        ("K3", run_category3_35ref),
-        ("K4", run_category4_ovrigt),
-        ("K5", run_category5_LB),
-    ]:
-        mb, mf = func(bank_rem, bokf_rem, counters)
-        if not mb.empty:
-            matched_bank_list.append(mb)
-            bank_rem = bank_rem[~bank_rem["BankRowID"].isin(mb["BankRowID"])]
-        if not mf.empty:
-            matched_bokf_list.append(mf)
-            bokf_rem = bokf_rem[~bokf_rem["BokfRowID"].isin(mf["BokfRowID"])]
-
-    # 3) K5X (global balans) – NY mellan K5 och K6
-    mb5x, mf5x = run_category5X_global(bank_rem, bokf_rem, counters)
-    if not mb5x.empty:
-        matched_bank_list.append(mb5x)
-        bank_rem = bank_rem[~bank_rem["BankRowID"].isin(mb5x["BankRowID"])]
-    if not mf5x.empty:
-        matched_bokf_list.append(mf5x)
-        bokf_rem = bokf_rem[~bokf_rem["BokfRowID"].isin(mf5x["BokfRowID"])]
-
-    # 4) K6 (symmetrisk) på rester
-    mb6, mf6 = run_category6_symmetric(bank_rem, bokf_rem, counters)
-    if not mb6.empty: matched_bank_list.append(mb6)
-    if not mf6.empty: matched_bokf_list.append(mf6)
-
-    # 5) Slå ihop matchat + bygg mapping via __GroupKey__
-    matched_bank_all = (pd.concat(matched_bank_list, ignore_index=True)
-                        if matched_bank_list else bank_all.iloc[0:0].copy())
-    matched_bokf_all = (pd.concat(matched_bokf_list, ignore_index=True)
-                        if matched_bokf_list else bokf_all.iloc[0:0].copy())
-
-    mapping_bank, mapping_bokf = build_mapping_from_groupkey(matched_bank_all, matched_bokf_all)
-
-    # 6) Bygg “Kombinerad”, formatera, returnera bytes
-    komb = build_combined_all(bank_all, bokf_all, mapping_bank, mapping_bokf)
-
-    with tempfile.TemporaryDirectory() as td:
-        tmp_path = Path(td) / "output_avstamning.xlsx"
-        with pd.ExcelWriter(tmp_path, engine="openpyxl") as xw:
-            komb.to_excel(xw, index=False, sheet_name="Kombinerad", startrow=3)
-        make_combined_sheet(tmp_path)
-        return tmp_path.read_bytes()
+def build_output_excel_bytes(bank_path, bokf_path, workers=None, stages=None,
+                             metrics: RunMetrics = None, stats_sheet: bool = False, state_path=None,
+                             progress: RunProgress = None, cache: bool = False) -> bytes:
+    # bank_path/bokf_path: sökväg, bytes eller filobjekt (t.ex. uppladdade filer) – läses i minnet;
+    # arbetsboken byggs i en BytesIO, inga temporära filer
+    # metrics: RunMetrics som fylls under körningen (rapport via metrics.to_json());
+    # stats_sheet=True lägger dessutom statistiken som fliken "Körstatistik";
+    # state_path: fil med MatchState – finns den körs bara nya/ändrade dagar, och läget skrivs om efteråt;
+    # progress: RunProgress för förlopp/avbrott (t.ex. från en bakgrundstråd i Streamlit-appen)
+    # cache=True: indatacachen på disk (InputCache) – av som standard, t.ex. för uppladdade filer
+    progress = progress or RunProgress()  # samma objekt i pipelinen och här, så att planen gäller stegen
+    pipe = ReconciliationPipeline(stages=stages, workers=workers, progress=progress)
+    progress.plan(["Läs bank", "Läs bokföring", *pipe.stages, "Kombinerad", "Excel"])
+    with metrics.active() if metrics is not None else nullcontext():
+        # 1) Läs källor
+        progress.start("Läs bank")
+        with phase("läs_bank"): bank_all = load_bank(bank_path, cache=cache)
+        progress.start("Läs bokföring")
+        with phase("läs_bokf"): bokf_all = load_bokf(bokf_path, cache=cache)
+
+        # 2) Kör K1 → K6 (se STAGES); workers: processer för de dagsvisa stegen (None → DAY_WORKERS),
+        #    stages: annan stegordning/urval (None = alla)
+        state = MatchState.load(state_path) if state_path else None
+        pipe.run(bank_all, bokf_all, state=state)
+        if state_path:
+            with phase("spara_läge"): MatchState.from_pipeline(pipe).save(state_path)
+
+        # 3) Bygg “Kombinerad” (MatchGruppID via __GroupKey__), formatera, returnera bytes
+        progress.start("Kombinerad")
+        with phase("kombinerad"): komb = pipe.combined()
+
+        progress.start("Excel")
+        buf = io.BytesIO()
+        with phase("skriv_xlsx"):
+            stats = metrics.frame() if metrics is not None and stats_sheet else None
+            write_combined_sheet(komb, buf, stats=stats)
+        return buf.getvalue()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# fil: batch_avstamning.py
+# Avstämning utan dialoger för nattkörningar: många (kontoutdrag, bokföring, utfil)-jobb
+# parallellt i en processpool, följt av en sammanfattning med tid och matchgrad per jobb.
+# Jobben anges med en manifestfil (CSV med kolumnerna bank, bokf, ut – relativa sökvägar
+# räknas från manifestets katalog) eller med katalogkonventionen
+#   <namn>_bank.<csv|xlsx|xls> + <namn>_bokf.<csv|xlsx|xls>  ->  <ut>/<namn>_avstamning.xlsx
+# Kör:  python batch_avstamning.py --manifest jobb.csv --workers 4
+#       python batch_avstamning.py --katalog indata/2025-07 --ut utdata/2025-07
+#       --cache: inlästa filer sparas i indatacachen (avm.InputCache, avm.INPUT_CACHE_DIR) så att
+#       omkörningar på samma filer slipper tolka dem igen; av som standard
+
+import argparse
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import avstamning_master_kombinerad as avm
+
+SUFFIXES = [".csv", ".xlsx", ".xls"]
+SUMMARY_COLS = ["jobb", "status", "sekunder", "bank_rader", "bokf_rader", "bank_matchade", "bokf_matchade",
+                "matchgrad_bank_%", "matchgrad_bokf_%", "k5x_uppgivna", "bank", "bokf", "ut", "fel"]
+
+def read_manifest(path) -> list:
+    # Jobb (namn, bank, bokf, ut) ur en CSV-manifest; avgränsaren gissas från rubrikraden
+    path = Path(path)
+    with open(path, encoding="utf-8-sig", newline="") as fh:
+        text = fh.read()
+    sep = csv.Sniffer().sniff(text.splitlines()[0] if text else ",", delimiters=",;\t").delimiter
+    jobs = []
+    for n, row in enumerate(csv.DictReader(text.splitlines(), delimiter=sep), start=1):
+        row = {k.strip().lower(): (v or "").strip() for k, v in row.items() if k}
+        missing = [c for c in ("bank", "bokf", "ut") if not row.get(c)]
+        if missing:
+            raise ValueError(f"Manifestet rad {n + 1}: saknar {', '.join(missing)}")
+        bank, bokf, ut = (path.parent / row[c] for c in ("bank", "bokf", "ut"))
+        jobs.append((row.get("namn") or Path(row["ut"]).stem, bank, bokf, ut))
+    return jobs
+
+def scan_directory(directory, out_dir=None) -> list:
+    # Jobb enligt katalogkonventionen <namn>_bank.* + <namn>_bokf.*; ensamma filer rapporteras
+    directory = Path(directory)
+    out_dir = Path(out_dir) if out_dir else directory
+    found = {}
+    for p in sorted(directory.iterdir()):
+        stem, suffix = p.stem, p.suffix.lower()
+        for kind in ("bank", "bokf"):
+            if suffix in SUFFIXES and stem.lower().endswith("_" + kind):
+                found.setdefault(stem[:-len(kind) - 1], {})[kind] = p
+    jobs = []
+    for name, files in found.items():
+        if len(files) < 2:
+            print(f"⚠️  {name}: hittade bara {', '.join(files)}-fil – hoppar över")
+            continue
+        jobs.append((name, files["bank"], files["bokf"], out_dir / f"{name}_avstamning.xlsx"))
+    return jobs
+
+def run_job(name, bank, bokf, out, day_workers=None, cache=False) -> dict:
+    # Ett jobb (körs i poolprocessen): avstämning + skrivning av utfilen, aldrig ett undantag ut
+    res = {"jobb": name, "bank": str(bank), "bokf": str(bokf), "ut": str(out), "status": "ok", "fel": ""}
+    t0 = time.perf_counter()
+    try:
+        metrics = avm.RunMetrics()
+        xlsx = avm.build_output_excel_bytes(str(bank), str(bokf), workers=day_workers, metrics=metrics, cache=cache)
+        Path(out).parent.mkdir(parents=True, exist_ok=True)
+        Path(out).write_bytes(xlsx)
+        st = metrics.stages
+        res["bank_rader"], res["bokf_rader"] = (st[0]["bank_in"], st[0]["bokf_in"]) if st else (0, 0)
+        res["bank_matchade"] = sum(s["bank_matched"] for s in st)
+        res["bokf_matchade"] = sum(s["bokf_matched"] for s in st)
+        res["k5x_uppgivna"] = metrics.gave_up()
+        for side in ("bank", "bokf"):
+            total = res[f"{side}_rader"]
+            res[f"matchgrad_{side}_%"] = round(100 * res[f"{side}_matchade"] / total, 1) if total else None
+    except Exception as e:
+        res["status"], res["fel"] = "fel", f"{type(e).__name__}: {e}"
+    res["sekunder"] = round(time.perf_counter() - t0, 2)
+    return res
+
+def run_batch(jobs, workers=None, day_workers=None, cache=False) -> list:
+    # Jobben parallellt (workers processer, standard: antal CPU:er); resultat i jobbordning
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs)))
+    if workers == 1:
+        results = []
+        for job in jobs:
+            results.append(run_job(*job, day_workers=day_workers, cache=cache)); _report(results[-1])
+        return results
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        futures = {ex.submit(run_job, *job, day_workers=day_workers, cache=cache): i for i, job in enumerate(jobs)}
+        results = [None] * len(jobs)
+        for fut in as_completed(futures):
+            results[futures[fut]] = fut.result(); _report(results[futures[fut]])
+    return results
+
+def _report(res):
+    if res["status"] == "ok":
+        print(f"✅ {res['jobb']}: {res['sekunder']:.1f} s, matchat bank {res['matchgrad_bank_%']} %, "
+              f"bokf {res['matchgrad_bokf_%']} % -> {res['ut']}")
+        if res["k5x_uppgivna"]:
+            print(f"⚠️  {res['jobb']}: K5X gav upp {res['k5x_uppgivna']} stordagssökning(ar) – granska omatchade dagar")
+    else:
+        print(f"❌ {res['jobb']}: {res['fel']}")
+
+def write_summary(results, path):
+    with open(path, "w", encoding="utf-8-sig", newline="") as fh:
+        w = csv.DictWriter(fh, fieldnames=SUMMARY_COLS, delimiter=";")
+        w.writeheader()
+        for res in results:
+            w.writerow({k: res.get(k, "") for k in SUMMARY_COLS})
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Avstämning av många konton/perioder utan dialoger")
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--manifest", help="CSV med kolumnerna bank, bokf, ut (valfritt namn)")
+    src.add_argument("--katalog", help="katalog med <namn>_bank.* och <namn>_bokf.*")
+    ap.add_argument("--ut", help="utkatalog för --katalog (standard: samma katalog)")
+    ap.add_argument("--workers", type=int, default=None, help="parallella jobb (standard: antal CPU:er)")
+    ap.add_argument("--dag-workers", type=int, default=None, help="processer per jobb för de dagsvisa K-stegen")
+    ap.add_argument("--cache", action="store_true",
+                    help=f"spara inlästa filer i indatacachen ({avm.INPUT_CACHE_DIR}, högst {avm.INPUT_CACHE_MAX_MB} MB)")
+    ap.add_argument("--sammanfattning", default=None,
+                    help="sammanfattningsfil (CSV, standard: batch_sammanfattning.csv i utkatalogen)")
+    args = ap.parse_args(argv)
+
+    jobs = read_manifest(args.manifest) if args.manifest else scan_directory(args.katalog, args.ut)
+    if not jobs:
+        print("Inga jobb hittades."); return 1
+    print(f"🔹 {len(jobs)} jobb")
+    t0 = time.perf_counter()
+    results = run_batch(jobs, args.workers, args.dag_workers, args.cache)
+    summary = Path(args.sammanfattning or Path(args.ut or args.katalog or Path(args.manifest).parent) / "batch_sammanfattning.csv")
+    summary.parent.mkdir(parents=True, exist_ok=True)
+    write_summary(results, summary)
+    failed = sum(r["status"] != "ok" for r in results)
+    print(f"\n{len(results) - failed}/{len(results)} jobb klara på {time.perf_counter() - t0:.1f} s – "
+          f"sammanfattning: {summary}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# fil: benchmark.py
+# Prestandasvit för avstämningen på syntetiska data (syntetisk_data.py):
+#   inläsning (load_bank/load_bokf), varje K-steg (run_category* via ReconciliationPipeline),
+#   bygget av Kombinerad och Excel-exporten. Varje körning läggs till som en JSON-rad i
+#   resultatfilen (standard bench_data/benchmark_resultat.jsonl) och jämförs med föregående
+#   körning av samma storlek/format/seed/workers, så att regressioner syns innan månadsbokslutet.
+#   Antal matchade rader jämförs bara mot föregående körning – att resultaten är desamma som
+#   referensalgoritmernas kontrolleras av ekvivalens.py.
+# Kör:  python benchmark.py                       (10k, 100k, 1M rader, csv)
+#       python benchmark.py --rader 10000 --format xlsx --upprepa 3 --strikt
+
+import argparse
+import datetime as dt
+import io
+import json
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+import avstamning_master_kombinerad as avm
+from syntetisk_data import make_dataset
+
+REGRESSION_PCT = 25.0   # långsammare än så (och minst REGRESSION_MIN_S) räknas som regression
+REGRESSION_MIN_S = 0.05
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def run_once(bank_path, bokf_path, workers=None) -> dict:
+    # Ett varv genom hela flödet; tider (s) per mätpunkt + matchade rader per steg
+    t = {}
+    # Inläsningen mäts utan indatacachen (InputCache) – det är tolkningen av filen som ska jämföras
+    t0 = time.perf_counter(); bank_all = avm.load_bank(bank_path, cache=False); t["load_bank"] = time.perf_counter() - t0
+    t0 = time.perf_counter(); bokf_all = avm.load_bokf(bokf_path, cache=False); t["load_bokf"] = time.perf_counter() - t0
+    pipe = avm.ReconciliationPipeline(workers=workers).run(bank_all, bokf_all)
+    for st in pipe.stats:
+        t[f"stage_{st['stage']}"] = st["wall_s"]
+    t0 = time.perf_counter(); komb = pipe.combined(); t["combined"] = time.perf_counter() - t0
+    t0 = time.perf_counter(); avm.write_combined_sheet(komb, io.BytesIO()); t["export_xlsx"] = time.perf_counter() - t0
+    t["total"] = sum(t.values())
+    matched = {st["stage"]: [st["bank_matched"], st["bokf_matched"]] for st in pipe.stats}
+    return {"timings": t, "matched": matched, "bank_rows": len(bank_all), "bokf_rows": len(bokf_all)}
+
+def run_size(n_rows, fmt, seed, repeat, data_dir, workers=None) -> dict:
+    t0 = time.perf_counter()
+    bank_path, bokf_path = make_dataset(data_dir, n_rows, fmt, seed)
+    gen_s = time.perf_counter() - t0
+    runs = [run_once(bank_path, bokf_path, workers) for _ in range(repeat)]
+    best = {k: min(r["timings"][k] for r in runs) for k in runs[0]["timings"]}  # bästa av N
+    return {
+        "tid": dt.datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(), "pandas": pd.__version__,
+        "rader": n_rows, "format": fmt, "seed": seed, "upprepa": repeat, "workers": workers,
+        "bank_rows": runs[0]["bank_rows"], "bokf_rows": runs[0]["bokf_rows"],
+        "generering_s": gen_s,
+        "timings": best,
+        "matched": runs[0]["matched"],
+    }
+
+def load_results(path) -> list:
+    p = Path(path)
+    if not p.exists(): return []
+    return [json.loads(line) for line in p.read_text(encoding="utf-8").splitlines() if line.strip()]
+
+def compare(prev: dict, cur: dict):
+    # Rader (mätpunkt, före, nu, diff %, flagga); flagga = REGRESSION / ändrat resultat
+    rows, regressions = [], 0
+    for k, now in cur["timings"].items():
+        before = prev["timings"].get(k) if prev else None
+        pct = (now - before) / before * 100 if before else None
+        flag = ""
+        if before is not None and pct > REGRESSION_PCT and now - before > REGRESSION_MIN_S:
+            flag = "REGRESSION"; regressions += 1
+        rows.append((k, before, now, pct, flag))
+    changed = bool(prev) and prev.get("matched") != cur["matched"]
+    return rows, regressions, changed
+
+def print_report(cur: dict, rows, changed):
+    print(f"\n== {cur['rader']:,} rader ({cur['format']}): bank {cur['bank_rows']:,}, "
+          f"bokf {cur['bokf_rows']:,} – commit {cur['commit'] or '?'}")
+    print(f"{'mätpunkt':<14}{'föreg. s':>10}{'nu s':>10}{'diff %':>9}")
+    for k, before, now, pct, flag in rows:
+        b = f"{before:10.3f}" if before is not None else f"{'–':>10}"
+        p = f"{pct:+8.1f}%" if pct is not None else f"{'':>9}"
+        print(f"{k:<14}{b}{now:10.3f}{p} {flag}")
+    if changed:
+        print("⚠️  Antal matchade rader per steg skiljer sig från föregående körning (samma data).")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Prestandasvit för avstämningen")
+    ap.add_argument("--rader", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    ap.add_argument("--format", choices=["csv", "xlsx"], default="csv")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--upprepa", type=int, default=1, help="antal varv per storlek (bästa tiden sparas)")
+    ap.add_argument("--workers", type=int, default=None, help="processer för de dagsvisa K-stegen")
+    ap.add_argument("--data", default="bench_data", help="katalog för genererade indata")
+    ap.add_argument("--resultat", default=None,
+                    help="resultatfil (JSON-rader), standard benchmark_resultat.jsonl i --data")
+    ap.add_argument("--strikt", action="store_true", help="avsluta med kod 1 vid regression")
+    args = ap.parse_args(argv)
+    args.resultat = Path(args.resultat or Path(args.data) / "benchmark_resultat.jsonl")
+    args.resultat.parent.mkdir(parents=True, exist_ok=True)
+
+    history = load_results(args.resultat)
+    total_regressions = 0
+    for n in args.rader:
+        cur = run_size(n, args.format, args.seed, args.upprepa, args.data, args.workers)
+        prev = next((h for h in reversed(history)
+                     if (h["rader"], h["format"], h["seed"], h.get("workers"))
+                     == (n, args.format, args.seed, args.workers)), None)
+        rows, regressions, changed = compare(prev, cur)
+        print_report(cur, rows, changed)
+        total_regressions += regressions
+        with open(args.resultat, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps(cur, ensure_ascii=False) + "\n")
+        history.append(cur)
+    print(f"\nResultat sparade i {args.resultat}")
+    return 1 if args.strikt and total_regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
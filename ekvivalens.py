@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+# fil: ekvivalens.py
+# Kontroll att de snabbare algoritmerna ger samma resultat som referensversionerna de ersatte,
+# på syntetiska data (syntetisk_data.py):
+#   subset_sum_mitm  mot dict/set-versionen (samma exkluderingsmängd)
+#   find_removal     mot itertools.combinations (första kombinationen, r = 1..3)
+#   K3 / K4          mot slingan "per bankrad första oanvända bokf-rad" (samma par och GroupKeys)
+#   inkrementellt    MatchState-körning (även kedjad) mot full körning på samma filer (samma grupper)
+#   hela flödet      mot modulen före prestandaserien (REFERENS, kopia i referens/): inläsning av
+#                    CSV och XLSX, K1–K5X, Kombinerad och Excel-fliken cell för cell; K6 redovisas
+#                    separat (find_removal utan kombinationstak och pass 2 är avsiktligt nytt beteende)
+#   workers          seriell körning mot processpoolen (samma grupper och GroupKeys)
+# benchmark.py jämför bara antal matchade rader mellan körningar; den här jämför mot referensen.
+# Kör:  python ekvivalens.py                      (20 000 rader, seed 1)
+#       python ekvivalens.py --rader 5000 --seed 3 --fall 500
+#       python ekvivalens.py --referens c402da0                (referens ur git i stället för kopian)
+
+import argparse
+import io
+import itertools
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from contextlib import nullcontext
+from pathlib import Path
+
+import pandas as pd
+from openpyxl import load_workbook
+
+import avstamning_master_kombinerad as avm
+from syntetisk_data import make_dataset, write_csv
+
+# Versionen före prestandaserien (git c402da0), oförändrad kopia; --referens tar även en git-revision
+REFERENS = Path(__file__).parent / "referens" / "avstamning_master_kombinerad.py"
+K6_CATS = {"K6", avm.K6_CANDIDATE_CAT}
+PRE_K6 = [s for s in avm.STAGES if s != "K6"]
+
+# ============================ Referenser ============================
+def ref_subset_sum_mitm(values_cents, ids, target_cents, max_rows=50):
+    # Dict/set-versionen: första summan per halva behåller sin mängd, vänster halva i insättningsordning
+    n = len(values_cents)
+    if n == 0:
+        return None
+    order = sorted(range(n), key=lambda i: abs(values_cents[i]), reverse=True)[:min(n, max_rows)]
+    values_cents = [values_cents[i] for i in order]
+    ids = [ids[i] for i in order]
+    n = len(values_cents)
+    if sum(values_cents) == target_cents:
+        return set()
+    k, take = (n // 2, n) if n <= 26 else (17, min(34, n))
+
+    def half(vals, half_ids):
+        sums = {0: set()}
+        for v, i in zip(vals, half_ids):
+            new = {}
+            for s, comb in sums.items():
+                ns = s + v
+                if ns not in sums and ns not in new:
+                    new[ns] = comb | {i}
+            sums.update(new)
+        return sums
+
+    left, right = half(values_cents[:k], ids[:k]), half(values_cents[k:take], ids[k:take])
+    for s, comb in left.items():
+        if target_cents - s in right:
+            return comb | right[target_cents - s]
+    return None
+
+def ref_find_removal(values, need, max_r=3):
+    for r in range(1, max_r + 1):
+        for combo in itertools.combinations(range(len(values)), r):
+            if sum(values[i] for i in combo) == need:
+                return combo
+    return None
+
+def ref_one_to_one(bank_sel, bokf_sel, cat):
+    # Gamla K3/K4-slingan: bankrader i (Bokföringsdatum, BankRowID)-ordning, var och en mot första
+    # oanvända bokf-rad (BokfRowID) samma dag med samma belopp; en stamp_match per par
+    counters, used, out = {}, set(), []
+    for _, b in bank_sel.sort_values(["Bokföringsdatum", "BankRowID"]).iterrows():
+        if pd.isna(b["Bokföringsdatum"]) or pd.isna(b["Belopp"]): continue
+        cand = bokf_sel[(bokf_sel["Datum"].dt.date == b["Bokföringsdatum"].date())
+                        & ~bokf_sel["BokfRowID"].isin(used)
+                        & (bokf_sel["Period SEK"].round(2) == round(b["Belopp"], 2))]
+        if len(cand):
+            chosen = cand.sort_values("BokfRowID").iloc[[0]]
+            used.add(chosen["BokfRowID"].iloc[0])
+            b2, f2, gkey = avm.stamp_match(pd.DataFrame([b]), chosen, cat, counters)
+            out.append((int(b2["BankRowID"].iloc[0]), int(f2["BokfRowID"].iloc[0]), gkey))
+    return sorted(out)
+
+def _pairs(mb, mf):
+    # (BankRowID, BokfRowID, GroupKey) ur matchade ramar från ett 1:1-steg
+    f = dict(zip(mf["__GroupKey__"], mf["BokfRowID"]))
+    return sorted((int(b), int(f[g]), g) for b, g in zip(mb["BankRowID"], mb["__GroupKey__"]))
+
+def load_reference(ref):
+    # Referensmodulen (filen ref, eller avstamning_master_kombinerad.py i revisionen ref); None om den saknas
+    path = Path(ref)
+    try:
+        if path.suffix == ".py":
+            source, name = path.read_text(encoding="utf-8"), str(path)
+        else:
+            source = subprocess.run(["git", "show", f"{ref}:avstamning_master_kombinerad.py"], cwd=Path(__file__).parent,
+                                    capture_output=True, text=True, check=True, timeout=60).stdout
+            name = f"{ref}:avstamning_master_kombinerad.py"
+    except (OSError, subprocess.SubprocessError):
+        return None
+    mod = types.ModuleType("avstamning_referens")
+    exec(compile(source, name, "exec"), mod.__dict__)
+    return mod
+
+def ref_pandas():
+    # Referensen skrevs för pandas 2 (textkolumner som object); pandas 3 slår på str-dtypen som standard
+    try:
+        pd.get_option("future.infer_string")
+    except KeyError:  # pandas < 2.1: ingen str-dtyp
+        return nullcontext()
+    return pd.option_context("future.infer_string", False)
+
+def ref_pipeline(ref, bank_all, bokf_all, k6=True):
+    # Referensens flöde (build_output_excel_bytes): K1–K5, K5X och ev. K6 på resterna -> matchade ramar
+    bank_rem, bokf_rem = bank_all.copy(), bokf_all.copy()
+    matched_bank, matched_bokf, counters = [], [], {}
+    funcs = [ref.run_category1_BG53782751, ref.run_category2_BG5341_7689, ref.run_category3_35ref,
+             ref.run_category4_ovrigt, ref.run_category5_LB, ref.run_category5X_global]
+    for func in funcs + ([ref.run_category6_symmetric] if k6 else []):
+        mb, mf = func(bank_rem, bokf_rem, counters)
+        if not mb.empty: matched_bank.append(mb); bank_rem = bank_rem[~bank_rem["BankRowID"].isin(mb["BankRowID"])]
+        if not mf.empty: matched_bokf.append(mf); bokf_rem = bokf_rem[~bokf_rem["BokfRowID"].isin(mf["BokfRowID"])]
+    concat = lambda parts, df: pd.concat(parts, ignore_index=True) if parts else df.iloc[0:0].copy()
+    return concat(matched_bank, bank_all), concat(matched_bokf, bokf_all)
+
+def ref_excel(ref, komb) -> bytes:
+    with tempfile.TemporaryDirectory() as td:
+        path = Path(td) / "ref.xlsx"
+        with pd.ExcelWriter(path, engine="openpyxl") as xw:
+            komb.to_excel(xw, index=False, sheet_name="Kombinerad", startrow=3)
+        ref.make_combined_sheet(path)
+        return path.read_bytes()
+
+def _frame_diff(want: pd.DataFrame, got: pd.DataFrame, cols):
+    # (kolumn, rad, referens, nu) där värdena skiljer; NaN/None/NaT räknas lika, liksom antal rader
+    if len(want) != len(got):
+        return [("antal rader", None, len(want), len(got))]
+    bad = []
+    for c in cols:
+        if c not in got.columns:
+            bad.append((c, None, "kolumn", "saknas")); continue
+        w = want[c].astype(object).reset_index(drop=True)
+        g = got[c].astype(object).reset_index(drop=True)
+        same = (w == g) | (w.isna() & g.isna())
+        bad += [(c, i, w[i], g[i]) for i in same.index[~same.to_numpy(dtype=bool)][:3]]
+    return bad
+
+def _sheet_cells(xlsx: bytes):
+    # Kombinerad-fliken som {(rad, kolumn): (värde, talformat)}; tom sträng = tom cell
+    ws = load_workbook(io.BytesIO(xlsx))["Kombinerad"]
+    cells = {}
+    for row in ws.iter_rows():
+        for c in row:
+            v = None if c.value == "" else c.value
+            if v is not None or c.number_format != "General":
+                cells[(c.row, c.column)] = (v, c.number_format)
+    return cells
+
+def _partition(pipe):
+    # Grupperna som (kategori, mängd av (sida, RowID)) – oberoende av GroupKey-numreringen
+    groups = {}
+    for df, side, id_col in [(pipe.matched_bank, "B", "BankRowID"), (pipe.matched_bokf, "F", "BokfRowID")]:
+        for g, kat, rid in zip(df["__GroupKey__"], df["__MatchKategori__"], df[id_col]):
+            groups.setdefault(g, [kat, set()])[1].add((side, int(rid)))
+    return {(kat, frozenset(rows)) for kat, rows in groups.values()}
+
+def _k2_window_case(data_dir):
+    # K2:s ±2-dagarsfönster över gränsen för de omkörda dagarna: bankraden 03-07 ska få båda
+    # Betalningar-raderna (03-09 från första körningen, 03-05 tillagd i andra) som K2
+    bank = [{"Bokföringsdatum": "2025-03-07", "Text": "BG 5341-7689", "Belopp": "100,00"}]
+    bet = lambda d, a: {"Datum": d, "Kategori": "Betalningar", "Period SEK": a, "Verifikationsnummer": "250307"}
+    frames = []
+    for name, rows, cols, header, load in [
+            ("bank", bank, avm.BANK_COLS, avm.BANK_HEADER_ROW, avm.load_bank),
+            ("bokf_1", [bet("2025-03-09", "60,00")], avm.BOKF_COLS, avm.BOKF_HEADER_ROW, avm.load_bokf),
+            ("bokf_2", [bet("2025-03-09", "60,00"), bet("2025-03-05", "40,00")], avm.BOKF_COLS, avm.BOKF_HEADER_ROW, avm.load_bokf)]:
+        path = Path(data_dir) / f"inkrementell_{name}.csv"
+        write_csv(path, rows, cols, header)
+        frames.append(load(path, cache=False))
+    bank, bokf_1, bokf_2 = frames
+    return (bank, bokf_1), (bank, bokf_2)
+
+def _renumbered(df, id_col):
+    # Som en ny inläsning av filen: RowID = radnummer, så borttagna rader flyttar de senare raderna
+    return df.reset_index(drop=True).assign(**{id_col: range(len(df))})
+
+def _incremental_cases(bank, bokf, r, data_dir):
+    # (namn, (bank, bokf) per körning …) – sparat läge förs vidare körning för körning och den sista
+    # körs både inkrementellt och fullt; månad-till-datum på de första 60 dagarna
+    day0 = int(min(bank["__Dag__"].min(), bokf["__Dag__"].min()))
+    bank = bank[bank["__Dag__"].between(day0, day0 + 59)].reset_index(drop=True)
+    bokf = bokf[bokf["__Dag__"].between(day0, day0 + 59)].reset_index(drop=True)
+    cut = day0 + 40
+    yield "K2-fönster", *_k2_window_case(data_dir)
+    yield "nya dagar", (bank[bank["__Dag__"] < cut], bokf[bokf["__Dag__"] < cut]), (bank, bokf)
+    edited = bokf.copy()
+    rows = r.sample(range(len(edited)), 5)
+    edited.loc[rows, "__Öre__"] += 100
+    edited.loc[rows, "Period SEK"] = edited.loc[rows, "__Öre__"] / 100
+    yield "ändrade belopp", (bank, edited), (bank, bokf)
+    dropped = bokf.drop(index=r.sample(range(len(bokf)), 5))
+    yield "borttagna rader", (bank, bokf), (bank, dropped)
+    # Kedja: nya dagar, sedan tidiga bankrader borttagna (BankRowID flyttas), sedan ändrade belopp
+    early = bank.index[bank["__Dag__"] < day0 + 10]
+    bank_2 = _renumbered(bank.drop(index=r.sample(list(early), min(3, len(early)))), "BankRowID")
+    edited_2 = bokf.copy()
+    rows = r.sample(range(len(edited_2)), 5)
+    edited_2.loc[rows, "__Öre__"] -= 100
+    edited_2.loc[rows, "Period SEK"] = edited_2.loc[rows, "__Öre__"] / 100
+    yield ("kedjade ändringar", (bank[bank["__Dag__"] < cut], bokf[bokf["__Dag__"] < cut]),
+           (bank, bokf), (bank_2, bokf), (bank_2, edited_2))
+
+def _stale_keys(pipe):
+    # GroupKeys vars B-nummer inte är gruppens minsta BankRowID i körningens ramar
+    mb = pipe.matched_bank
+    want = mb.groupby("__GroupKey__")["BankRowID"].min()
+    return [g for g, b in want.items() if g.split("-")[1] != f"B{int(b)}"]
+
+def check_incremental(bank, bokf, r, data_dir):
+    bad, n = [], 0
+    for name, first, *runs in _incremental_cases(bank, bokf, r, data_dir):
+        n += 1
+        state = avm.MatchState.from_pipeline(avm.ReconciliationPipeline().run(*first))
+        for frames in runs[:-1]:
+            state = avm.MatchState.from_pipeline(avm.ReconciliationPipeline().run(*frames, state=state))
+        inc_pipe = avm.ReconciliationPipeline().run(*runs[-1], state=state)
+        inc, full = _partition(inc_pipe), _partition(avm.ReconciliationPipeline().run(*runs[-1]))
+        if inc != full:
+            bad.append((name, sorted(full - inc, key=str)[:3], sorted(inc - full, key=str)[:3]))
+        if _stale_keys(inc_pipe):
+            bad.append((name, "GroupKey med fel B-nummer", _stale_keys(inc_pipe)[:3]))
+    return n, bad
+
+def check_loaders(ref, paths):
+    # Inläsning (CSV och XLSX) mot referensens load_bank/load_bokf, referensens kolumner
+    bad, n = [], 0
+    for fmt, (bank_path, bokf_path) in paths.items():
+        for kind, path, load, ref_load in [("bank", bank_path, avm.load_bank, ref.load_bank),
+                                           ("bokf", bokf_path, avm.load_bokf, ref.load_bokf)]:
+            n += 1
+            with ref_pandas(): want = ref_load(str(path))
+            got = load(path, cache=False)
+            bad += [(fmt, kind, *d) for d in _frame_diff(want, got, want.columns)]
+    return n, bad
+
+def check_pipeline(ref, bank_path, bokf_path):
+    # K1–K5X + Kombinerad + Excel-fliken mot referensen (utan K6 på båda sidor)
+    with ref_pandas():
+        rb, rf = ref.load_bank(str(bank_path)), ref.load_bokf(str(bokf_path))
+        want = ref.build_combined_all(rb, rf, *ref.build_mapping_from_groupkey(*ref_pipeline(ref, rb, rf, k6=False)))
+        want_xlsx = ref_excel(ref, want)
+    pipe = avm.ReconciliationPipeline(stages=PRE_K6).run(avm.load_bank(bank_path, cache=False),
+                                                         avm.load_bokf(bokf_path, cache=False))
+    got = pipe.combined()
+    bad = _frame_diff(want, got, avm.KOMB_COLS)
+    buf = io.BytesIO(); avm.write_combined_sheet(got, buf)
+    want_cells, got_cells = _sheet_cells(want_xlsx), _sheet_cells(buf.getvalue())
+    bad += [("Excel", k, want_cells.get(k), got_cells.get(k))
+            for k in sorted(set(want_cells) | set(got_cells)) if want_cells.get(k) != got_cells.get(k)][:5]
+    return len(want), bad
+
+def k6_report(ref, bank_path, bokf_path):
+    # K6 matchade rader (bank, bokf): referensen mot nu (K6 resp. kandidater) – avsiktligt olika
+    with ref_pandas():
+        mb, mf = ref_pipeline(ref, ref.load_bank(str(bank_path)), ref.load_bokf(str(bokf_path)))
+    pipe = avm.ReconciliationPipeline().run(avm.load_bank(bank_path, cache=False), avm.load_bokf(bokf_path, cache=False))
+    count = lambda df, cats: int(df["__MatchKategori__"].isin(cats).sum()) if len(df) else 0
+    return ((count(mb, {"K6"}), count(mf, {"K6"})),
+            (count(pipe.matched_bank, {"K6"}), count(pipe.matched_bokf, {"K6"})),
+            (count(pipe.matched_bank, {avm.K6_CANDIDATE_CAT}), count(pipe.matched_bokf, {avm.K6_CANDIDATE_CAT})))
+
+def check_workers(bank, bokf, workers=2):
+    # Processpoolen mot seriell körning: samma rader i samma grupper med samma GroupKeys
+    runs = [avm.ReconciliationPipeline(workers=w).run(bank, bokf) for w in (1, workers)]
+    maps = [avm.build_mapping_from_groupkey(p.matched_bank, p.matched_bokf) for p in runs]
+    bad = []
+    for side, want, got in zip(("bank", "bokf"), *maps):
+        if not want.equals(got):
+            diff = want.compare(got) if want.index.equals(got.index) else (len(want), len(got))
+            bad.append((side, str(diff)[:200]))
+    return len(maps[0][0]) + len(maps[0][1]), bad
+
+# ============================ Kontroller ============================
+def _cases(bokf, n_cases, sizes, r, max_pick=None):
+    # (värden, id:n, mål) per dag ur bokföringen: målet är en delsumma av högst max_pick
+    # värden (träff) eller slumpat
+    days = [grp for _, grp in avm.iter_days(bokf)]
+    for k in range(n_cases):
+        grp = days[k % len(days)]
+        n = min(len(grp), sizes[k % len(sizes)])
+        vals = [int(v) for v in grp["__Öre__"].iloc[:n]]
+        ids = [int(v) for v in grp["BokfRowID"].iloc[:n]]
+        if vals and r.random() < 0.7:
+            target = sum(r.sample(vals, r.randint(1, min(n, max_pick or n))))
+        else:
+            target = r.randint(-10**6, 10**6)
+        yield vals, ids, target
+
+def check_mitm(bokf, n_cases, r):
+    bad = []
+    for vals, ids, target in _cases(bokf, n_cases, [5, 12, 20, 26, 30, 50], r):
+        got, want = avm.subset_sum_mitm(vals, ids, target), ref_subset_sum_mitm(vals, ids, target)
+        if got != want: bad.append((vals, target, want, got))
+    return n_cases, bad
+
+def check_find_removal(bokf, n_cases, r):
+    bad = []
+    for vals, _, target in _cases(bokf, n_cases, [3, 10, 20, 30], r, max_pick=3):
+        got, want = avm.find_removal(vals, target), ref_find_removal(vals, target)
+        if got != want: bad.append((vals, target, want, got))
+    return n_cases, bad
+
+def check_k3(bank, bokf):
+    has_35ref = bank["Text"].astype(str).str.contains(r"35\d{10}", regex=True, na=False)
+    pay = bokf[bokf["Kategori"].astype(str).str.strip() == "Betalningar"]
+    want = ref_one_to_one(bank[has_35ref], pay, "K3")
+    got = _pairs(*avm.run_category3_35ref(bank, bokf, {}))
+    return len(want), sorted(set(want) ^ set(got))  # par som bara finns på ena sidan
+
+def check_k4(bank, bokf):
+    text = bank["Text"].astype(str)
+    k1_k3 = (text.str.contains(r"BG53782751", case=False, na=False)
+             | text.str.contains(r"BG\s*5341-7689", case=False, na=False)
+             | text.str.contains(r"35\d{10}", regex=True, na=False))
+    want = ref_one_to_one(bank[~k1_k3], bokf, "K4")
+    got = _pairs(*avm.run_category4_ovrigt(bank, bokf, {}))
+    return len(want), sorted(set(want) ^ set(got))  # par som bara finns på ena sidan
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Jämför de snabba algoritmerna mot referensversionerna")
+    ap.add_argument("--rader", type=int, default=20_000, help="ungefärligt antal rader i testdata")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--fall", type=int, default=200, help="antal slumpade fall för MITM/find_removal")
+    ap.add_argument("--data", default="bench_data", help="katalog för genererade indata")
+    ap.add_argument("--referens", default=str(REFERENS), help=".py-fil eller git-revision med referensmodulen")
+    args = ap.parse_args(argv)
+
+    bank_path, bokf_path = make_dataset(args.data, args.rader, "csv", args.seed)
+    paths = {"csv": (bank_path, bokf_path), "xlsx": make_dataset(args.data, args.rader, "xlsx", args.seed)}
+    bank, bokf = avm.load_bank(bank_path, cache=False), avm.load_bokf(bokf_path, cache=False)
+    r = random.Random(args.seed)
+    checks = [
+        ("subset_sum_mitm", lambda: check_mitm(bokf, args.fall, r)),
+        ("find_removal", lambda: check_find_removal(bokf, args.fall, r)),
+        ("K3 (1:1)", lambda: check_k3(bank, bokf)),
+        ("K4 (1:1)", lambda: check_k4(bank, bokf)),
+        ("inkrementell = full", lambda: check_incremental(bank, bokf, r, args.data)),
+        ("workers=2 = seriellt", lambda: check_workers(bank, bokf)),
+    ]
+    ref = load_reference(args.referens)
+    if ref is None:
+        print(f"❌ Referensen {args.referens} kunde inte läsas", file=sys.stderr)
+        return 2
+    checks += [
+        ("inläsning CSV/XLSX", lambda: check_loaders(ref, paths)),
+        ("K1–K5X + Kombinerad + Excel", lambda: check_pipeline(ref, bank_path, bokf_path)),
+    ]
+    failed = 0
+    for name, run in checks:
+        t0 = time.perf_counter()
+        n, bad = run()
+        if bad:
+            failed += 1
+            print(f"❌ {name}: {len(bad)} av {n} skiljer – första: {str(bad[0])[:300]}")
+        else:
+            print(f"✅ {name}: {n} fall lika ({time.perf_counter() - t0:.1f} s)")
+    (rb, rf), (kb, kf), (cb, cf) = k6_report(ref, bank_path, bokf_path)
+    print(f"ℹ️  K6 (jämförs inte): referensen {rb}/{rf} rader (bank/bokf), nu K6 {kb}/{kf}, "
+          f"kandidater ({avm.K6_CANDIDATE_CAT}) {cb}/{cf}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
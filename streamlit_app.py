@@ -1,6 +1,7 @@
+import threading
+import time
+
 import streamlit as st
-from pathlib import Path
-import tempfile
 
 import avstamning_master_kombinerad as avm   # <-- byt namn om din fil heter annorlunda
 
@@ -10,31 +11,67 @@ st.write("Ladda upp kontoutdrag och bokföring (CSV/XLSX). Appen matchar K1–K6
 
 st.caption(f"Laddad modul: {getattr(avm, '__file__', 'okänd')}")
 
+class Job:
+    # Avstämning i en bakgrundstråd. Ligger i session_state, så körningen och resultatet
+    # finns kvar när skriptet körs om (widgetklick, uppdatering av förloppet).
+    def __init__(self, bank_file, bokf_file):
+        self.progress = avm.RunProgress()
+        self.metrics = avm.RunMetrics()
+        self.result = self.error = None
+        self.started = time.monotonic()
+        # Bytes i stället för UploadedFile: tråden ska inte bero på widgetarnas livslängd
+        args = (bank_file.getvalue(), bokf_file.getvalue())
+        self.thread = threading.Thread(target=self._run, args=args, daemon=True)
+        self.thread.start()
+
+    def _run(self, bank, bokf):
+        try:
+            self.result = avm.build_output_excel_bytes(bank, bokf, progress=self.progress, metrics=self.metrics)
+        except avm.RunCancelled:
+            self.error = "Avstämningen avbröts."
+        except Exception as e:
+            self.error = f"Något gick fel: {e}"
+
+    @property
+    def running(self) -> bool:
+        return self.thread.is_alive()
+
 col1, col2 = st.columns(2)
 with col1:
     bank_file = st.file_uploader("Kontoutdrag (Bank)", type=["csv","xlsx","xls"])
 with col2:
     bokf_file = st.file_uploader("Bokföring", type=["csv","xlsx","xls"])
 
-go = st.button("Kör avstämning", type="primary", disabled=not (bank_file and bokf_file))
-
+job = st.session_state.get("job")
+busy = job is not None and job.running
+go = st.button("Kör avstämning", type="primary", disabled=busy or not (bank_file and bokf_file))
 if go:
-    try:
-        with tempfile.TemporaryDirectory() as td:
-            b_path = Path(td) / ("bank" + Path(bank_file.name).suffix or ".xlsx")
-            f_path = Path(td) / ("bokf" + Path(bokf_file.name).suffix or ".xlsx")
-            b_path.write_bytes(bank_file.getbuffer())
-            f_path.write_bytes(bokf_file.getbuffer())
-
-            with st.spinner("Bearbetar…"):
-                xlsx_bytes = avm.build_output_excel_bytes(str(b_path), str(f_path))
+    job = st.session_state["job"] = Job(bank_file, bokf_file)
+    busy = True
 
+if job is not None:
+    if busy:
+        p = job.progress.snapshot()
+        days = f" – dag {p['days_done']}/{p['days_total']}" if p["days_total"] else ""
+        n = lambda v: f"{v:,}".replace(",", " ")
+        st.progress(min(p["fraction"], 1.0),
+                    text=f"{p['step'] or 'Startar'} ({p['step_no']}/{p['steps']}){days} – "
+                         f"matchade rader: bank {n(p['bank_matched'])}, bokföring {n(p['bokf_matched'])}")
+        st.caption(f"Pågått {time.monotonic() - job.started:.0f} s")
+        if st.button("Avbryt", disabled=job.progress.cancelled):
+            job.progress.cancel()
+        time.sleep(0.5)
+        st.rerun()
+    elif job.error:
+        st.error(job.error)
+    else:
         st.success("Klar! Ladda ner resultatet:")
+        if job.metrics.gave_up():
+            st.warning(f"K5X gav upp sökningen på {job.metrics.gave_up()} stora dagar (tidsbudgeten tog slut) – "
+                       "där kan det finnas matchningar som inte hittades. Granska de omatchade dagarna.")
         st.download_button(
             "⬇️ Ladda ner output_avstamning.xlsx",
-            xlsx_bytes,
+            job.result,
             file_name="output_avstamning.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         )
-    except Exception as e:
-        st.error(f"Något gick fel: {e}")
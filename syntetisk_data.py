@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# fil: syntetisk_data.py
+# Syntetiska bank- och bokföringsfiler i exakt den layout som load_bank/load_bokf läser:
+#   BANK_HEADER_ROW resp. BOKF_HEADER_ROW rader försättsblad, rubrikrad med BANK_COLS/BOKF_COLS,
+#   ";"-separerat, svenska belopp ("-1 234,56") och ISO-datum – eller samma sak som .xlsx.
+# Mönster per bankdag (så att alla K-steg får arbete):
+#   K1  BG53782751-inbetalningar mot Inbetalningar (SEB-/Skabank-verifikat, brus som stegen tar bort)
+#   K2  BG 5341-7689 mot 065 BFO (Text1 "Skabank <yymmdd>"), Inbetalningar och Betalningar ±2 dagar
+#   K3  "Betalning 35xxxxxxxxxx" 1:1 mot Betalningar
+#   K4  övriga bankrader 1:1 (kortköp, avgifter, räntor)
+#   K5  LB-utbetalningar mot negativa leverantörsrader
+#   K5X dagsobalans där några bokf- eller bankrader måste bort för att dagen ska gå jämnt upp
+#   K6  belopp som bokförts en dag och reverserats 1–3 dagar senare
+# Kör:  python syntetisk_data.py --rader 100000 --ut bench_data [--format xlsx] [--seed 1]
+
+import argparse
+import datetime as dt
+import random
+from pathlib import Path
+
+from avstamning_master_kombinerad import BANK_COLS, BOKF_COLS, BANK_HEADER_ROW, BOKF_HEADER_ROW
+
+ROWS_PER_DAY = 40  # ungefärligt antal bank+bokf-rader per dag och skalsteg
+
+def sv(x: float) -> str:
+    # Svensk formatering med mellanslag som tusentalsavgränsare
+    return f"{x:,.2f}".replace(",", " ").replace(".", ",")
+
+def generate(n_rows: int, seed: int = 1, days: int = None):
+    """
+    Ca n_rows rader totalt (bank + bokföring). days = antal bankdagar (standard: ett år,
+    färre för små mängder); volymen per dag skalas så att totalen når n_rows.
+    Returnerar (bankrader, bokföringsrader) som listor av dict med kolumnnamn som nycklar.
+    """
+    r = random.Random(seed)
+    days = days or max(5, min(250, n_rows // ROWS_PER_DAY))
+    scale = max(1, round(n_rows / (days * ROWS_PER_DAY)))
+    bank, bokf = [], []
+    start = dt.date(2025, 1, 1)
+    kallor = ["AR", "AP", "GL"]
+
+    def B(d, text, amt):
+        bank.append({"Bokföringsdatum": d.isoformat(), "Text": text, "Belopp": sv(amt), "Referens": "r"})
+    def F(d, kat, amt, vnr="", t1="", ib=""):
+        bokf.append({"Datum": d.isoformat(), "Kategori": kat, "Period SEK": sv(amt), "Verifikationsnummer": vnr,
+                     "Text1": t1, "IB Året SEK": ib, "Källa": r.choice(kallor), "KTO": "1930", "FTG": "10"})
+    money = lambda lo, hi: round(r.uniform(lo, hi), 2)
+
+    day = start
+    for _ in range(days):
+        while day.weekday() >= 5:  # bankdagar
+            day += dt.timedelta(days=1)
+        d, yy = day, day.strftime("%y%m%d")
+
+        # K1: dagens BG53782751-rader summeras mot dagens Inbetalningar
+        if r.random() < 0.85:
+            parts = [money(10, 5000) for _ in range(r.randint(1, 6) * scale)]
+            for chunk in range(0, len(parts), 6):
+                B(d, "BG53782751 inbetalning", round(sum(parts[chunk:chunk + 6]), 2))
+            for p in parts:
+                F(d, r.choice(["Inbetalningar", "inbetalningar "]), p,
+                  vnr=r.choice([f"SEB{r.randint(1, 99999)}", f"Skabank {yy} x"]))
+            for _ in range(r.randint(0, 2)):  # brus: en rad == diff, fel datum i verifikatet …
+                F(d, "Inbetalningar", money(1, 300), vnr=r.choice(["X1", "Skabank 010101", "123456"]))
+
+        # K2: BG 5341-7689 mot 065 BFO / Inbetalningar / Betalningar (±2 dagar)
+        if r.random() < 0.7:
+            parts = [money(10, 3000) for _ in range(r.randint(1, 5))]
+            B(d, "BG 5341-7689 Skabank", round(sum(parts), 2))
+            for p in parts:
+                kind = r.random()
+                if kind < 0.6:
+                    F(d, "065 BFO", p, t1=r.choice([f"Skabank {yy}", f"Skabank {yy} ref"]))
+                elif kind < 0.8:
+                    F(d, "Inbetalningar", p, vnr=f"Skabank {yy}")
+                else:
+                    F(d + dt.timedelta(days=r.randint(-2, 2)), "Betalningar", p, vnr=yy)
+            if r.random() < 0.4:
+                F(d, "065 BFO", money(1, 200), t1=f"Skabank {yy}")
+
+        # K3: 35-referenser 1:1 mot Betalningar
+        for _ in range(r.randint(2, 6) * scale):
+            a = money(-5000, -10)
+            B(d, f"Betalning 35{r.randint(10**9, 10**10 - 1)}", a)
+            if r.random() < 0.9: F(d, "Betalningar", a)
+
+        # K4: övrigt 1:1 (med dubbletter av vanliga belopp)
+        for _ in range(r.randint(2, 8) * scale):
+            a = round(r.choice([r.uniform(-900, 900), 100.0, -250.0]), 2)
+            B(d, r.choice(["Kortköp", "Avgift", "Ränta", "Swish"]), a)
+            if r.random() < 0.85: F(d, r.choice(["Övrigt", "Bank"]), a)
+
+        # K5: LB mot negativa leverantörsrader (+ ibland en positiv rad som måste bort)
+        if r.random() < 0.75:
+            parts = [money(-4000, -10) for _ in range(r.randint(1, 6) * scale)]
+            for chunk in range(0, len(parts), 6):
+                B(d, "LB utbetalning", round(sum(parts[chunk:chunk + 6]), 2))
+            for p in parts: F(d, "Leverantörer", p)
+            if r.random() < 0.4: F(d, "Leverantörer", money(1, 99))
+
+        # K5X: dagsobalans – bokf har några extra rader (eller banken en extra rad)
+        if r.random() < 0.6:
+            parts = [money(-3000, 3000) for _ in range(r.randint(2, 24))]
+            half = len(parts) // 2
+            B(d, "Diverse", round(sum(parts[:half]), 2))
+            B(d, "Diverse 2", round(sum(parts[half:]), 2))
+            for p in parts: F(d, "Div", p)
+            for _ in range(r.randint(0, 2)): F(d, "Div", money(-500, 500))
+            if r.random() < 0.2: B(d, "Diverse 3", money(-800, 800))
+
+        # K6: bokfört en dag, reverserat 1–3 dagar senare
+        if r.random() < 0.3:
+            v = money(1, 900)
+            F(d, "Div", v); F(d + dt.timedelta(days=r.randint(1, 3)), "Div", -v)
+
+        # IB-rader (filtreras bort vid inläsning)
+        if r.random() < 0.1:
+            F(d, "IB", 1.0, ib="123,00")
+        day += dt.timedelta(days=1)
+
+    return bank, bokf
+
+def write_csv(path, rows, cols, header_row):
+    with open(path, "w", encoding="utf-8", newline="") as fh:
+        for k in range(header_row): fh.write(f"Rubrik {k};\n")
+        fh.write(";".join(cols) + "\n")
+        for row in rows:
+            fh.write(";".join(str(row.get(c, "")) for c in cols) + "\n")
+
+def write_xlsx(path, rows, cols, header_row):
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Blad1")
+    for k in range(header_row): ws.append([f"Rubrik {k}"])
+    ws.append(cols)
+    for row in rows:
+        ws.append([row.get(c) or None for c in cols])
+    wb.save(path)
+
+def make_dataset(out_dir, n_rows: int, fmt: str = "csv", seed: int = 1, days: int = None):
+    # Skriver bank_<n>_<seed>.<fmt> och bokf_<n>_<seed>.<fmt> i out_dir (återanvänds om de finns)
+    out = Path(out_dir); out.mkdir(parents=True, exist_ok=True)
+    bank_path = out / f"bank_{n_rows}_{seed}.{fmt}"
+    bokf_path = out / f"bokf_{n_rows}_{seed}.{fmt}"
+    if not (bank_path.exists() and bokf_path.exists()):
+        bank, bokf = generate(n_rows, seed, days)
+        write = write_xlsx if fmt == "xlsx" else write_csv
+        write(bank_path, bank, BANK_COLS, BANK_HEADER_ROW)
+        write(bokf_path, bokf, BOKF_COLS, BOKF_HEADER_ROW)
+    return bank_path, bokf_path
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Skapa syntetiska bank- och bokföringsfiler")
+    ap.add_argument("--rader", type=int, default=10_000, help="ungefärligt antal rader totalt")
+    ap.add_argument("--ut", default="bench_data", help="målkatalog")
+    ap.add_argument("--format", choices=["csv", "xlsx"], default="csv")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--dagar", type=int, default=None, help="antal bankdagar (standard: upp till ett år)")
+    args = ap.parse_args()
+    b, f = make_dataset(args.ut, args.rader, args.format, args.seed, args.dagar)
+    print(f"✅ Skrev: {b}\n✅ Skrev: {f}")